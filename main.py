@@ -1,8 +1,31 @@
-import pandas as pd
-import yaml
-import time
+import io
+
 import streamlit as st
-from PIL import Image
+
+HERO_IMAGE = "assets/jiachen-lin-AIk_5-M9Uho-unsplash.jpg"
+
+
+@st.cache_data
+def load_hero_image(path_filename, max_width=1200):
+    """
+    Function to downscale the hero image once, instead of sending the full-size photo on every rerun
+
+    Args:
+        path_filename [string]: path and filename of the image
+        max_width [int]: width in pixels of the largest rendered image
+
+    Returns:
+        image [bytes]: the resized image, JPEG encoded
+    """
+    # imported on first use, so that the app starts without loading PIL
+    from PIL import Image
+
+    with Image.open(path_filename) as image:
+        image.thumbnail((max_width, max_width))
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, format='JPEG', quality=85, optimize=True)
+    return buffer.getvalue()
+
 
 def main():
     """
@@ -21,9 +44,8 @@ def main():
     # title
     st.title("HDB Resale Transactions (1990-2023)")
 
-    image = Image.open("assets/jiachen-lin-AIk_5-M9Uho-unsplash.jpg")
     st.image(
-        image,
+        load_hero_image(HERO_IMAGE),
         caption="Photo by Jiachen Lin on Unsplash"
     )
     
@@ -1,15 +1,28 @@
 # Script for first page of Streamlit on EDA
+import os
 import pandas as pd
-import yaml
 import streamlit as st
-import plotly.express as px
-
-with open("config.yml", encoding="utf-8", mode='r') as ymlfile:
-    cfg = yaml.load(ymlfile, Loader=yaml.Loader)
-    artifacts_path = cfg['eda']['artifacts_path']
+from src.config import load_config
+from src.preview import paged_dataframe
+from src.instrument import begin_rerun, end_rerun, stage, cached_stage
+from src import query
+from src import serving, warmup, snapshot
+from src.address import address_labels
+from src.cache import shared_result_cache
+
+cfg = load_config()
+artifacts_path = cfg['eda']['artifacts_path']
+log_file = cfg['instrumentation']['log_file']
+debug_panel = cfg['instrumentation']['debug_panel']
+query_backend = cfg['query']['backend']
+serving_mode = cfg['serving']['mode']
+serving_file = cfg['serving']['artifact_file']
+warmup_cfg = cfg['warmup']
+result_cache_cfg = cfg['result_cache']
+address_file = cfg['address']['artifact_file']
 
 # cache data to avoid reloading data
-@st.cache_data(ttl=300)
+@cached_stage("load_parquet", ttl=300)
 def load_parquet(path_filename):
     """
     Loads a Parquet file located at the given path and filename into a pandas DataFrame.
@@ -18,80 +31,137 @@ def load_parquet(path_filename):
     - path_filename: string containing the path and filename of the Parquet file to be loaded
 
     Returns:
-    - pandas DataFrame containing the contents of the Parquet file
+    - pandas DataFrame containing the contents of the Parquet file, in the compact representation of
+      serving.compact_table(): categorical strings and narrowed integers
     """
     
-    # Use pandas' read_parquet() function to load the Parquet file into a DataFrame
-    
-    return pd.read_parquet(path_filename)
+    # Load the Parquet file without creating a Python string per row, recording its version for the result cache;
+    # every session gets its own copy from st.cache_data, so the compact frame also makes each copy cheaper
+    return serving.load_compact_dataset(path_filename)
 
+# in serving mode "mmap" the dataset is mapped once per process and the same frame is shared by every session;
+# the mapping of a replaced snapshot is released once a second newer snapshot has been loaded
+load_mmap = cached_stage("load_mmap", resource=True, max_entries=2)(serving.load_serving_dataset)
 
-@st.cache_data(ttl=300)
-def slice_year_range (df, start_year, end_year):
+@cached_stage("load_warmup", resource=True, ttl=300)
+def load_warmup(path_filename):
     """
-    Filters a pandas DataFrame to include only rows where the value of 'year' column is greater than 
-    the 'start_year' variable and less than the 'end_year' variable.
+    Loads the results precomputed by prepare for the default and popular views. Pages never build them: until
+    prepare or `python -m src.warmup` has written the results of the artifact, every view is computed on demand.
 
     Args:
-    - df: pandas DataFrame with a column named 'year'
+    - path_filename: string containing the path and filename of the Parquet artifact, whose version the results must match
 
     Returns:
-    - pandas DataFrame with only rows where the 'year' value is greater than 'start_year' and less than 'end_year'
+    - dict of the precomputed pandas DataFrames keyed by query spec, None if there are none for the artifact
     """
-    
-    # Filter the DataFrame to only include rows where the 'year' value is greater than 'start_year'
-    # and less than 'end_year'
-    return df.loc[(df['year']>start_year) & (df['year']<end_year)]
+    return warmup.load_warmup_store(
+        f"{artifacts_path}/{warmup_cfg['store_path']}",
+        serving.dataset_version(path_filename)
+    )
 
-@st.cache_data(ttl=300)
-def slice_features(df: pd.DataFrame, sel_flat_type: list, sel_town: list, sel_flat_model: list) -> pd.DataFrame:
+@cached_stage("load_addresses", resource=True, ttl=300)
+def load_addresses(path_filename):
     """
-    Returns a filtered pandas DataFrame containing only the rows with flat types specified in sel_flat_type.
+    Loads the full address of every address id, shared across sessions without copying.
 
     Args:
-        df (pandas.DataFrame): Input DataFrame to filter.
-        sel_flat_type (list): List of flat types to filter the DataFrame.
-        sel_town (list): List of towns to filter the DataFrame.
-        sel_flat_model (list): List of flat models to filter the DataFrame.
+    - path_filename: string containing the path and filename of the address dimension
 
     Returns:
-        pandas.DataFrame: Filtered DataFrame containing only the specified flat types, towns and flat models.
+    - pandas Series of full addresses indexed by address id, or None if prepare() has not written the dimension
     """
-    
-    # Filter the input DataFrame by selecting rows where the 'flat_type' column value is in the list of selected flat types.
-    df_flat_type = df.loc[df['flat_type'].isin(sel_flat_type)]
-    
-    # Filter the df_flat_type by selecting rows where the 'town' column value is in the list of selected towns.
-    df_town = df_flat_type.loc[df_flat_type['town'].isin(sel_town)]
-    
-    # Filter the df_town by selecting rows where the 'flat_model' column value is in the list of selected flat models.
-    df_flat_model = df_town.loc[df_town['flat_model'].isin(sel_flat_model)]
-    
-    # Return the filtered DataFrame.
-    return df_flat_model
+    if not os.path.exists(path_filename):
+        return None
+    return address_labels(pd.read_parquet(path_filename, columns=['address_id', 'full_address']))
+
+def get_result_cache():
+    """
+    Opens the disk-backed result cache shared by every page, session and app process, see src.cache.
+
+    Returns:
+    - ResultCache of the query results, keyed by the version of the artifact they were computed from
+    """
+    return shared_result_cache(
+        f"{artifacts_path}/{result_cache_cfg['cache_dir']}",
+        max_bytes=int(result_cache_cfg['max_mb'] * 1024 ** 2),
+        keep_versions=result_cache_cfg['keep_versions']
+    )
+
+def select_rows(df, filters):
+    """
+    Selects the rows matching the sidebar selection, with their positions cached across sessions and restarts.
+
+    Args:
+    - df: pandas DataFrame of the prepared dataset
+    - filters: dict of the sidebar selection, in the query spec format of src.query
 
-@st.cache_data(ttl=300)
-def plot_transacts(df,col:str):
+    Returns:
+    - pandas DataFrame of the selected rows
+    """
+    with stage("select_rows", rows_in=len(df)) as record:
+        # filtering is shared with the headless query API
+        positions = get_result_cache().fetch(
+            df.attrs.get('dataset_version'),
+            f"rows-{query.spec_key({'filters': filters})}",
+            lambda: query.filter_positions(df, filters)
+        )
+        df_sel = df.take(positions)
+        record['rows_out'] = len(df_sel)
+    return df_sel
+
+@cached_stage("aggregate", ttl=300)
+def aggregate(_df, path_filename, filters, aggregation, _warm=None):
+    """
+    Runs an aggregation of the selected transactions on the query backend chosen in config.yml.
+
+    Args:
+    - _df: pandas DataFrame already filtered by the sidebar selection, aggregated in place by the pandas backend.
+      It is left out of the cache key, which the sidebar selection in 'filters' already determines
+    - path_filename: string containing the path and filename of the Parquet artifact in the published snapshot,
+      so that results are recomputed once a new snapshot is published
+    - filters: dict of the sidebar selection, in the query spec format of src.query
+    - aggregation: dict describing the aggregation, in the query spec format of src.query
+    - _warm: dict of precomputed results from load_warmup(), left out of the cache key
+
+    Returns:
+    - pandas DataFrame with the aggregated values
+    """
+    # the default and popular views are served from the warm-up store without touching the rows
+    key = query.spec_key({'filters': filters, 'aggregation': aggregation})
+    if _warm and key in _warm:
+        return _warm[key]
+
+    def compute():
+        if query_backend == 'pandas':
+            return query.run_query(_df, {'aggregation': aggregation})
+
+        # the other backends query the Parquet artifact directly, with the filters pushed down
+        from src.backends import get_backend
+        backend = get_backend(query_backend, path_filename)
+        return backend.run({'filters': filters, 'aggregation': aggregation})
+
+    # other selections are shared with every session and process through the result cache
+    return get_result_cache().fetch(_df.attrs.get('dataset_version'), f"agg-{key}", compute)
+
+@cached_stage("plot_transacts", ttl=300)
+def plot_transacts(df_transacts, col:str):
     """
     Plots a bar chart of the number of transactions for each type of flat.
 
     Args:
-        df (pandas.DataFrame): A pandas DataFrame containing the data to be plotted. 
-            Must have a 'flat_type' column.
+        df_transacts (pandas.DataFrame): A pandas DataFrame with the number of transactions to be plotted,
+            as returned by the 'count' aggregation. Must have `col` and 'num_transactions' columns.
         
         col (string): a valid string that must match column values of the input dataframe
 
     Returns:
         plotly.graph_objs._figure.Figure: A plotly bar chart figure object.
     """
-    if col in df.columns:
-        # Create a DataFrame grouped by col variable and count the number of transactions for each variable
-        df_transacts = pd.DataFrame(df.groupby([col])[col].count())
-        # Rename the column to 'num_transactions'
-        df_transacts.columns = ['num_transactions']
-        # Sort the DataFrame by number of transactions in descending order
-        df_transacts = df_transacts.sort_values(by=['num_transactions'], ascending=False).reset_index()
+    # imported on first use, so that the app starts without loading the plotting libraries
+    import plotly.express as px
 
+    if col in df_transacts.columns:
         # Create a bar chart using Plotly Express
         fig = px.bar(
             df_transacts, 
@@ -114,6 +184,7 @@ def main():
     """
     First page of Streamlit app to render EDA visualisations
     """
+    begin_rerun("EDA Distribution")
 
     st.set_page_config(
         page_title="Second page of streamlit app",
@@ -123,8 +194,14 @@ def main():
 
     st.title("Exploratory Data Analysis of HDB Resale Transactions")
 
-    # load data artifact
-    df_load = load_parquet(f'{artifacts_path}/hdb_resale.parquet')
+    # load data artifact from the published snapshot; a new snapshot changes the paths, and with them the cache keys
+    snapshot_path = snapshot.current_path(artifacts_path)
+    path_filename = f'{snapshot_path}/hdb_resale.parquet'
+    if serving_mode == 'mmap':
+        df_load = load_mmap(f'{snapshot_path}/{serving_file}')
+    else:
+        df_load = load_parquet(path_filename)
+    warm = load_warmup(path_filename)
 
     # SIDEBAR
     with st.sidebar:
@@ -136,26 +213,26 @@ def main():
         start_year, end_year = st.select_slider(
             "Select range of years",
             options=date_range_lst,
-            value=(date_range_lst[-11],date_range_lst.max())
+            value=(date_range_lst[-min(warmup_cfg['default_years'], len(date_range_lst))],date_range_lst.max())
         )
         st.write('You selected year range between', start_year, 'and', end_year)
 
         # MULTISELECT - FLAT TYPE
-        flat_type_fields = df_load['flat_type'].unique()
+        flat_type_fields = query.distinct_values(df_load, 'flat_type')
         sel_flat_type = st.multiselect(
             "Select flat types",
             options=flat_type_fields
                 )
 
         # MULTISELECT - TOWN
-        town_fields = df_load['town'].unique()
+        town_fields = query.distinct_values(df_load, 'town')
         sel_town = st.multiselect(
                     "Select town",
                     options=town_fields
                 )
         
         # MULTISELECT - FLAT MODEL
-        flat_model_fields = df_load['flat_model'].unique()
+        flat_model_fields = query.distinct_values(df_load, 'flat_model')
         sel_flat_model = st.multiselect(
                     "Select flat model",
                     options=flat_model_fields
@@ -165,38 +242,23 @@ def main():
 
     # END - SIDEBAR
     
-    # slice year range based on user's selected range
-    df_resale = slice_year_range(df_load, start_year=start_year, end_year=end_year)
-
-    # If the selected flat type list is empty, set it to the default list of flat type fields.
-    if len(sel_flat_type) == 0:
-        sel_flat_type = flat_type_fields
-
-    # If the selected town list is empty, set it to the default list of town fields.
-    if len(sel_town) == 0:
-        sel_town = town_fields
-
-    # If the selected flat model list is empty, set it to the default list of flat model fields.
-    if len(sel_flat_model) == 0:
-        sel_flat_model = flat_model_fields
+    # sidebar selection in the query spec format, empty selections meaning every value
+    filters = {
+        'start_year': int(start_year),
+        'end_year': int(end_year),
+        'flat_type': list(sel_flat_type),
+        'town': list(sel_town),
+        'flat_model': list(sel_flat_model)
+    }
+
+    # slice year range and features based on user's selection
+    df_resale = select_rows(df_load, filters)
 
-    # If all three filter lists are empty, create a copy of the input DataFrame.
-    if (len(sel_flat_type) == 0) & (len(sel_town) == 0) & (len(sel_flat_model) == 0):
-        df_resale = df_resale.copy()
-
-    # Otherwise, apply the specified filters to the input DataFrame using the slice_features function.
-    else:
-        df_resale = slice_features(
-                        df_resale, 
-                        sel_flat_type=sel_flat_type, 
-                        sel_town=sel_town, 
-                        sel_flat_model=sel_flat_model)
-        
     # METRICS
     col1, col2, col3 = st.columns(3)
     col1.metric("Total Transactions",len(df_resale))
     col2.metric("Highest Transaction", f"S${int(max(df_resale['resale_price']))}")
-    top_town = pd.DataFrame(df_resale.groupby(['town'])['town'].count()).rename(columns={'town':'count'}).sort_values(by=['count'],ascending=False).iloc[0].name
+    top_town = aggregate(df_resale, path_filename, filters, {'type': 'count', 'by': 'town'}, _warm=warm).iloc[0]['town']
     col3.metric("Most Popular Town",top_town.title())
 
     st.write()
@@ -205,7 +267,9 @@ def main():
 
     # DATAFRAME SNIPPET
     with st.expander("Expand to see snippet of dataframe"):
-        st.dataframe(df_resale[:10000])
+        # transactions only hold address ids, the visible page is labelled with the full addresses
+        labels = load_addresses(f'{snapshot_path}/{address_file}')
+        paged_dataframe(df_resale, key="distribution_preview", labels={'address_id': labels} if labels is not None else None)
 
     tab1, tab2 = st.tabs(["Features", "Resale Price"])
 
@@ -223,8 +287,10 @@ def main():
         )
         # plots for town, flat_type, storey_range and month
         for col in ['town','flat_type','storey_range', 'flat_model','month']:
-            fig_transacts = plot_transacts(df_resale,col)  
-            st.plotly_chart(fig_transacts, use_container_width=True)      
+            df_transacts = aggregate(df_resale, path_filename, filters, {'type': 'count', 'by': col}, _warm=warm)
+            fig_transacts = plot_transacts(df_transacts, col)
+            with stage(f"render {col} chart"):
+                st.plotly_chart(fig_transacts, use_container_width=True)      
 
     with tab2:
         st.markdown(
@@ -266,46 +332,54 @@ def main():
             if add_field != 'None':
                 field_options = st.multiselect(
                     "Choose a maximum of 4 options to be included in the distribution plot",
-                    options=df_resale[add_field].unique(),
+                    options=query.distinct_values(df_resale, add_field),
                     max_selections=4
                 )
 
-        if add_field == 'None':
-            # plot for resale price
-            fig_price = px.histogram(
-                df_resale.sort_values(by='year'),
-                x="resale_price",
-                nbins=bin_width,
-                title='Distribution of Transactions for Resale Price',
-                marginal=dist_type,
-                animation_frame="year",
-                range_x=[df_resale.resale_price.min(), df_resale.resale_price.max()],
-                barmode="overlay",
-            ).update_layout(
-                xaxis_title="Resale Price (S$)",
-                yaxis_title="Frequency",
-            )
-            st.plotly_chart(fig_price, use_container_width=True)
-
-        else:
-
-            df_resale_price = df_resale.loc[df_resale[add_field].isin(field_options)]
-            # plot for resale price
-            fig_price = px.histogram(
-                df_resale_price.sort_values(by='year'),
-                x="resale_price",
-                nbins=bin_width, 
-                title='Distribution of Transactions for Resale Price',
-                color=add_field,
-                marginal=dist_type,
-                animation_frame="year",
-                range_x=[df_resale_price.resale_price.min(), df_resale_price.resale_price.max()],
-                barmode="overlay",
-            ).update_layout(
-                xaxis_title="Resale Price (S$)",
-                yaxis_title="Frequency",
-            )
-            st.plotly_chart(fig_price, use_container_width=True)
+        # build and render the histogram, which is not cached
+        with stage("resale price histogram", rows_in=len(df_resale)):
+            # imported on first use, so that the app starts without loading the plotting libraries
+            import plotly.express as px
+
+            if add_field == 'None':
+                # plot for resale price
+                fig_price = px.histogram(
+                    df_resale.sort_values(by='year'),
+                    x="resale_price",
+                    nbins=bin_width,
+                    title='Distribution of Transactions for Resale Price',
+                    marginal=dist_type,
+                    animation_frame="year",
+                    range_x=[df_resale.resale_price.min(), df_resale.resale_price.max()],
+                    barmode="overlay",
+                ).update_layout(
+                    xaxis_title="Resale Price (S$)",
+                    yaxis_title="Frequency",
+                )
+                st.plotly_chart(fig_price, use_container_width=True)
+
+            else:
+
+                df_resale_price = df_resale.loc[df_resale[add_field].isin(field_options)]
+                # plot for resale price
+                fig_price = px.histogram(
+                    df_resale_price.sort_values(by='year'),
+                    x="resale_price",
+                    nbins=bin_width, 
+                    title='Distribution of Transactions for Resale Price',
+                    color=add_field,
+                    marginal=dist_type,
+                    animation_frame="year",
+                    range_x=[df_resale_price.resale_price.min(), df_resale_price.resale_price.max()],
+                    barmode="overlay",
+                ).update_layout(
+                    xaxis_title="Resale Price (S$)",
+                    yaxis_title="Frequency",
+                )
+                st.plotly_chart(fig_price, use_container_width=True)
+
+    end_rerun(log_file=log_file, debug_panel=debug_panel)
+
 
 if __name__ == "__main__":
     main()
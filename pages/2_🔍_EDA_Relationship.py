@@ -1,16 +1,32 @@
 # Script for second page of Streamlit on EDA
-import pandas as pd
 import numpy as np
-import yaml
+import pandas as pd
 import streamlit as st
-import plotly.express as px
-
-with open("config.yml", encoding="utf-8", mode='r') as ymlfile:
-    cfg = yaml.load(ymlfile, Loader=yaml.Loader)
-    artifacts_path = cfg['eda']['artifacts_path']
+from src.config import load_config
+from src.preview import paged_dataframe
+from src.instrument import begin_rerun, end_rerun, stage, cached_stage
+from src import query
+from src import serving, warmup, snapshot
+from src.cache import shared_result_cache
+from src.timeseries import load_monthly_store, rolling_medians, price_index
+from src import groupstats
+from src.features import BASE_YEAR, order_storey_ranges
+
+cfg = load_config()
+artifacts_path = cfg['eda']['artifacts_path']
+log_file = cfg['instrumentation']['log_file']
+debug_panel = cfg['instrumentation']['debug_panel']
+query_backend = cfg['query']['backend']
+serving_mode = cfg['serving']['mode']
+serving_file = cfg['serving']['artifact_file']
+warmup_cfg = cfg['warmup']
+result_cache_cfg = cfg['result_cache']
+monthly_file = cfg['timeseries']['artifact_file']
+windows = tuple(cfg['timeseries']['windows'])
+group_stats_file = cfg['group_stats']['artifact_file']
 
 # cache data to avoid reloading data
-@st.cache_data(ttl=300)
+@cached_stage("load_parquet", ttl=300)
 def load_parquet(path_filename):
     """
     Loads a Parquet file located at the given path and filename into a pandas DataFrame.
@@ -19,85 +35,105 @@ def load_parquet(path_filename):
     - path_filename: string containing the path and filename of the Parquet file to be loaded
 
     Returns:
-    - pandas DataFrame containing the contents of the Parquet file
+    - pandas DataFrame containing the contents of the Parquet file, in the compact representation of
+      serving.compact_table(): categorical strings and narrowed integers
     """
     
-    # Use pandas' read_parquet() function to load the Parquet file into a DataFrame
-    
-    return pd.read_parquet(path_filename)
-
-@st.cache_data(ttl=300)
-def slice_features(df: pd.DataFrame, sel_flat_type: list, sel_town: list, sel_flat_model: list) -> pd.DataFrame:
+    # Load the Parquet file without creating a Python string per row, recording its version for the result cache;
+    # every session gets its own copy from st.cache_data, so the compact frame also makes each copy cheaper
+    return serving.load_compact_dataset(path_filename)
+# in serving mode "mmap" the dataset is mapped once per process and the same frame is shared by every session;
+# the mapping of a replaced snapshot is released once a second newer snapshot has been loaded
+load_mmap = cached_stage("load_mmap", resource=True, max_entries=2)(serving.load_serving_dataset)
+
+@cached_stage("load_warmup", resource=True, ttl=300)
+def load_warmup(path_filename):
     """
-    Returns a filtered pandas DataFrame containing only the rows with flat types specified in sel_flat_type.
+    Loads the results precomputed by prepare for the default and popular views. Pages never build them: until
+    prepare or `python -m src.warmup` has written the results of the artifact, every view is computed on demand.
 
     Args:
-        df (pandas.DataFrame): Input DataFrame to filter.
-        sel_flat_type (list): List of flat types to filter the DataFrame.
-        sel_town (list): List of towns to filter the DataFrame.
-        sel_flat_model (list): List of flat models to filter the DataFrame.
+    - path_filename: string containing the path and filename of the Parquet artifact, whose version the results must match
 
     Returns:
-        pandas.DataFrame: Filtered DataFrame containing only the specified flat types, towns and flat models.
+    - dict of the precomputed pandas DataFrames keyed by query spec, None if there are none for the artifact
     """
-    
-    # Filter the input DataFrame by selecting rows where the 'flat_type' column value is in the list of selected flat types.
-    df_flat_type = df.loc[df['flat_type'].isin(sel_flat_type)]
-    
-    # Filter the df_flat_type by selecting rows where the 'town' column value is in the list of selected towns.
-    df_town = df_flat_type.loc[df_flat_type['town'].isin(sel_town)]
-    
-    # Filter the df_town by selecting rows where the 'flat_model' column value is in the list of selected flat models.
-    df_flat_model = df_town.loc[df_town['flat_model'].isin(sel_flat_model)]
-    
-    # Return the filtered DataFrame.
-    return df_flat_model
+    return warmup.load_warmup_store(
+        f"{artifacts_path}/{warmup_cfg['store_path']}",
+        serving.dataset_version(path_filename)
+    )
+
+def get_result_cache():
+    """
+    Opens the disk-backed result cache shared by every page, session and app process, see src.cache.
+
+    Returns:
+    - ResultCache of the query results, keyed by the version of the artifact they were computed from
+    """
+    return shared_result_cache(
+        f"{artifacts_path}/{result_cache_cfg['cache_dir']}",
+        max_bytes=int(result_cache_cfg['max_mb'] * 1024 ** 2),
+        keep_versions=result_cache_cfg['keep_versions']
+    )
 
-@st.cache_data(ttl=300)
-def slice_year_range (df, start_year, end_year):
+def select_rows(df, filters):
     """
-    Filters a pandas DataFrame to include only rows where the value of 'year' column is greater than 
-    the 'start_year' variable and less than the 'end_year' variable.
+    Selects the rows matching the sidebar selection, with their positions cached across sessions and restarts.
 
     Args:
-    - df: pandas DataFrame with a column named 'year'
+    - df: pandas DataFrame of the prepared dataset
+    - filters: dict of the sidebar selection, in the query spec format of src.query
 
     Returns:
-    - pandas DataFrame with only rows where the 'year' value is greater than 'start_year' and less than 'end_year'
+    - pandas DataFrame of the selected rows
     """
-    
-    # Filter the DataFrame to only include rows where the 'year' value is greater than 'start_year'
-    # and less than 'end_year'
-    return df.loc[(df['year']>start_year) & (df['year']<end_year)]
+    with stage("select_rows", rows_in=len(df)) as record:
+        # filtering is shared with the headless query API
+        positions = get_result_cache().fetch(
+            df.attrs.get('dataset_version'),
+            f"rows-{query.spec_key({'filters': filters})}",
+            lambda: query.filter_positions(df, filters)
+        )
+        df_sel = df.take(positions)
+        record['rows_out'] = len(df_sel)
+    return df_sel
 
-@st.cache_data(ttl=300)
-def agg_date(df, x_selector, y_selector):
-    """Aggregate the input DataFrame `df` by a given `date_level_selector`.
+@cached_stage("aggregate", ttl=300)
+def aggregate(_df, path_filename, filters, aggregation, _warm=None):
+    """
+    Runs an aggregation of the selected transactions on the query backend chosen in config.yml.
 
     Args:
-        df (pd.DataFrame): Input DataFrame to be aggregated.
-        date_level_selector (str): Column name to group the DataFrame by.
+    - _df: pandas DataFrame already filtered by the sidebar selection, aggregated in place by the pandas backend.
+      It is left out of the cache key, which the sidebar selection in 'filters' already determines
+    - path_filename: string containing the path and filename of the Parquet artifact in the published snapshot,
+      so that results are recomputed once a new snapshot is published
+    - filters: dict of the sidebar selection, in the query spec format of src.query
+    - aggregation: dict describing the aggregation, in the query spec format of src.query
+    - _warm: dict of precomputed results from load_warmup(), left out of the cache key
 
     Returns:
-        pd.DataFrame: Aggregated DataFrame with minimum, maximum, mean and median resale prices
+    - pandas DataFrame with the aggregated values
     """
-    
-    # Group the DataFrame by the given date_level_selector column
-    # and aggregate the resale_price column using different functions
-    df_agg = pd.DataFrame(df
-                .groupby(by=[x_selector])
-                .agg(
-                    min=pd.NamedAgg(column=y_selector, aggfunc='min'),
-                    max=pd.NamedAgg(column=y_selector, aggfunc='max'),
-                    mean=pd.NamedAgg(column=y_selector, aggfunc=lambda x: int(np.mean(x))),
-                    median=pd.NamedAgg(column=y_selector, aggfunc=lambda x: int(np.median(x)))
-                    )
-                ).reset_index()
-    
-    return df_agg
+    # the default and popular views are served from the warm-up store without touching the rows
+    key = query.spec_key({'filters': filters, 'aggregation': aggregation})
+    if _warm and key in _warm:
+        return _warm[key]
+
+    def compute():
+        if query_backend == 'pandas':
+            return query.run_query(_df, {'aggregation': aggregation})
+
+        # the other backends query the Parquet artifact directly, with the filters pushed down
+        from src.backends import get_backend
+        backend = get_backend(query_backend, path_filename)
+        return backend.run({'filters': filters, 'aggregation': aggregation})
+
+    # other selections are shared with every session and process through the result cache
+    return get_result_cache().fetch(_df.attrs.get('dataset_version'), f"agg-{key}", compute)
 
 #
-@st.cache_data(ttl=300)
+@cached_stage("plotly_violin", ttl=300)
 def plotly_violin(df, x_var):
     """Plot a violin plot of resale prices against a specified x-variable.
     
@@ -109,13 +145,18 @@ def plotly_violin(df, x_var):
         fig_violin (plotly.graph_objs._figure.Figure): Plotly figure object of the violin plot.
     """
     # Create a violin plot using Plotly
+    # imported on first use, so that the app starts without loading the plotting libraries
+    import plotly.express as px
+
     fig_violin = px.violin(
         df,                             # Dataframe to use for plotting
         y='resale_price',               # Column containing the resale prices
         x=x_var,                        # Column containing the specified x-variable
         color=x_var,                    # Color data points by the specified x-variable
         title=f"Resale Price and {x_var.replace('_',' ').title()}",    # Title of the plot
-        box=True                        # Show a box plot on top of the violin plot
+        box=True,                       # Show a box plot on top of the violin plot
+        # storey ranges read from the lowest storeys up rather than in the order of the rows
+        category_orders={x_var: order_storey_ranges(df[x_var])} if x_var == 'storey_range' else None
     )
     
     # Update the layout of the plot with axis titles and legend parameters
@@ -132,8 +173,16 @@ def plotly_violin(df, x_var):
     
     return fig_violin    # Return the plotly figure object
 
-@st.cache_data(ttl=300)
+@cached_stage("plotly_bar", ttl=300)
 def plotly_bar (df,x_var,y_var):
+    # imported on first use, so that the app starts without loading the plotting libraries
+    import plotly.express as px
+
+    # bars are ranked by price, except storey ranges, which read from the lowest storeys up
+    xaxis = {'categoryorder':'total descending'}
+    if x_var == 'storey_range':
+        xaxis = {'categoryorder': 'array', 'categoryarray': order_storey_ranges(df[x_var])}
+
     fig_bar = px.bar(
         df, 
         x=x_var,
@@ -141,14 +190,17 @@ def plotly_bar (df,x_var,y_var):
         title=f"{y_var.title()} Resale Price in each {x_var.replace('_',' ').title()}",
         text_auto=True
     ).update_layout(
-        xaxis={'categoryorder':'total descending'},
+        xaxis=xaxis,
         xaxis_title=x_var.replace('_',' ').title(),
         yaxis_title = f"{y_var.title()} Resale Price (S$)"
     )
     return fig_bar
 
-@st.cache_data(ttl=300)
+@cached_stage("plotly_line", ttl=300)
 def plotly_line(df,x_var, y_var):
+            # imported on first use, so that the app starts without loading the plotting libraries
+            import plotly.express as px
+
             fig_line = px.line(
                 df, 
                 x=x_var, 
@@ -161,10 +213,150 @@ def plotly_line(df,x_var, y_var):
 
             return fig_line
 
+@cached_stage("load_monthly", resource=True, ttl=300)
+def load_monthly(path_filename):
+    """
+    Loads the monthly price store, shared across sessions without copying.
+
+    Args:
+    - path_filename: string containing the path and filename of the monthly store
+
+    Returns:
+    - pandas DataFrame of monthly price histograms, or None if the store has not been built
+    - int width of a price bin in S$
+    """
+    return load_monthly_store(path_filename)
+
+@cached_stage("load_stats", resource=True, ttl=300)
+def load_stats(path_filename):
+    """
+    Loads the yearly group statistics, shared across sessions without copying.
+
+    Args:
+    - path_filename: string containing the path and filename of the group statistics
+
+    Returns:
+    - pandas DataFrame of yearly price histograms, or None if the store has not been built
+    - int width of a price bin in S$
+    """
+    return groupstats.load_group_stats(path_filename)
+
+@cached_stage("median_pivot", ttl=300)
+def median_pivot(_df_stats, path_filename, bin_width, filters, columns):
+    """
+    Estimates the median resale price of each town against flat types, flat models or years from the group
+    statistics, so that switching filters never scans the transactions.
+
+    Args:
+    - _df_stats: pandas DataFrame of the group statistics, excluded from the cache key
+    - path_filename: string containing the path and filename of the group statistics in the published snapshot,
+      part of the cache key in place of _df_stats so that a new snapshot is never served stale results
+    - bin_width: int width of a price bin in S$ of the group statistics
+    - filters: dict of the sidebar selection, in the query spec format of src.query
+    - columns: string name of the column whose values become the columns of the heatmap
+
+    Returns:
+    - pandas DataFrame of median resale prices, towns by `columns`
+    """
+    return groupstats.median_pivot(_df_stats, bin_width, filters, index='town', columns=columns)
+
+def heatmap_styles(df_pivot, cmap='YlOrRd', text_color_threshold=0.408):
+    """
+    Colours every cell of the heatmap in one vectorised pass, as Styler.background_gradient would, with
+    empty cells left transparent.
+
+    Args:
+    - df_pivot: pandas DataFrame of the values to colour
+    - cmap: string name of the matplotlib colormap
+    - text_color_threshold: float luminance below which the text of a cell is drawn light
+
+    Returns:
+    - pandas DataFrame of CSS declarations, shaped like df_pivot, for Styler.apply(axis=None)
+    """
+    # imported on first use, so that the app starts without loading the plotting libraries
+    import matplotlib
+
+    values = df_pivot.to_numpy(dtype='float64', na_value=np.nan)
+    is_empty = np.isnan(values)
+    if is_empty.all():
+        return pd.DataFrame('', index=df_pivot.index, columns=df_pivot.columns)
+
+    low, high = np.nanmin(values), np.nanmax(values)
+    scaled = np.nan_to_num((values - low) / (high - low) if high > low else np.zeros_like(values))
+    rgb = matplotlib.colormaps[cmap](scaled)[..., :3]
+
+    # relative luminance of the background decides between dark and light text
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    luminance = linear @ np.array([0.2126, 0.7152, 0.0722])
+
+    packed = (np.round(rgb * 255).astype('int64') * np.array([1 << 16, 1 << 8, 1])).sum(axis=-1)
+    css = np.char.add(
+        np.char.mod('background-color: #%06x; ', packed),
+        np.where(luminance < text_color_threshold, 'color: #f1f1f1', 'color: #000000')
+    )
+    css = np.where(is_empty, 'color: transparent; background-color: transparent', css)
+
+    return pd.DataFrame(css, index=df_pivot.index, columns=df_pivot.columns)
+
+@cached_stage("plot_price_trend", ttl=300)
+def plot_price_trend(_df_monthly, path_filename, bin_width, towns, flat_types, start_month, end_month, window, as_index):
+    """Plot rolling median resale prices, or the price index rebased on them, for each town.
+
+    Args:
+        _df_monthly (pandas.DataFrame): monthly store, excluded from the cache key.
+        path_filename (str): path and filename of the monthly store in the published snapshot, part of the
+            cache key in place of _df_monthly so that a new snapshot is never served stale results.
+        bin_width (int): width of a price bin in S$ of the monthly store.
+        towns (list): towns to plot.
+        flat_types (list): flat types included in each town's series.
+        start_month (int): first month ordinal to plot.
+        end_month (int): last month ordinal to plot.
+        window (int): rolling window in months.
+        as_index (bool): plot the price index instead of the median resale price.
+
+    Returns:
+        fig_trend (plotly.graph_objs._figure.Figure): Plotly figure object of the line plot.
+    """
+    # imported on first use, so that the app starts without loading the plotting libraries
+    import plotly.express as px
+
+    df_rolling = rolling_medians(
+        _df_monthly,
+        bin_width,
+        windows=(window,),
+        by='town',
+        towns=towns,
+        flat_types=flat_types,
+        start_month=start_month,
+        end_month=end_month
+    )
+
+    if as_index:
+        df_plot = price_index(df_rolling, window)
+        y_var, y_title = 'price_index', "Price Index (first month = 100)"
+    else:
+        df_plot = df_rolling
+        y_var, y_title = f'median_{window}m', "Median Resale Price (S$)"
+
+    fig_trend = px.line(
+        df_plot,
+        x='month',
+        y=y_var,
+        color='series',
+        title=f"{window}-Month Rolling {'Price Index' if as_index else 'Median Resale Price'} by Town"
+    ).update_layout(
+        xaxis_title="Month",
+        yaxis_title=y_title,
+        legend={"title": None}
+    )
+
+    return fig_trend
+
 def main():
     """
     First page of Streamlit app to render EDA visualisations
     """
+    begin_rerun("EDA Relationship")
 
     st.set_page_config(
         page_title="Second page of streamlit app",
@@ -174,8 +366,14 @@ def main():
 
     st.title("Understanding the Relationships between Resale Price and other Features")
 
-    # load data artifact
-    df_load = load_parquet(f'{artifacts_path}/hdb_resale.parquet')
+    # load data artifact from the published snapshot; a new snapshot changes the paths, and with them the cache keys
+    snapshot_path = snapshot.current_path(artifacts_path)
+    path_filename = f'{snapshot_path}/hdb_resale.parquet'
+    if serving_mode == 'mmap':
+        df_load = load_mmap(f'{snapshot_path}/{serving_file}')
+    else:
+        df_load = load_parquet(path_filename)
+    warm = load_warmup(path_filename)
 
     # SIDEBAR
     with st.sidebar:
@@ -187,27 +385,27 @@ def main():
         start_year, end_year = st.select_slider(
             "Select range of years",
             options=date_range_lst,
-            value=(date_range_lst[-11],date_range_lst.max())
+            value=(date_range_lst[-min(warmup_cfg['default_years'], len(date_range_lst))],date_range_lst.max())
         )
         st.write('You selected year range between', start_year, 'and', end_year)
 
 
         # MULTISELECT - FLAT TYPE
-        flat_type_fields = df_load['flat_type'].unique()
+        flat_type_fields = query.distinct_values(df_load, 'flat_type')
         sel_flat_type = st.multiselect(
             "Select flat types",
             options=flat_type_fields
                 )
 
         # MULTISELECT - TOWN
-        town_fields = df_load['town'].unique()
+        town_fields = query.distinct_values(df_load, 'town')
         sel_town = st.multiselect(
                     "Select town",
                     options=town_fields
                 )
         
         # MULTISELECT - FLAT MODEL
-        flat_model_fields = df_load['flat_model'].unique()
+        flat_model_fields = query.distinct_values(df_load, 'flat_model')
         sel_flat_model = st.multiselect(
                     "Select flat model",
                     options=flat_model_fields
@@ -215,9 +413,18 @@ def main():
         
         st.write("This dashboard is created by [Leon Sun](https://github.com/leonswl). The source code for this project is published in this [GitHub Repository](https://github.com/leonswl/hdb-resale).")
 
-    # slice year range based on user's selected range
-    df_resale = slice_year_range(df_load, start_year=start_year, end_year=end_year)
-    df_resale = df_resale.copy().drop(['full_address','search_address','lease_commence_date'],axis=1)
+    # sidebar selection in the query spec format, empty selections meaning every value
+    filters = {
+        'start_year': int(start_year),
+        'end_year': int(end_year),
+        'flat_type': list(sel_flat_type),
+        'town': list(sel_town),
+        'flat_model': list(sel_flat_model)
+    }
+
+    # slice year range and features based on user's selection
+    df_resale = select_rows(df_load, filters)
+    df_resale = df_resale.drop(['address_id','lease_commence_date'],axis=1)
 
     # If the selected flat type list is empty, set it to the default list of flat type fields.
     if len(sel_flat_type) == 0:
@@ -231,18 +438,6 @@ def main():
     if len(sel_flat_model) == 0:
         sel_flat_model = flat_model_fields
 
-    # If all three filter lists are empty, create a copy of the input DataFrame.
-    if (len(sel_flat_type) == 0) & (len(sel_town) == 0) & (len(sel_flat_model) == 0):
-        df_resale = df_resale.copy()
-
-    # Otherwise, apply the specified filters to the input DataFrame using the slice_features function.
-    else:
-        df_resale = slice_features(
-                        df_resale, 
-                        sel_flat_type=sel_flat_type, 
-                        sel_town=sel_town, 
-                        sel_flat_model=sel_flat_model)
-
     st.markdown(
             """
             I'll investigate how resale price changes with the various features:
@@ -257,7 +452,7 @@ def main():
         )
 
     with st.expander("Expand"):
-        st.dataframe(df_resale)
+        paged_dataframe(df_resale, key="relationship_preview")
     
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -284,78 +479,130 @@ def main():
         st.write(f"You selected: {select_flat_type}")
     
     # Create 2 tabs
-    tab1, tab2 = st.tabs(['univariate','multivariate'])
+    tab1, tab2, tab3 = st.tabs(['univariate','multivariate','price index'])
 
     with tab1:
         # LINE PLOT - resale price against TIME
         # slice dataframe based on users' selected date level (month or year) and aggregate them
-        df_price_date = agg_date(df_resale, x_selector=x_date_select, y_selector='resale_price')
+        df_price_date = aggregate(df_resale, path_filename, filters, {'type': 'agg', 'by': x_date_select, 'value': 'resale_price'}, _warm=warm)
         fig_price_date = plotly_line(df_price_date, x_date_select, y_aggregation_select)
         st.plotly_chart(fig_price_date, use_container_width=True)
 
         # BAR & VIOLIN PLOTS - resale price and TOWN
         # slice dataframe based on town and aggregate them
-        df_price_town = agg_date(df_resale, x_selector='town', y_selector='resale_price')
+        df_price_town = aggregate(df_resale, path_filename, filters, {'type': 'agg', 'by': 'town', 'value': 'resale_price'}, _warm=warm)
         fig_price_town_bar = plotly_bar(df_price_town,x_var='town',y_var=y_aggregation_select)
         fig_price_town_violin = plotly_violin(df_resale, x_var='town')
 
         # BAR & VIOLIN PLOTS - resale price and FLAT TYPE
         # # slice dataframe based on  flat type and aggregate them
-        df_price_flat_type = agg_date(df_resale, x_selector='flat_type', y_selector='resale_price')
+        df_price_flat_type = aggregate(df_resale, path_filename, filters, {'type': 'agg', 'by': 'flat_type', 'value': 'resale_price'}, _warm=warm)
         fig_price_flat_type_bar = plotly_bar(df_price_flat_type, x_var='flat_type',y_var=y_aggregation_select)
         fig_price_flat_type_violin = plotly_violin(df_resale, x_var='flat_type')
         
         # BAR & VIOLIN PLOTS - resale price and STOREY RANGE
         # slice dataframe based on storey range and aggregate them
-        df_price_storey_range = agg_date(df_resale, x_selector='storey_range', y_selector='resale_price')
+        df_price_storey_range = aggregate(df_resale, path_filename, filters, {'type': 'agg', 'by': 'storey_range', 'value': 'resale_price'}, _warm=warm)
         fig_price_storey_range_bar = plotly_bar(df_price_storey_range, x_var='storey_range', y_var=y_aggregation_select)
         fig_price_storey_range_violin = plotly_violin(df_resale, x_var='storey_range')
 
         # Render BAR or VIOLIN/BOX plots depending on users' selection
-        if select_flat_type == "Bar":
-            st.plotly_chart(fig_price_town_bar, use_container_width=True) # render on streamlit
-            st.plotly_chart(fig_price_flat_type_bar, use_container_width=True) # render on streamlit
-            st.plotly_chart(fig_price_storey_range_bar, use_container_width=True) # render on streamliT
-        else:
-            st.plotly_chart(fig_price_town_violin, use_container_width=True) # render TOWN on streamlit
-            st.plotly_chart(fig_price_flat_type_violin, use_container_width=True) # render FLAT TYPE on streamlit
-            st.plotly_chart(fig_price_storey_range_violin, use_container_width=True) # render STOREY RANGE on streamlit
+        with stage("render price charts"):
+            if select_flat_type == "Bar":
+                st.plotly_chart(fig_price_town_bar, use_container_width=True) # render on streamlit
+                st.plotly_chart(fig_price_flat_type_bar, use_container_width=True) # render on streamlit
+                st.plotly_chart(fig_price_storey_range_bar, use_container_width=True) # render on streamliT
+            else:
+                st.plotly_chart(fig_price_town_violin, use_container_width=True) # render TOWN on streamlit
+                st.plotly_chart(fig_price_flat_type_violin, use_container_width=True) # render FLAT TYPE on streamlit
+                st.plotly_chart(fig_price_storey_range_violin, use_container_width=True) # render STOREY RANGE on streamlit
 
         # LINE PLOT - resale price and FLOOR AREA
         # slice dataframe based on floor_area_sqm and aggregate them
-        df_price_area = agg_date(df_resale, x_selector='floor_area_sqm', y_selector='resale_price')
+        df_price_area = aggregate(df_resale, path_filename, filters, {'type': 'agg', 'by': 'floor_area_sqm', 'value': 'resale_price'}, _warm=warm)
         fig_price_area = plotly_line(df_price_area, 'floor_area_sqm', y_aggregation_select)
         st.plotly_chart(fig_price_area, use_container_width=True) # render on streamlit
 
         # LINE PLOT - resale price against REMAINING LEASE
         # slice dataframe based on remaining lease and aggregate them
-        df_price_lease = agg_date(df_resale, x_selector='remaining_lease', y_selector='resale_price')
+        df_price_lease = aggregate(df_resale, path_filename, filters, {'type': 'agg', 'by': 'remaining_lease', 'value': 'resale_price'}, _warm=warm)
         fig_price_lease = plotly_line(df_price_lease, 'remaining_lease',y_aggregation_select)
         st.plotly_chart(fig_price_lease, use_container_width=True) # render on streamlit
 
     with tab2:
-        # DATAFRAME - median resale price breakdown by flat types
-        with pd.option_context("display.float_format", "${:,.2f}".format):
-            resale_price_table = df_resale.groupby(["town", "flat_type"]).resale_price.median().reset_index()
-            resale_price_pivot = pd.pivot(resale_price_table, index="town", columns="flat_type", values="resale_price")
-            # resale_table_columns = ["1 ROOM", "2 ROOM", "3 ROOM", "4 ROOM", "5 ROOM", "EXECUTIVE", "MULTI-GENERATION"]
-            resale_table_columns = df_resale['flat_type'].unique()
-        st.markdown("#### Median Resale Price Across Towns and Flat Types")
+        # DATAFRAME - median resale price breakdown by flat types, flat models or years
+        pivot_columns = st.radio(
+            "Break down towns by",
+            options=('flat_type', 'flat_model', 'year'),
+            format_func=lambda col: col.replace('_', ' ').title(),
+            horizontal=True
+        )
+        with stage("median price heatmap", rows_in=len(df_resale)):
+            df_stats, stats_bin_width = load_stats(f'{snapshot_path}/{group_stats_file}')
+            if df_stats is not None:
+                resale_price_pivot = median_pivot(
+                    df_stats, f'{snapshot_path}/{group_stats_file}', stats_bin_width, filters, pivot_columns
+                )
+            else:
+                # without the group statistics, the medians are computed from the selected transactions
+                resale_price_pivot = aggregate(
+                    df_resale, path_filename, filters, {'type': 'median_pivot', 'by': 'town', 'columns': pivot_columns, 'value': 'resale_price'},
+                    _warm=warm
+                ).set_index('town')
+            resale_price_styles = heatmap_styles(resale_price_pivot)
+        st.markdown(f"#### Median Resale Price Across Towns and {pivot_columns.replace('_',' ').title()}s")
         st.dataframe(
-            resale_price_pivot.style.background_gradient(
-                    axis=None,
-                    subset=resale_table_columns, 
-                    vmin=resale_price_table.resale_price.min(),
-                    cmap='YlOrRd'
+            resale_price_pivot.style.apply(
+                    lambda _: resale_price_styles, axis=None
                 ).format(
                     na_rep="-",
                     precision=0,
                     thousands=","
-                ).applymap(
-                    lambda x: 'color: transparent; background-color: transparent' if pd.isnull(x) else ''
                 ),
             use_container_width=True)
+        if df_stats is not None:
+            st.caption(f"Medians are estimated from S${stats_bin_width:,} price bins of the precomputed group statistics.")
+
+    with tab3:
+        # LINE PLOT - rolling median resale price or price index, served from the monthly store
+        df_monthly, bin_width = load_monthly(f'{snapshot_path}/{monthly_file}')
+
+        if df_monthly is None:
+            st.info("The monthly price store has not been built yet, run `python -m src.prepare` to create it.")
+        else:
+            col1, col2 = st.columns(2)
+            with col1:
+                # RADIO SELECT - ROLLING WINDOW
+                window = st.radio(
+                    "Select rolling window (months)",
+                    options=windows,
+                    index=len(windows) - 1,
+                    horizontal=True
+                )
+            with col2:
+                # RADIO SELECT - MEASURE
+                measure = st.radio(
+                    "Select measure",
+                    options=("Median Resale Price", "Price Index"),
+                    horizontal=True
+                )
+
+            fig_trend = plot_price_trend(
+                df_monthly,
+                f'{snapshot_path}/{monthly_file}',
+                bin_width,
+                towns=list(sel_town),
+                flat_types=list(sel_flat_type),
+                start_month=(int(start_year) + 1 - BASE_YEAR) * 12,
+                end_month=(int(end_year) - BASE_YEAR) * 12 - 1,
+                window=window,
+                as_index=measure == "Price Index"
+            )
+            st.plotly_chart(fig_trend, use_container_width=True)
+            st.caption("Medians are estimated from monthly price histograms and are not filtered by flat model.")
+
+    end_rerun(log_file=log_file, debug_panel=debug_panel)
 
 
 if __name__ == "__main__":
-    main()
+    main()
\ No newline at end of file
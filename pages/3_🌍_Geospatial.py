@@ -1,17 +1,23 @@
 # Script for geospatial analysis page Streamlit
-import pandas as pd
-import yaml
+import os
 import streamlit as st
-import pydeck as pdk
+from src.config import load_config
+from src.preview import paged_dataframe
+from src.instrument import begin_rerun, end_rerun, stage, cached_stage
+from src import query, serving, snapshot
+from src.features import materialize_features
 
-with open("config.yml", encoding="utf-8", mode='r') as ymlfile:
-    cfg = yaml.load(ymlfile, Loader=yaml.Loader)
-    artifacts_path = cfg['eda']['artifacts_path']
-    artifact_file = cfg['geospatial']['artifact_file']
+cfg = load_config()
+artifacts_path = cfg['eda']['artifacts_path']
+log_file = cfg['instrumentation']['log_file']
+debug_panel = cfg['instrumentation']['debug_panel']
+artifact_file = cfg['geospatial']['artifact_file']
+seed_file = cfg['geocode']['seed_file']
+default_years = cfg['geospatial']['default_years']
 
 
 # cache data to avoid reloading data
-@st.cache_data(ttl=300)
+@cached_stage("load_clean_parquet", ttl=300)
 def load_clean_parquet(path_filename):
     """
     Load a parquet file into a Pandas DataFrame, rename the columns 'Lat' and 'Lon' to 'lat' and 'lon' respectively, 
@@ -24,8 +30,9 @@ def load_clean_parquet(path_filename):
     Pandas DataFrame: A cleaned DataFrame with non-missing values and renamed columns.
     """
 
-    # Load the parquet file into a DataFrame using Pandas' read_parquet function
-    df = pd.read_parquet(path_filename).drop(['Unnamed: 0','block','street_name','search_address','full_address'],axis=1)
+    # Load the parquet file into a DataFrame in the compact representation, as the geocoded transactions span every year
+    # the address columns of earlier geocoding runs were replaced by the address id of the address dimension
+    df = serving.load_compact_dataset(path_filename).drop(['Unnamed: 0','block','street_name','search_address','full_address','location','address_id'],axis=1,errors='ignore')
     
     # Rename the 'Lat' and 'Lon' columns to 'lat' and 'lon' respectively
     df_coord = df.rename(columns={'Lat':'lat','Lon':'lon'})
@@ -33,59 +40,21 @@ def load_clean_parquet(path_filename):
     # Drop any rows with missing values
     df_coord_dropna = df_coord.dropna()
 
-    # create year column
-    df_coord_dropna['year'] = df_coord_dropna['month'].apply(lambda x: int(x.split('-')[0]))
+    # artifacts written before the feature stage existed lack the derived columns, so materialize them once on load
+    if 'resale_price_thousands' not in df_coord_dropna.columns:
+        df_coord_dropna = materialize_features(df_coord_dropna.copy())
 
     # Return the cleaned DataFrame
     return df_coord_dropna
 
 
 
-@st.cache_data(ttl=300)
-def slice_features(df: pd.DataFrame, sel_flat_type: list, sel_town: list, sel_flat_model: list) -> pd.DataFrame:
-    """
-    Returns a filtered pandas DataFrame containing only the rows with flat types specified in sel_flat_type.
+# filtering and aggregation are shared with the headless query API
+slice_features = cached_stage("slice_features", ttl=300)(query.slice_features)
+slice_year_range = cached_stage("slice_year_range", ttl=300)(query.slice_year_range)
 
-    Args:
-        df (pandas.DataFrame): Input DataFrame to filter.
-        sel_flat_type (list): List of flat types to filter the DataFrame.
-        sel_town (list): List of towns to filter the DataFrame.
-        sel_flat_model (list): List of flat models to filter the DataFrame.
 
-    Returns:
-        pandas.DataFrame: Filtered DataFrame containing only the specified flat types, towns and flat models.
-    """
-    
-    # Filter the input DataFrame by selecting rows where the 'flat_type' column value is in the list of selected flat types.
-    df_flat_type = df.loc[df['flat_type'].isin(sel_flat_type)]
-    
-    # Filter the df_flat_type by selecting rows where the 'town' column value is in the list of selected towns.
-    df_town = df_flat_type.loc[df_flat_type['town'].isin(sel_town)]
-    
-    # Filter the df_town by selecting rows where the 'flat_model' column value is in the list of selected flat models.
-    df_flat_model = df_town.loc[df_town['flat_model'].isin(sel_flat_model)]
-    
-    # Return the filtered DataFrame.
-    return df_flat_model
-
-@st.cache_data(ttl=300)
-def slice_year_range (df, start_year, end_year):
-    """
-    Filters a pandas DataFrame to include only rows where the value of 'year' column is greater than 
-    the 'start_year' variable and less than the 'end_year' variable.
-
-    Args:
-    - df: pandas DataFrame with a column named 'year'
-
-    Returns:
-    - pandas DataFrame with only rows where the 'year' value is greater than 'start_year' and less than 'end_year'
-    """
-    
-    # Filter the DataFrame to only include rows where the 'year' value is greater than 'start_year'
-    # and less than 'end_year'
-    return df.loc[(df['year']>start_year) & (df['year']<end_year)]
-
-@st.cache_data(ttl=300)
+@cached_stage("find_sg_coord", ttl=300)
 def find_sg_coord(df):
     """
     Function to exclude non-singapore coordinates from dataframe
@@ -99,11 +68,9 @@ def find_sg_coord(df):
     df = df.loc[(df['lat'] > 1.0) & (df['lat'] < 1.5)] # isolate lat values
     df = df.loc[(df['lon'] > 101) & (df['lon'] < 106)] # isolate lon values
 
-    df['resale_price_thousands'] = df['resale_price'] / 1000
-
     return df
 
-@st.cache_data(ttl=300)
+@cached_stage("select_elevation_var", ttl=300)
 def select_elevation_var(input_elevation_var):
     """
     Given a string representing an elevation variable, returns a standardized version of the variable name.
@@ -131,6 +98,9 @@ def select_elevation_var(input_elevation_var):
     return elevation_var
 
 def pydeck (df, elevation_var):
+    # imported on first use, so that the app starts without loading the plotting libraries
+    import pydeck as pdk
+
     INITIAL_VIEW_STATE = pdk.ViewState(
         latitude=1.25,
         longitude=103.8,
@@ -168,40 +138,56 @@ def pydeck (df, elevation_var):
     return layers, INITIAL_VIEW_STATE
 
 def main():
+    begin_rerun("Geospatial")
+
     st.set_page_config(
         page_title="Geospatial Visualisation",
         page_icon='🌍'
     )
 
-    # Load and prepare dataset for geospatial visualisation
-    df_load = load_clean_parquet(f'{artifacts_path}/{artifact_file}')
+    # Load and prepare dataset for geospatial visualisation, from the published snapshot; until python -m src.geocode
+    # has published the geocoded transactions of every year, the 2015 transactions geocoded earlier are shown
+    path_filename = f'{snapshot.current_path(artifacts_path)}/{artifact_file}'
+    df_load = load_clean_parquet(path_filename if os.path.exists(path_filename) else seed_file)
 
     #  include only sg coordinates
     df_coord_sg = find_sg_coord(df_load)
 
     # SIDEBAR
     with st.sidebar:
+
+        # SELECT_SLIDER - YEAR RANGE
+        date_range_lst = df_coord_sg.year.unique()
+        date_range_lst.sort()
+
+        start_year, end_year = st.select_slider(
+            "Select range of years",
+            options=date_range_lst,
+            value=(date_range_lst[-min(default_years, len(date_range_lst))],date_range_lst.max())
+        )
+        st.write('You selected year range between', start_year, 'and', end_year)
+
         input_elevation_var = st.selectbox(
             "Select field for Elevation",
             ('Resale Price','Floor Area (sqm)','Remaining Lease')
         )
 
         # MULTISELECT - FLAT TYPE
-        flat_type_fields = df_coord_sg['flat_type'].unique()
+        flat_type_fields = query.distinct_values(df_coord_sg, 'flat_type')
         sel_flat_type = st.multiselect(
             "Select flat types",
             options=flat_type_fields
                 )
 
         # MULTISELECT - TOWN
-        town_fields = df_coord_sg['town'].unique()
+        town_fields = query.distinct_values(df_coord_sg, 'town')
         sel_town = st.multiselect(
                     "Select town",
                     options=town_fields
                 )
         
         # MULTISELECT - FLAT MODEL
-        flat_model_fields = df_coord_sg['flat_model'].unique()
+        flat_model_fields = query.distinct_values(df_coord_sg, 'flat_model')
         sel_flat_model = st.multiselect(
                     "Select flat model",
                     options=flat_model_fields
@@ -211,7 +197,9 @@ def main():
 
     # END - SIDEBAR 
 
-    # slice year range based on
+    # slice year range based on the selected years, whose bounds are included
+    df_coord_sg = slice_year_range(df_coord_sg, int(start_year) - 1, int(end_year) + 1)
+
     # If the selected flat type list is empty, set it to the default list of flat type fields.
     if len(sel_flat_type) == 0:
         sel_flat_type = flat_type_fields
@@ -239,7 +227,7 @@ def main():
 
     # MAIN PAGE
 
-    st.title("Geospatial Visualisation of HDB resale transactions in 2015")
+    st.title(f"Geospatial Visualisation of HDB resale transactions from {start_year} to {end_year}")
     
     # Streamlit Map
     st.markdown(
@@ -250,7 +238,8 @@ def main():
         """
     )
 
-    st.map(df_resale[["lat","lon"]])
+    with stage("render scatter map", rows_in=len(df_resale)):
+        st.map(df_resale[["lat","lon"]])
 
     st.markdown(
         """
@@ -269,19 +258,23 @@ def main():
 
     token = st.secrets["token"]
 
-    st.pydeck_chart(
-            pdk.Deck(
-                api_keys={'mapbox':token},
-                initial_view_state=initial_view_state, 
-                layers=layers,
-                tooltip={
-                    'html': '<b>Flat Model:</b> {flat_model} <br> <b>Flat Type: </b> {flat_type} <br> <b>Town: </b> {town} <br> <b>Resale Price: S$</b> {resale_price} <br> <b>Storey Range: </b> {storey_range} <br> <b>Floor Area (sqm): </b> {floor_area_sqm} <br> <b>Remaining Lease :</b> {remaining_lease}', 
-                    'style': {
-                        'color': 'white'
+    with stage("render pydeck chart", rows_in=len(df_resale)):
+        # imported on first use, so that the app starts without loading the plotting libraries
+        import pydeck as pdk
+
+        st.pydeck_chart(
+                pdk.Deck(
+                    api_keys={'mapbox':token},
+                    initial_view_state=initial_view_state, 
+                    layers=layers,
+                    tooltip={
+                        'html': '<b>Flat Model:</b> {flat_model} <br> <b>Flat Type: </b> {flat_type} <br> <b>Town: </b> {town} <br> <b>Resale Price: S$</b> {resale_price} <br> <b>Storey Range: </b> {storey_range} <br> <b>Floor Area (sqm): </b> {floor_area_sqm} <br> <b>Remaining Lease :</b> {remaining_lease}', 
+                        'style': {
+                            'color': 'white'
+                        }
                     }
-                }
+                )
             )
-        )
     
     
     with st.expander("Expand to see more about the data"):
@@ -290,7 +283,7 @@ def main():
             ### Dataframe Snippet
             """
         )
-        st.dataframe(df_resale[:10000])
+        paged_dataframe(df_resale, key="geospatial_preview")
 
 
         # st.markdown(
@@ -304,5 +297,8 @@ def main():
 
     
 
+    end_rerun(log_file=log_file, debug_panel=debug_panel)
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,181 @@
+# Script for fair price page Streamlit
+import numpy as np
+import pandas as pd
+import streamlit as st
+from src.config import load_config
+from src.instrument import begin_rerun, end_rerun, stage, cached_stage
+from src import model, snapshot
+
+cfg = load_config()
+artifacts_path = cfg['eda']['artifacts_path']
+log_file = cfg['instrumentation']['log_file']
+debug_panel = cfg['instrumentation']['debug_panel']
+model_cfg = cfg['model']
+
+# labels of the model terms in the breakdown of a fair price
+TERM_LABELS = {
+    'town': 'Town',
+    'flat_type': 'Flat type',
+    'flat_model': 'Flat model',
+    'month': 'Month',
+    'storey_mid': 'Storey',
+    'floor_area_sqm': 'Floor area',
+    'remaining_lease': 'Remaining lease'
+}
+
+
+@cached_stage("load_model", resource=True, ttl=300)
+def load_model(path_filename):
+    """
+    Loads the coefficients of the hedonic price model fitted by prepare(), shared across sessions without copying.
+
+    Args:
+    - path_filename: string containing the path and filename of the model
+
+    Returns:
+    - pandas DataFrame of the coefficients, or None if the model has not been fitted
+    - dict of the fit summary
+    """
+    return model.load_model(path_filename)
+
+
+def levels(df_coef, feature):
+    """
+    Lists the levels of a categorical feature the model was fitted on.
+
+    Args:
+    - df_coef: pandas DataFrame of the coefficients
+    - feature: name of the categorical feature
+
+    Returns:
+    - list of the levels, in sorted order
+    """
+    return df_coef.loc[df_coef['feature'] == feature, 'level'].tolist()
+
+
+def term_effects(df_coef, df_terms):
+    """
+    Expresses each term of a flat's log price as its effect on the price, relative to a flat with the average
+    value of that feature over the training transactions.
+
+    Args:
+    - df_coef: pandas DataFrame of the coefficients
+    - df_terms: pandas DataFrame of the terms of one flat, from src.model.score_terms()
+
+    Returns:
+    - pandas DataFrame with the percentage effect of each feature
+    """
+    effects = []
+    for feature, label in TERM_LABELS.items():
+        df_feature = df_coef.loc[df_coef['feature'] == feature]
+        # numeric features are centred, categorical levels are weighed by their number of transactions
+        baseline = 0.0 if feature in model.NUMERIC_FEATURES else np.average(df_feature['coef'], weights=df_feature['rows'])
+        effects.append({'Feature': label, 'Effect (%)': 100 * np.expm1(df_terms[feature].iat[0] - baseline)})
+    return pd.DataFrame(effects)
+
+
+def main():
+    """
+    Fourth page of Streamlit app to score the fair price of a hypothetical flat
+    """
+    begin_rerun("Fair Price")
+
+    st.set_page_config(
+        page_title="Fair Price",
+        page_icon='💰'
+    )
+
+    st.title("Fair Price of a Resale Flat")
+
+    df_coef, summary = load_model(f"{snapshot.current_path(artifacts_path)}/{model_cfg['artifact_file']}")
+    if df_coef is None:
+        st.info("The price model has not been fitted yet, run `python -m src.prepare` to fit it.")
+        end_rerun(log_file=log_file, debug_panel=debug_panel)
+        return
+
+    numeric = df_coef.loc[df_coef['feature'].isin(model.NUMERIC_FEATURES)].set_index('feature')
+    months = levels(df_coef, 'month')
+
+    # SIDEBAR
+    with st.sidebar:
+        town = st.selectbox("Select town", levels(df_coef, 'town'))
+        flat_types = levels(df_coef, 'flat_type')
+        flat_type = st.selectbox("Select flat type", flat_types, index=flat_types.index('4 ROOM') if '4 ROOM' in flat_types else 0)
+        flat_model = st.selectbox("Select flat model", levels(df_coef, 'flat_model'))
+        storey = st.slider(
+            "Select storey",
+            min_value=int(numeric.at['storey_mid', 'min']),
+            max_value=int(numeric.at['storey_mid', 'max']),
+            value=int(round(numeric.at['storey_mid', 'mean']))
+        )
+        floor_area = st.slider(
+            "Select floor area (sqm)",
+            min_value=int(numeric.at['floor_area_sqm', 'min']),
+            max_value=int(numeric.at['floor_area_sqm', 'max']),
+            value=int(round(numeric.at['floor_area_sqm', 'mean']))
+        )
+        remaining_lease = st.slider(
+            "Select remaining lease (years)",
+            min_value=int(numeric.at['remaining_lease', 'min']),
+            max_value=int(numeric.at['remaining_lease', 'max']),
+            value=int(round(numeric.at['remaining_lease', 'mean']))
+        )
+        month = st.select_slider("Select month of sale", options=months, value=months[-1])
+
+        st.write("This dashboard is created by [Leon Sun](https://github.com/leonswl). The source code for this project is published in this [GitHub Repository](https://github.com/leonswl/hdb-resale).")
+
+    # END - SIDEBAR
+
+    flat = pd.DataFrame([{
+        'town': town,
+        'flat_type': flat_type,
+        'flat_model': flat_model,
+        'month': month,
+        'storey_mid': storey,
+        'floor_area_sqm': floor_area,
+        'remaining_lease': remaining_lease
+    }])
+
+    # scoring reads only the stored coefficients, so every change of the sidebar is answered instantly
+    with stage("score fair price", rows_in=1):
+        df_price = model.fair_price(df_coef, flat, summary['rmse'], coverage=model_cfg['coverage'])
+        df_terms = model.score_terms(df_coef, flat)
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Fair price", f"S${df_price['fair_price'].iat[0]:,.0f}")
+    col2.metric("Low", f"S${df_price['low'].iat[0]:,.0f}")
+    col3.metric("High", f"S${df_price['high'].iat[0]:,.0f}")
+    st.caption(
+        f"About {model_cfg['coverage']:.0%} of comparable transactions sold between the low and high prices. "
+        f"The model explains {summary['r2']:.1%} of the variation in log resale prices over {summary['rows']:,} transactions."
+    )
+
+    st.markdown(
+        """
+        ### What drives the price
+
+        Effect of each feature on the fair price, compared with a flat of the average town, flat type, flat model,
+        month, storey, floor area and remaining lease of all transactions.
+        """
+    )
+    with stage("render price drivers", rows_in=len(TERM_LABELS)):
+        st.bar_chart(term_effects(df_coef, df_terms).set_index('Feature'))
+
+    st.markdown(
+        """
+        ### Fair price over time
+
+        Fair price of the same flat had it been sold in every month of the history.
+        """
+    )
+    with stage("render price history", rows_in=len(months)):
+        df_history = flat.drop(columns='month').merge(pd.DataFrame({'month': months}), how='cross')
+        df_history = model.fair_price(df_coef, df_history, summary['rmse'], coverage=model_cfg['coverage'])
+        df_history.index = pd.to_datetime(months)
+        st.line_chart(df_history.rename(columns={'fair_price': 'Fair price', 'low': 'Low', 'high': 'High'}))
+
+    end_rerun(log_file=log_file, debug_panel=debug_panel)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .validation import ADDRESS_COLS
+
+ADDRESS_DTYPES = {
+    'address_id': 'int32',
+    'block': object,
+    'street_name': object,
+    'full_address': object,
+    'search_address': object,
+    'lat': 'float64',
+    'lon': 'float64',
+    # looked up by geocoding, whether or not coordinates were found
+    'geocoded': bool
+}
+
+
+def factorize_normalized(values: pd.Series):
+    """
+    Function to factorize address parts after normalizing their case and whitespace
+
+    Only the distinct values are normalized, so the cost does not grow with the number of transactions.
+
+    Args:
+        values [series]: blocks or street names as published
+
+    Returns:
+        codes [np.ndarray]: position of each value in `uniques`, -1 where missing
+        uniques [np.ndarray]: distinct normalized values
+
+    """
+    codes, uniques = pd.factorize(values)
+    normalized = pd.Series(uniques, dtype=object).astype(str).str.upper().str.split().str.join(' ')
+    norm_codes, norm_uniques = pd.factorize(normalized)
+    # missing values keep the code -1 through the appended marker
+    return np.append(norm_codes, -1)[codes], np.asarray(norm_uniques, dtype=object)
+
+
+class AddressIndex:
+    """
+    Dimension table of the addresses of resale transactions, one row per normalized (block, street_name)
+
+    Transactions store the int32 `address_id` of their address instead of address strings. Ids are assigned in
+    order of first appearance and never change, so a dimension loaded from a previous run keeps its ids, and
+    the coordinates found by geocoding, while new addresses are appended.
+
+    Args:
+        df_addresses [dataframe]: rows with the `ADDRESS_DTYPES` columns, ordered by `address_id` from 0,
+            or None to start empty
+    """
+
+    def __init__(self, df_addresses=None):
+        if df_addresses is None:
+            df_addresses = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in ADDRESS_DTYPES.items()})
+        elif 'geocoded' not in df_addresses.columns:
+            # dimensions written before failed lookups were recorded only kept the coordinates found
+            df_addresses = df_addresses.assign(geocoded=df_addresses['lat'].notna())
+        self.addresses = df_addresses.reset_index(drop=True)
+        self._ids = dict(zip(zip(self.addresses['block'], self.addresses['street_name']), self.addresses['address_id']))
+        self._new = []
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Function to load the dimension persisted by `write()`, or start an empty one if there is none
+        """
+        return cls(pd.read_parquet(path) if os.path.exists(path) else None)
+
+    def assign(self, block: pd.Series, street_name: pd.Series) -> np.ndarray:
+        """
+        Function to look up the id of the address of each transaction, adding the addresses not seen before
+
+        Args:
+            block [series]: blocks of the transactions
+            street_name [series]: street names of the transactions
+
+        Returns:
+            ids [np.ndarray]: int32 address id of each transaction, -1 where the block or street name is missing
+
+        """
+        block_codes, blocks = factorize_normalized(block)
+        street_codes, streets = factorize_normalized(street_name)
+
+        # a transaction's pair of codes identifies its address, so only distinct pairs are looked up
+        pair_keys = np.where((block_codes < 0) | (street_codes < 0), -1,
+                             block_codes.astype('int64') * len(streets) + street_codes)
+        pair_codes, pairs = pd.factorize(pair_keys)
+
+        pair_ids = np.empty(len(pairs) + 1, dtype='int32')
+        pair_ids[-1] = -1
+        for position, key in enumerate(pairs):
+            if key < 0:
+                pair_ids[position] = -1
+                continue
+            address = (blocks[key // len(streets)], streets[key % len(streets)])
+            address_id = self._ids.get(address)
+            if address_id is None:
+                address_id = self._ids[address] = len(self._ids)
+                self._new.append(address)
+            pair_ids[position] = address_id
+
+        return pair_ids[pair_codes]
+
+    def attach(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Function to replace the block and street name of transactions with their address id
+
+        Args:
+            df [dataframe]: transactions with `block` and `street_name` columns
+
+        Returns:
+            df [dataframe]: transactions with an `address_id` column where the address columns were
+        """
+        df.insert(df.columns.get_loc(ADDRESS_COLS[0]), 'address_id', self.assign(df['block'], df['street_name']))
+        return df.drop(ADDRESS_COLS, axis=1)
+
+    def attach_table(self, table: pa.Table) -> pa.Table:
+        """
+        Function to replace the block and street name of transactions with their address id, on an Arrow table
+        such as the partitions returned by the workers of src.parallel
+
+        Args:
+            table [pa.Table]: transactions with `block` and `street_name` columns
+
+        Returns:
+            table [pa.Table]: transactions with an `address_id` column where the address columns were
+        """
+        df_address = table.select(ADDRESS_COLS).to_pandas()
+        ids = self.assign(df_address['block'], df_address['street_name'])
+        position = table.schema.get_field_index(ADDRESS_COLS[0])
+        return table.drop(ADDRESS_COLS).add_column(position, 'address_id', pa.array(ids))
+
+    def frame(self) -> pd.DataFrame:
+        """
+        Function to gather the dimension, including the addresses added since it was loaded
+
+        Returns:
+            df_addresses [dataframe]: one row per address with its search string and coordinates, ordered by id
+        """
+        if self._new:
+            blocks = pd.Series([block for block, _ in self._new], dtype=object)
+            streets = pd.Series([street for _, street in self._new], dtype=object)
+            df_new = pd.DataFrame({
+                'address_id': np.arange(len(self.addresses), len(self._ids), dtype='int32'),
+                'block': blocks,
+                'street_name': streets,
+                'full_address': blocks + ' ' + streets,
+                'search_address': blocks + '+' + streets.str.replace(' ', '+') + '+SINGAPORE',
+                'lat': np.nan,
+                'lon': np.nan,
+                'geocoded': False
+            })
+            self.addresses = pd.concat([self.addresses, df_new], ignore_index=True).astype(ADDRESS_DTYPES)
+            self._new = []
+        return self.addresses
+
+    def set_coordinates(self, ids, lat, lon):
+        """
+        Function to record the coordinates of addresses, e.g. after geocoding them
+
+        Args:
+            ids [array]: address ids
+            lat [array]: latitudes, NaN where the address could not be geocoded
+            lon [array]: longitudes, NaN where the address could not be geocoded
+        """
+        df_addresses = self.frame()
+        ids = np.asarray(ids, dtype='int64')
+        df_addresses.loc[ids, 'lat'] = np.asarray(lat, dtype='float64')
+        df_addresses.loc[ids, 'lon'] = np.asarray(lon, dtype='float64')
+        df_addresses.loc[ids, 'geocoded'] = True
+
+    def unresolved(self, ids, retry_failed=False) -> np.ndarray:
+        """
+        Function to find the addresses among `ids` that geocoding has not resolved yet
+
+        Args:
+            ids [array]: address ids, e.g. of every transaction; -1 for missing addresses is ignored
+            retry_failed [bool]: also return the addresses looked up before without finding coordinates
+
+        Returns:
+            ids [np.ndarray]: distinct unresolved address ids, in increasing order
+        """
+        df_addresses = self.frame()
+        ids = pd.unique(np.asarray(ids, dtype='int64'))
+        ids = np.sort(ids[ids >= 0])
+        done = df_addresses['lat'].notna() if retry_failed else df_addresses['geocoded']
+        return ids[~done.to_numpy()[ids]]
+
+    def coordinates(self, ids):
+        """
+        Function to look up the coordinates of the address of each transaction
+
+        Args:
+            ids [array]: address id of each transaction, -1 for missing addresses
+
+        Returns:
+            lat [np.ndarray]: latitude of each transaction, NaN where the address has no coordinates
+            lon [np.ndarray]: longitude of each transaction, NaN where the address has no coordinates
+        """
+        df_addresses = self.frame()
+        ids = np.asarray(ids, dtype='int64')
+        # ids are positions in the dimension, and -1 picks the appended NaN
+        lat = np.append(df_addresses['lat'].to_numpy(dtype='float64'), np.nan)[ids]
+        lon = np.append(df_addresses['lon'].to_numpy(dtype='float64'), np.nan)[ids]
+        return lat, lon
+
+    def write(self, path: str) -> int:
+        """
+        Function to persist the dimension, replacing the file atomically
+
+        Args:
+            path [string]: path of the parquet file
+
+        Returns:
+            rows [int]: number of addresses
+        """
+        df_addresses = self.frame()
+        tmp_path = f'{path}.tmp'
+        df_addresses.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        return len(df_addresses)
+
+
+def address_labels(df_addresses: pd.DataFrame) -> pd.Series:
+    """
+    Function to label address ids with their full address for display, e.g. by `preview.paged_dataframe()`
+
+    Args:
+        df_addresses [dataframe]: the dimension, from `AddressIndex.frame()` or its parquet file
+
+    Returns:
+        labels [series]: full address indexed by address id
+    """
+    return df_addresses.set_index('address_id')['full_address']
@@ -0,0 +1,144 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .config import load_config
+from .backends import get_backend
+from .snapshot import pointer_path
+
+# unaggregated row queries are capped, so that a single request cannot serialize the whole dataset
+DEFAULT_ROW_LIMIT = 1000
+
+
+def row_limit(limit) -> int:
+    """
+    Function to cap the number of rows an unaggregated query returns
+
+    Args:
+        limit [int]: number of rows requested, None for as many as allowed
+
+    Returns:
+        limit [int]: number of rows returned, at most `DEFAULT_ROW_LIMIT`
+    """
+    if limit is None:
+        return DEFAULT_ROW_LIMIT
+    limit = int(limit)
+    if limit < 0:
+        raise ValueError(f"limit must not be negative, got {limit}")
+    return min(limit, DEFAULT_ROW_LIMIT)
+
+
+def make_handler(backend):
+    """
+    Function to build a request handler bound to a query backend
+
+    Args:
+        backend [PandasBackend]: query backend from `src.backends.get_backend()`
+
+    Returns:
+        handler [class]: request handler class for `ThreadingHTTPServer`
+    """
+
+    class QueryHandler(BaseHTTPRequestHandler):
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send_json(200, {'status': 'ok', 'backend': backend.name, 'rows': backend.num_rows()})
+            else:
+                self._send_json(404, {'error': f"unknown path '{self.path}'"})
+
+        def do_POST(self):
+            if self.path != '/query':
+                self._send_json(404, {'error': f"unknown path '{self.path}'"})
+                return
+
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                spec = json.loads(self.rfile.read(length) or b'{}')
+                if spec.get('aggregation', {}).get('type', 'rows') == 'rows':
+                    spec['limit'] = row_limit(spec.get('limit'))
+
+                start_time = time.perf_counter()
+                df_result = backend.run(spec)
+                elapsed = time.perf_counter() - start_time
+
+            except (ValueError, KeyError, TypeError, AttributeError) as err:
+                self._send_json(400, {'error': str(err)})
+                return
+            # any other failure, e.g. reading a snapshot being pruned, still gets a response
+            except Exception as err:
+                self._send_json(500, {'error': repr(err)})
+                return
+
+            self._send_json(200, {
+                'row_count': len(df_result),
+                'query_seconds': round(elapsed, 6),
+                'rows': json.loads(df_result.to_json(orient='records'))
+            })
+
+        def log_message(self, format, *args):
+            # keep the console quiet under load; latency is reported in each response instead
+            pass
+
+    return QueryHandler
+
+
+class QueryServer(ThreadingHTTPServer):
+    # the default backlog of 5 makes bursts of concurrent clients wait on connection retries
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def make_server(backend, host='127.0.0.1', port=8000):
+    """
+    Function to create a threaded HTTP/JSON server in front of the query module
+
+    Args:
+        backend [PandasBackend]: query backend from `src.backends.get_backend()`
+        host [string]: interface to bind to
+        port [int]: port to listen on, 0 for any free port
+
+    Returns:
+        server [QueryServer]: server ready for `serve_forever()`
+    """
+    return QueryServer((host, port), make_handler(backend))
+
+
+def main():
+    """
+    Serve the query API over the prepared dataset
+    """
+    cfg = load_config()
+    artifacts_path = cfg['eda']['artifacts_path']
+    host = cfg['api']['host']
+    port = cfg['api']['port']
+    query_backend = cfg['query']['backend']
+
+    parser = argparse.ArgumentParser(description="HTTP/JSON query API over the prepared HDB resale dataset")
+    parser.add_argument('--host', default=host)
+    parser.add_argument('--port', type=int, default=port)
+    parser.add_argument('--backend', default=query_backend, help="query backend, overrides config.yml")
+    args = parser.parse_args()
+
+    # queries follow the `current` snapshot pointer, so a refresh is served without restarting the API
+    backend = get_backend(args.backend, pointer_path(artifacts_path, 'hdb_resale.parquet'))
+
+    # warm up once, so that the first request does not pay for loading the dataset
+    backend.run({'aggregation': {'type': 'count', 'by': 'town'}})
+
+    server = make_server(backend, host=args.host, port=args.port)
+    print(f"Serving queries on http://{args.host}:{args.port}/query with the {backend.name} backend")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+import argparse
+import sys
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+try:
+    import duckdb
+except ImportError:  # optional, only needed for the 'duckdb' backend
+    duckdb = None
+
+from .config import load_config
+from .query import FILTER_COLS, load_dataset, parse_aggregation, run_query
+from .snapshot import pointer_path
+
+# queries compared across backends by `check_parity()`, covering every aggregation type
+PARITY_SPECS = [
+    {'filters': {}, 'aggregation': {'type': 'agg', 'by': 'month'}},
+    {'filters': {'start_year': 2012, 'end_year': 2023}, 'aggregation': {'type': 'agg', 'by': 'year'}},
+    {'filters': {'flat_type': ['4 ROOM', '5 ROOM']}, 'aggregation': {'type': 'agg', 'by': 'town', 'value': 'price_per_sqm'}},
+    {'filters': {}, 'aggregation': {'type': 'agg', 'by': 'storey_range'}},
+    {'filters': {}, 'aggregation': {'type': 'agg', 'by': 'floor_area_sqm'}},
+    {'filters': {}, 'aggregation': {'type': 'agg', 'by': 'remaining_lease'}},
+    {'filters': {'town': ['BEDOK', 'TAMPINES']}, 'aggregation': {'type': 'count', 'by': 'flat_model'}},
+    {'filters': {}, 'aggregation': {'type': 'count', 'by': 'town'}},
+    {'filters': {}, 'aggregation': {'type': 'count', 'by': 'month'}},
+    {'filters': {}, 'aggregation': {'type': 'median_pivot', 'by': 'town', 'columns': 'flat_type'}},
+    {'filters': {'start_year': 2014}, 'aggregation': {'type': 'median_pivot', 'by': 'flat_type', 'columns': 'storey_range'}},
+]
+
+
+class PandasBackend:
+    """
+    Query backend running the pandas helpers of `src.query` on the dataset loaded into memory
+
+    Args:
+        path_filename [string]: path and filename of the Parquet artifact
+    """
+
+    name = 'pandas'
+
+    def __init__(self, path_filename: str):
+        self.path_filename = path_filename
+
+    def num_rows(self) -> int:
+        return pq.ParquetFile(self.path_filename).metadata.num_rows
+
+    def run(self, spec: dict) -> pd.DataFrame:
+        """
+        Run a query spec, see `src.query.run_query()`
+        """
+        return run_query(load_dataset(self.path_filename), spec)
+
+
+class ArrowBackend(PandasBackend):
+    """
+    Query backend running Arrow compute kernels over the Parquet artifact
+
+    Filters are pushed down into the Parquet scan and only the columns a query needs are read, so the
+    dataset is never materialized as a pandas frame.
+    """
+
+    name = 'arrow'
+
+    def __init__(self, path_filename: str):
+        super().__init__(path_filename)
+        self.dataset = ds.dataset(path_filename, format='parquet')
+
+    def _scan(self, filters: dict, columns: list) -> pa.Table:
+        """
+        Function to read the filtered rows of the given columns
+        """
+        expression = None
+        conditions = []
+        if 'start_year' in filters:
+            conditions.append(ds.field('year') > filters['start_year'])
+        if 'end_year' in filters:
+            conditions.append(ds.field('year') < filters['end_year'])
+        for col in FILTER_COLS:
+            if filters.get(col):
+                conditions.append(ds.field(col).isin(list(filters[col])))
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+
+        return self.dataset.to_table(columns=columns, filter=expression)
+
+    @staticmethod
+    def _sorted_groups(table: pa.Table, keys: list, value: str):
+        """
+        Function to sort the values of a table by its group keys, and locate the first row of each group
+
+        Keys are dictionary-encoded and ranked first, so that the sort compares small integers instead of strings.
+
+        Returns:
+            groups [dict]: the key of each group per key column
+            values [np.ndarray]: the sorted values
+            starts [np.ndarray]: first row of each group
+            ends [np.ndarray]: one past the last row of each group
+        """
+        n_rows = table.num_rows
+        ranks, dictionaries = [], []
+        for key in keys:
+            encoded = pc.dictionary_encode(table[key].combine_chunks())
+            order = pc.sort_indices(encoded.dictionary).to_numpy()
+            rank = np.empty(len(order), dtype='int64')
+            rank[order] = np.arange(len(order))
+            ranks.append(rank[encoded.indices.to_numpy()])
+            dictionaries.append(encoded.dictionary.take(pa.array(order)).to_numpy(zero_copy_only=False))
+
+        values = table[value].to_numpy()
+        # np.lexsort sorts by its last key first
+        sort_order = np.lexsort([values] + ranks[::-1])
+        values = values[sort_order]
+        ranks = [rank[sort_order] for rank in ranks]
+
+        is_start = np.zeros(n_rows, dtype=bool)
+        is_start[:1] = True
+        for rank in ranks:
+            is_start[1:] |= rank[1:] != rank[:-1]
+
+        starts = np.flatnonzero(is_start)
+        ends = np.append(starts[1:], n_rows)
+        groups = {key: dictionary[rank[starts]] for key, rank, dictionary in zip(keys, ranks, dictionaries)}
+        return groups, values, starts, ends
+
+    @staticmethod
+    def _medians(values, starts, ends):
+        # the middle value of each sorted group, or the mean of the two middle values
+        return (values[(starts + ends - 1) // 2].astype('float64') + values[(starts + ends) // 2]) / 2
+
+    def agg(self, filters: dict, by: str, value: str) -> pd.DataFrame:
+        table = self._scan(filters, [by, value])
+        if table.num_rows == 0:
+            return pd.DataFrame(columns=[by, 'min', 'max', 'mean', 'median'])
+
+        groups, values, starts, ends = self._sorted_groups(table, [by], value)
+        counts = ends - starts
+
+        return pd.DataFrame({
+            by: groups[by],
+            'min': values[starts],
+            'max': values[ends - 1],
+            'mean': (np.add.reduceat(values.astype('float64'), starts) / counts).astype('int64'),
+            'median': self._medians(values, starts, ends).astype('int64')
+        })
+
+    def count(self, filters: dict, by: str) -> pd.DataFrame:
+        # hash aggregation runs on Arrow's thread pool
+        table = self._scan(filters, [by]).group_by(by).aggregate([(by, 'count')])
+        table = table.rename_columns([
+            'num_transactions' if name == f'{by}_count' else name for name in table.column_names
+        ])
+        table = table.sort_by([('num_transactions', 'descending'), (by, 'ascending')])
+        return table.select([by, 'num_transactions']).to_pandas()
+
+    def median_pivot(self, filters: dict, index: str, columns: str, value: str) -> pd.DataFrame:
+        table = self._scan(filters, [index, columns, value])
+        if table.num_rows == 0:
+            return pd.DataFrame(columns=[index])
+
+        groups, values, starts, ends = self._sorted_groups(table, [index, columns], value)
+        df_medians = pd.DataFrame({
+            index: groups[index],
+            columns: groups[columns],
+            value: self._medians(values, starts, ends)
+        })
+        return df_medians.pivot(index=index, columns=columns, values=value).reset_index()
+
+    def run(self, spec: dict) -> pd.DataFrame:
+        """
+        Run a query spec, see `src.query.run_query()`
+        """
+        aggregation = parse_aggregation(spec.get('aggregation', {'type': 'rows'}))
+        filters = spec.get('filters', {})
+        limit = spec.get('limit')
+
+        if aggregation['type'] == 'agg':
+            df_result = self.agg(filters, aggregation['by'], aggregation['value'])
+        elif aggregation['type'] == 'count':
+            df_result = self.count(filters, aggregation['by'])
+        elif aggregation['type'] == 'median_pivot':
+            df_result = self.median_pivot(filters, aggregation['by'], aggregation['columns'], aggregation['value'])
+        else:
+            table = self._scan(filters, None)
+            df_result = (table if limit is None else table.slice(0, int(limit))).to_pandas()
+
+        if limit is not None:
+            df_result = df_result.head(int(limit))
+
+        return df_result
+
+
+class DuckDBBackend(PandasBackend):
+    """
+    Query backend running multi-threaded SQL in DuckDB directly over the Parquet artifact
+    """
+
+    name = 'duckdb'
+
+    def __init__(self, path_filename: str):
+        if duckdb is None:
+            raise ImportError("the 'duckdb' query backend requires the duckdb package, pip install duckdb")
+        super().__init__(path_filename)
+        self.connection = duckdb.connect()
+
+    def _where(self, filters: dict):
+        """
+        Function to build the WHERE clause of the filters and its parameters
+        """
+        conditions, params = [], []
+        if 'start_year' in filters:
+            conditions.append("year > ?")
+            params.append(int(filters['start_year']))
+        if 'end_year' in filters:
+            conditions.append("year < ?")
+            params.append(int(filters['end_year']))
+        for col in FILTER_COLS:
+            if filters.get(col):
+                conditions.append(f"list_contains(?, {col})")
+                params.append([str(value) for value in filters[col]])
+
+        return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+    def _sql(self, select: str, filters: dict, tail: str = "") -> pd.DataFrame:
+        where, params = self._where(filters)
+        # column names are validated by `parse_aggregation()`, only the values are bound as parameters
+        sql = f"SELECT {select} FROM read_parquet(?) {where} {tail}"
+        # each thread gets its own cursor, a DuckDB connection is not safe to share between threads
+        return self.connection.cursor().execute(sql, [self.path_filename] + params).df()
+
+    def run(self, spec: dict) -> pd.DataFrame:
+        """
+        Run a query spec, see `src.query.run_query()`
+        """
+        aggregation = parse_aggregation(spec.get('aggregation', {'type': 'rows'}))
+        filters = spec.get('filters', {})
+        limit = spec.get('limit')
+        by, value = aggregation['by'], aggregation['value']
+        tail = f"LIMIT {int(limit)}" if limit is not None else ""
+
+        if aggregation['type'] == 'agg':
+            return self._sql(
+                f"{by}, min({value}) AS min, max({value}) AS max, "
+                f"CAST(trunc(avg({value})) AS BIGINT) AS mean, "
+                f"CAST(trunc(quantile_cont(CAST({value} AS DOUBLE), 0.5)) AS BIGINT) AS median",
+                filters, f"GROUP BY {by} ORDER BY {by} {tail}"
+            )
+        if aggregation['type'] == 'count':
+            return self._sql(
+                f"{by}, count(*) AS num_transactions",
+                filters, f"GROUP BY {by} ORDER BY num_transactions DESC, {by} {tail}"
+            )
+        if aggregation['type'] == 'median_pivot':
+            columns = aggregation['columns']
+            df_medians = self._sql(
+                f"{by}, {columns}, quantile_cont(CAST({value} AS DOUBLE), 0.5) AS {value}",
+                filters, f"GROUP BY {by}, {columns}"
+            )
+            df_result = df_medians.pivot(index=by, columns=columns, values=value).reset_index()
+            return df_result if limit is None else df_result.head(int(limit))
+
+        return self._sql("*", filters, tail)
+
+
+BACKENDS = {
+    'pandas': PandasBackend,
+    'arrow': ArrowBackend,
+    'duckdb': DuckDBBackend,
+}
+
+
+@lru_cache(maxsize=8)
+def get_backend(name: str, path_filename: str):
+    """
+    Function to create, once per process, the query backend selected in config.yml
+
+    Args:
+        name [string]: 'pandas', 'arrow' or 'duckdb'
+        path_filename [string]: path and filename of the Parquet artifact
+
+    Returns:
+        backend [PandasBackend]: backend whose `run(spec)` answers query specs
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"unknown query backend '{name}', expected one of {list(BACKENDS)}")
+    return BACKENDS[name](path_filename)
+
+
+def available_backends() -> list:
+    """
+    Function to list the backends whose dependencies are installed
+    """
+    return [name for name in BACKENDS if name != 'duckdb' or duckdb is not None]
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    # backends may differ in dtypes, column index names and categorical keys, not in values
+    df = df.reset_index(drop=True)
+    df.columns = [str(col) for col in df.columns]
+    return df.astype({col: 'object' for col in df.columns if not pd.api.types.is_numeric_dtype(df[col])})
+
+
+def check_parity(path_filename: str, backends=None, specs=PARITY_SPECS) -> list:
+    """
+    Function to compare the results of each backend against the pandas path
+
+    Args:
+        path_filename [string]: path and filename of the Parquet artifact
+        backends [list]: backends to check, None for every installed backend
+        specs [list]: query specs to compare
+
+    Returns:
+        mismatches [list]: (backend, spec, message) for every query whose results differ
+    """
+    reference = get_backend('pandas', path_filename)
+    mismatches = []
+
+    for name in backends or available_backends():
+        if name == 'pandas':
+            continue
+        backend = get_backend(name, path_filename)
+        for spec in specs:
+            expected = _normalize(reference.run(spec))
+            actual = _normalize(backend.run(spec))
+            try:
+                pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_exact=False, rtol=1e-6)
+            except AssertionError as err:
+                mismatches.append((name, spec, str(err)))
+
+    return mismatches
+
+
+def main():
+    """
+    Check that every installed query backend returns the same results as the pandas path
+    """
+    cfg = load_config()
+    artifacts_path = cfg['eda']['artifacts_path']
+
+    parser = argparse.ArgumentParser(description="Parity check of the query backends against pandas")
+    parser.add_argument('--backends', nargs='*', choices=list(BACKENDS), help="backends to check, default all installed")
+    parser.add_argument('--path', default=pointer_path(artifacts_path, 'hdb_resale.parquet'), help="Parquet artifact to query")
+    args = parser.parse_args()
+
+    backends = args.backends or available_backends()
+    mismatches = check_parity(args.path, backends)
+
+    for name, spec, message in mismatches:
+        print(f"[{name}] {spec}\n{message}\n")
+    print(f"{len(PARITY_SPECS)} queries x {len([b for b in backends if b != 'pandas'])} backends, "
+          f"{len(mismatches)} mismatches")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,727 @@
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import threading
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from .config import load_config
+from .lease import parse_lease_months, lease_months_to_years
+from .utility import CSV_DTYPES, convert_to_year_num, read_concat_csv_to_df, iter_csv_batches, transform, ParquetBatchWriter
+from .features import materialize_features
+from .validation import Validator
+from . import query
+from .api import make_server
+from .backends import available_backends, get_backend
+from .serving import write_serving_file, load_serving_dataset, load_compact_dataset
+from .parallel import iter_transformed_partitions
+from .storage import storage_profile, write_artifact
+from .address import AddressIndex
+from . import model
+from . import synth
+
+BUNDLED_CSV = "data/resale-flat-prices-based-on-registration-date-from-jan-2015-to-dec-2016.csv"
+DEFAULT_SCALES = (1, 10, 30)
+REPEAT = 3
+
+# replicated CSVs live here until the process exits
+_WORKDIR = tempfile.TemporaryDirectory(prefix="hdb_benchmark_")
+
+
+def measure(func, *args, rows=None, repeat=None, **kwargs):
+    """
+    Function to time a callable and record its peak memory
+
+    Args:
+        func [callable]: function to benchmark
+        rows [int]: number of input rows, used to derive throughput
+        repeat [int]: number of timed runs, the fastest one is reported; defaults to `REPEAT`
+
+    Returns:
+        result [dict]: wall time in seconds, peak traced memory in bytes and rows per second
+
+    """
+    timings = []
+    for _ in range(repeat or REPEAT):
+        start_time = time.perf_counter()
+        func(*args, **kwargs)
+        timings.append(time.perf_counter() - start_time)
+
+    # trace memory on a separate run so the allocation hooks do not skew the timings
+    tracemalloc.start()
+    func(*args, **kwargs)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    wall_seconds = min(timings)
+    return {
+        'wall_seconds': round(wall_seconds, 6),
+        'peak_bytes': peak_bytes,
+        'rows': rows,
+        'rows_per_second': round(rows / wall_seconds, 1) if rows and wall_seconds else None
+    }
+
+
+def lease_samples(rows):
+    """
+    Function to build a `remaining_lease` column mixing every published format
+
+    Args:
+        rows [int]: number of values to generate
+
+    Returns:
+        values [series]: mix of 'NN years', 'NN years MM months', plain ints and NaN
+
+    """
+    formats = ['{y} years', '{y} years {m:02d} months', '{y}', None]
+    values = []
+    for i in range(rows):
+        fmt = formats[i % len(formats)]
+        values.append(None if fmt is None else fmt.format(y=45 + i % 50, m=i % 12))
+    return pd.Series([int(v) if v and v.isdigit() else v for v in values], dtype=object)
+
+
+def bench_lease_parser(scale):
+    """
+    Benchmark the vectorized lease parser against the per-row `convert_to_year_num()` apply
+
+    Args:
+        scale [int]: multiple of the bundled CSV row count to parse
+
+    Returns:
+        results [dict]: measurements keyed by implementation
+
+    """
+    rows = scale * len(workload(1)['raw'])
+    values = lease_samples(rows)
+
+    def per_row():
+        return values.apply(lambda x: convert_to_year_num(x) if isinstance(x, str) else x)
+
+    def vectorized():
+        return lease_months_to_years(parse_lease_months(values).fillna(0))
+
+    # both implementations must agree on every parsed value before their timings mean anything
+    expected = per_row()
+    parsed = expected.notna()
+    assert (vectorized()[parsed] == expected[parsed].astype('int64')).all()
+
+    return {
+        'convert_to_year_num': measure(per_row, rows=rows),
+        'parse_lease_months': measure(vectorized, rows=rows)
+    }
+
+
+def load_page(prefix):
+    """
+    Function to import a Streamlit page script as a module, without running its `main()`
+
+    Args:
+        prefix [string]: numeric prefix of the page file, e.g. '1'
+
+    Returns:
+        module [module]: the imported page script
+
+    """
+    path = glob.glob(f"pages/{prefix}_*.py")[0]
+    spec = importlib.util.spec_from_file_location(f"page_{prefix}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def uncached(func):
+    """
+    Function to strip the `st.cache_data` wrapper, so that every timed call does the actual work
+    """
+    return getattr(func, '__wrapped__', func)
+
+
+def replicate_csv(scale):
+    """
+    Function to write `scale` copies of the bundled CSV, each shifted two years further back in time
+
+    Args:
+        scale [int]: number of copies to write
+
+    Returns:
+        csv_path [string]: glob pattern matching the written CSV files
+
+    """
+    out_dir = os.path.join(_WORKDIR.name, f"x{scale}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    df = pd.read_csv(BUNDLED_CSV)
+    years = df['month'].str.slice(0, 4).astype(int)
+    months = df['month'].str.slice(4)
+
+    for i in range(scale):
+        df_copy = df.copy()
+        df_copy['month'] = (years - 2 * i).astype(str) + months
+        df_copy['lease_commence_date'] = df['lease_commence_date'] - 2 * i
+        df_copy.to_csv(os.path.join(out_dir, f"replica_{i:03d}.csv"), index=False)
+
+    return os.path.join(out_dir, "*.csv")
+
+
+@lru_cache(maxsize=None)
+def workload(scale):
+    """
+    Function to build, once per scale, the inputs shared by the benchmarks
+
+    Args:
+        scale [int]: multiple of the bundled CSV
+
+    Returns:
+        workload [dict]: CSV glob pattern, raw concatenated frame and transformed frame
+
+    """
+    csv_path = replicate_csv(scale)
+    df_raw = read_concat_csv_to_df(csv_path)
+    df_transformed = materialize_features(transform(df_raw.copy()))
+
+    return {'csv_path': csv_path, 'raw': df_raw, 'transformed': df_transformed}
+
+
+def validator():
+    """
+    Function to create a validator from config.yml, as `prepare()` does
+    """
+    cfg = load_config()
+    return Validator.from_config(cfg['validation'])
+
+
+def bench_etl(scale):
+    """
+    Benchmark the ETL steps run by `prepare()`
+
+    Args:
+        scale [int]: multiple of the bundled CSV
+
+    Returns:
+        results [dict]: measurements keyed by function
+
+    """
+    data = workload(scale)
+    rows = len(data['raw'])
+
+    return {
+        'read_concat_csv_to_df': measure(read_concat_csv_to_df, data['csv_path'], rows=rows),
+        # transform mutates its input, so each run works on a fresh copy
+        'transform': measure(lambda: transform(data['raw'].copy()), rows=rows),
+        'transform_validated': measure(lambda: transform(data['raw'].copy(), validator=validator()), rows=rows),
+        'materialize_features': measure(lambda: materialize_features(data['transformed'].copy()), rows=rows)
+    }
+
+
+def bench_streaming(scale, batch_size=50_000):
+    """
+    Benchmark the in-memory ETL against the streaming ETL, from the CSV files to the Parquet artifact
+
+    Peak traced memory of the streaming ETL should stay flat as the scale grows.
+
+    Args:
+        scale [int]: multiple of the bundled CSV
+        batch_size [int]: rows per batch of the streaming ETL
+
+    Returns:
+        results [dict]: measurements keyed by ETL mode
+
+    """
+    data = workload(scale)
+    rows = len(data['raw'])
+    out_path = os.path.join(_WORKDIR.name, f"etl_x{scale}.parquet")
+
+    def in_memory():
+        materialize_features(transform(read_concat_csv_to_df(data['csv_path']))).to_parquet(out_path)
+
+    def streaming():
+        with ParquetBatchWriter(out_path) as writer:
+            for df_batch in iter_csv_batches(data['csv_path'], batch_size):
+                writer.write(materialize_features(transform(df_batch)))
+
+    return {
+        'batch': measure(in_memory, rows=rows),
+        'streaming': measure(streaming, rows=rows)
+    }
+
+
+def bench_parallel(scale, workers=(1, 2, 4), projected=(2, 4, 8)):
+    """
+    Benchmark the in-memory ETL against the parallel ETL with a growing number of worker processes,
+    from the CSV files to the Parquet artifact
+
+    The CSV files of the workload are its partitions, so at most `scale` workers are busy. The parent process
+    numbers the addresses and writes the single artifact one partition after the other; its share of the CPU
+    time, measured against the CPU time of the workers, bounds the speedup any number of cores can reach, which
+    is projected for the `projected` worker counts even on a host with fewer cores.
+
+    Args:
+        scale [int]: multiple of the bundled CSV
+        workers [tuple]: worker counts to measure, capped at the number of CPU cores
+        projected [tuple]: worker counts whose speedup over one worker is projected from the serial share
+
+    Returns:
+        results [dict]: measurements keyed by ETL mode, and the speedup of each worker count over the in-memory ETL
+
+    """
+    data = workload(scale)
+    rows = len(data['raw'])
+    out_path = os.path.join(_WORKDIR.name, f"etl_x{scale}.parquet")
+    profile = storage_profile(load_config())
+    seconds = {}
+
+    def in_memory():
+        df = materialize_features(AddressIndex().attach(transform(read_concat_csv_to_df(data['csv_path']))))
+        write_artifact(df, out_path, profile)
+
+    def parallel(num_workers):
+        # the same work as prepare_parallel(), without the monthly store
+        addresses = AddressIndex()
+        run_seconds = {'parent': 0.0, 'worker': 0.0}
+        with ParquetBatchWriter(out_path, profile=profile) as writer:
+            for partition in iter_transformed_partitions(data['csv_path'], workers=num_workers):
+                start_time = time.process_time()
+                writer.write_table(addresses.attach_table(partition['table']))
+                run_seconds['parent'] += time.process_time() - start_time
+                run_seconds['worker'] += partition['cpu_seconds']
+        # the run tracing memory is slowed down in the parent only
+        if not tracemalloc.is_tracing():
+            seconds.update(run_seconds)
+
+    results = {'batch': measure(in_memory, rows=rows)}
+    for num_workers in sorted({min(n, os.cpu_count()) for n in workers}):
+        result = measure(parallel, num_workers, rows=rows)
+        result['speedup'] = round(results['batch']['wall_seconds'] / result['wall_seconds'], 2)
+        results[f'parallel_{num_workers}'] = result
+
+    # Amdahl's law over the CPU seconds of the last timed run: the parent's share does not shrink with more workers
+    serial = seconds['parent'] / (seconds['parent'] + seconds['worker'])
+    results['serial_share'] = {
+        'parent_cpu_seconds': round(seconds['parent'], 6),
+        'worker_cpu_seconds': round(seconds['worker'], 6),
+        'serial_fraction': round(serial, 4),
+        'projected_speedup': {n: round(1 / (serial + (1 - serial) / min(n, scale)), 2) for n in projected}
+    }
+    return results
+
+
+def bench_pages(scale):
+    """
+    Benchmark the page helpers on the default sidebar state, bypassing the Streamlit cache
+
+    Args:
+        scale [int]: multiple of the bundled CSV
+
+    Returns:
+        results [dict]: measurements keyed by function
+
+    """
+    distribution = load_page('1')
+    df = workload(scale)['transformed']
+    rows = len(df)
+
+    plot_transacts = uncached(distribution.plot_transacts)
+    df_transacts = query.count_transactions(df, 'town')
+
+    # every flat type, town and flat model selected, as when the multiselects are left empty
+    filters = {
+        'sel_flat_type': df['flat_type'].unique(),
+        'sel_town': df['town'].unique(),
+        'sel_flat_model': df['flat_model'].unique()
+    }
+
+    return {
+        'slice_features': measure(query.slice_features, df, rows=rows, **filters),
+        'agg_date': measure(query.agg_date, df, x_selector='month', y_selector='resale_price', rows=rows),
+        'count_transactions': measure(query.count_transactions, df, 'town', rows=rows),
+        'plot_transacts': measure(plot_transacts, df_transacts, 'town', rows=rows)
+    }
+
+
+API_QUERIES = [
+    {'filters': {'start_year': 2012, 'end_year': 2023}, 'aggregation': {'type': 'agg', 'by': 'month'}},
+    {'filters': {'flat_type': ['4 ROOM']}, 'aggregation': {'type': 'agg', 'by': 'town', 'value': 'price_per_sqm'}},
+    {'filters': {}, 'aggregation': {'type': 'count', 'by': 'flat_model'}},
+    {'filters': {'town': ['BEDOK', 'TAMPINES']}, 'aggregation': {'type': 'median_pivot', 'by': 'town'}},
+    {'filters': {'town': ['ANG MO KIO']}, 'limit': 100},
+]
+
+
+@lru_cache(maxsize=None)
+def workload_parquet(scale):
+    """
+    Function to write, once per scale, the transformed workload as the Parquet artifact the backends query
+    """
+    path_filename = os.path.join(_WORKDIR.name, f"hdb_resale_x{scale}.parquet")
+    workload(scale)['transformed'].to_parquet(path_filename)
+    return path_filename
+
+
+def bench_backends(scale):
+    """
+    Benchmark the page aggregations on every installed query backend, from the Parquet artifact
+
+    The pandas backend is timed on the dataset already loaded, as the pages and the API keep it in memory;
+    the other backends scan the Parquet artifact on every query.
+
+    Args:
+        scale [int]: multiple of the bundled CSV
+
+    Returns:
+        results [dict]: measurements keyed by backend, then by query
+
+    """
+    path_filename = workload_parquet(scale)
+    rows = len(workload(scale)['transformed'])
+    specs = {
+        'agg_month': {'aggregation': {'type': 'agg', 'by': 'month'}},
+        'count_town': {'aggregation': {'type': 'count', 'by': 'town'}},
+        'median_pivot': {'aggregation': {'type': 'median_pivot', 'by': 'town', 'columns': 'flat_type'}},
+        'agg_town_filtered': {'filters': {'start_year': 2012, 'flat_type': ['4 ROOM']},
+                              'aggregation': {'type': 'agg', 'by': 'town'}},
+    }
+
+    results = {}
+    for name in available_backends():
+        backend = get_backend(name, path_filename)
+        # warm up, so that loading the dataset into the pandas backend is not timed
+        backend.run(specs['count_town'])
+        results[name] = {key: measure(backend.run, spec, rows=rows) for key, spec in specs.items()}
+
+    return results
+
+
+def bench_api(scale, requests_per_client=20, clients=(1, 4, 16), backend='pandas'):
+    """
+    Benchmark the HTTP query API end to end, with concurrent clients against a server on a free local port
+
+    Args:
+        scale [int]: multiple of the bundled CSV
+        requests_per_client [int]: number of queries each client sends
+        clients [tuple]: numbers of concurrent clients to measure
+        backend [string]: query backend serving the API
+
+    Returns:
+        results [dict]: latency percentiles and throughput keyed by the number of clients
+
+    """
+    server = make_server(get_backend(backend, workload_parquet(scale)), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/query"
+
+    def send(i):
+        body = json.dumps(API_QUERIES[i % len(API_QUERIES)]).encode('utf-8')
+        request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+        start_time = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        return time.perf_counter() - start_time
+
+    results = {}
+    try:
+        for n_clients in clients:
+            n_requests = n_clients * requests_per_client
+            with ThreadPoolExecutor(max_workers=n_clients) as pool:
+                start_time = time.perf_counter()
+                latencies = np.array(list(pool.map(send, range(n_requests))))
+                wall_seconds = time.perf_counter() - start_time
+
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            results[f"{n_clients}_clients"] = {
+                'requests': n_requests,
+                'p50_seconds': round(p50, 6),
+                'p95_seconds': round(p95, 6),
+                'p99_seconds': round(p99, 6),
+                'requests_per_second': round(n_requests / wall_seconds, 1)
+            }
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return results
+
+
+def bench_serving(scale):
+    """
+    Benchmark the cold start of an app process, loading the Parquet artifact as is or in the compact
+    representation against memory-mapping the Arrow IPC serving file, followed by a first aggregation over the
+    loaded frame, and the resident size of each frame
+
+    Peak traced memory of the memory-mapped load excludes the mapped file, which the OS shares between processes.
+
+    Args:
+        scale [int]: multiple of the bundled CSV
+
+    Returns:
+        results [dict]: measurements keyed by serving mode
+
+    """
+    parquet_filename = workload_parquet(scale)
+    serving_filename = os.path.join(_WORKDIR.name, f"hdb_resale_x{scale}.arrow")
+    write_serving_file(parquet_filename, serving_filename)
+    rows = len(workload(scale)['transformed'])
+    spec = {'aggregation': {'type': 'count', 'by': 'town'}}
+
+    results = {}
+    loaders = (('parquet', pd.read_parquet, parquet_filename), ('compact', load_compact_dataset, parquet_filename),
+               ('mmap', load_serving_dataset, serving_filename))
+    for mode, load, filename in loaders:
+        results[f'{mode}_load'] = measure(load, filename, rows=rows)
+        results[f'{mode}_first_query'] = measure(lambda: query.run_query(load(filename), spec), rows=rows)
+        results[f'{mode}_frame_bytes'] = int(load(filename).memory_usage(index=False, deep=True).sum())
+
+    return results
+
+
+def bench_storage(scale):
+    """
+    Benchmark every storage profile of config.yml on the transformed workload: file size, write time, loading
+    the whole artifact, and a filtered load of one town over the recent years that row group statistics can prune
+
+    Args:
+        scale [int]: multiple of the bundled CSV
+
+    Returns:
+        results [dict]: measurements keyed by profile
+
+    """
+    df = workload(scale)['transformed']
+    rows = len(df)
+    filters = [('year', '>=', int(df['year'].max()) - 1), ('town', '==', 'BEDOK')]
+
+    results = {}
+    for name in load_config()['storage']['profiles']:
+        profile = storage_profile(load_config(), name)
+        path_filename = os.path.join(_WORKDIR.name, f"hdb_resale_x{scale}_{name}.parquet")
+        write = measure(write_artifact, df, path_filename, profile, rows=rows)
+        results[name] = {
+            'bytes': os.path.getsize(path_filename),
+            'write': write,
+            'load': measure(pd.read_parquet, path_filename, rows=rows),
+            'filtered_load': measure(pd.read_parquet, path_filename, filters=filters, rows=rows)
+        }
+
+    return results
+
+
+def bench_model(scale):
+    """
+    Benchmark fitting the hedonic price model, and scoring fair prices from its coefficients as the page does
+
+    Args:
+        scale [int]: multiple of the bundled CSV
+
+    Returns:
+        results [dict]: measurements keyed by step
+
+    """
+    df = workload(scale)['transformed']
+    rows = len(df)
+    df_coef, summary = model.fit_model(df)
+    flats = df[model.CATEGORICAL_FEATURES + model.NUMERIC_FEATURES].head(1000)
+
+    return {
+        'design_matrix': measure(model.design_matrix, df, rows=rows),
+        'fit': measure(model.fit_model, df, rows=rows),
+        'score_one': measure(model.fair_price, df_coef, flats.head(1), summary['rmse'], rows=1),
+        'score_batch': measure(model.fair_price, df_coef, flats, summary['rmse'], rows=len(flats))
+    }
+
+
+def bench_synth(scale):
+    """
+    Benchmark the synthetic dataset generator: learning the distributions of the bundled CSV, sampling
+    transactions and writing them as CSV and parquet files
+
+    Args:
+        scale [int]: multiple of the bundled CSV rows to generate
+
+    Returns:
+        results [dict]: measurements keyed by step
+    """
+    synth_cfg = load_config()['synth']
+    df_source = pd.read_csv(BUNDLED_CSV, dtype=CSV_DTYPES)
+    rows = len(df_source) * scale
+    generator = synth.SyntheticGenerator(df_source)
+    months = (synth_cfg['start_month'], synth_cfg['end_month'])
+    path = os.path.join(_WORKDIR.name, f"synthetic_x{scale}")
+
+    return {
+        'fit': measure(synth.SyntheticGenerator, df_source, rows=len(df_source)),
+        'sample': measure(lambda: list(generator.iter_chunks(rows, *months)), rows=rows),
+        'write_csv': measure(lambda: synth.write_csv(generator.iter_chunks(rows, *months), path,
+                                                     synth_cfg['rows_per_file']), rows=rows),
+        'write_parquet': measure(lambda: synth.write_parquet(generator.iter_chunks(rows, *months), path), rows=rows)
+    }
+
+
+def bench_geocode(scale, resolved_share=0.99):
+    """
+    Benchmark the offline part of an incremental geocoding run over the address dimension, with the geocoding
+    API stubbed out, so that only the work of `src.geocode` around the requests is timed
+
+    The dimension of a previous run has geocoded all but the newest `1 - resolved_share` of its addresses,
+    which are the ones a run looks up.
+
+    Args:
+        scale [int]: multiple of the bundled CSV
+        resolved_share [float]: share of the addresses geocoded by the previous run
+
+    Returns:
+        results [dict]: measurements keyed by step, and the size of the dimension and of the lookups
+
+    """
+    data = workload(scale)
+    block, street_name = data['raw']['block'], data['raw']['street_name']
+    rows = len(block)
+
+    previous = AddressIndex()
+    ids = previous.assign(block, street_name)
+    resolved = previous.frame()['address_id'].to_numpy()[:int(len(previous.frame()) * resolved_share)]
+    previous.set_coordinates(resolved, np.full(len(resolved), 1.35), np.full(len(resolved), 103.82))
+    df_previous = previous.frame()
+
+    def stub_geocode(query):
+        # stands in for the rate-limited request to the geocoding API
+        return 1.35, 103.82
+
+    def incremental_run():
+        addresses = AddressIndex(df_previous.copy())
+        pending = addresses.unresolved(ids)
+        full_address = addresses.frame()['full_address'].to_numpy()
+        coordinates = np.array([stub_geocode(full_address[address_id]) for address_id in pending]).reshape(-1, 2)
+        addresses.set_coordinates(pending, coordinates[:, 0], coordinates[:, 1])
+        return addresses.coordinates(ids)
+
+    return {
+        # first run: every address is new to the dimension
+        'assign_new': measure(lambda: AddressIndex().assign(block, street_name), rows=rows),
+        # later runs: every address is already in the dimension
+        'assign_known': measure(lambda: AddressIndex(df_previous.copy()).assign(block, street_name), rows=rows),
+        # attach inserts the id column into its input, so each run works on a fresh copy
+        'attach': measure(lambda: AddressIndex(df_previous.copy()).attach(data['raw'][['block', 'street_name']].copy()),
+                          rows=rows),
+        'unresolved': measure(AddressIndex(df_previous).unresolved, ids, rows=rows),
+        'coordinates': measure(AddressIndex(df_previous).coordinates, ids, rows=rows),
+        'incremental_run': measure(incremental_run, rows=rows),
+        'dimension': {
+            'addresses': len(df_previous),
+            'lookups': len(AddressIndex(df_previous).unresolved(ids))
+        }
+    }
+
+
+# imports a script as a module without running its main(), twice: in a fresh interpreter, then as a rerun
+_STARTUP_PROBE = """
+import importlib.util, json, sys, time
+def run():
+    spec = importlib.util.spec_from_file_location('app_script', sys.argv[1])
+    module = importlib.util.module_from_spec(spec)
+    start_time = time.perf_counter()
+    spec.loader.exec_module(module)
+    return time.perf_counter() - start_time
+first, rerun = run(), run()
+print(json.dumps({
+    'import_seconds': round(first, 6),
+    'rerun_seconds': round(rerun, 6),
+    'modules': len(sys.modules),
+    'plotting_loaded': [name for name in ('plotly.express', 'pydeck') if name in sys.modules]
+}))
+"""
+
+
+def bench_startup(scale):
+    """
+    Benchmark the start of the app, importing the main script and each page in a fresh interpreter, and the
+    module-level work Streamlit repeats on every rerun of a script
+
+    The timings do not depend on the dataset, so only the first scale is measured.
+
+    Args:
+        scale [int]: multiple of the bundled CSV, unused
+
+    Returns:
+        results [dict]: measurements keyed by script, the fastest of `REPEAT` interpreters
+    """
+    results = {}
+    for path in ['main.py'] + sorted(glob.glob("pages/*.py")):
+        name = os.path.splitext(os.path.basename(path))[0].encode('ascii', 'ignore').decode().strip('_')
+        runs = [
+            json.loads(subprocess.run(
+                [sys.executable, '-c', _STARTUP_PROBE, path],
+                capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1])
+            for _ in range(REPEAT)
+        ]
+        results[name] = min(runs, key=lambda run: run['import_seconds'])
+    return results
+
+
+BENCHMARKS = {
+    'etl': bench_etl,
+    'streaming': bench_streaming,
+    'parallel': bench_parallel,
+    'pages': bench_pages,
+    'backends': bench_backends,
+    'api': bench_api,
+    'serving': bench_serving,
+    'storage': bench_storage,
+    'model': bench_model,
+    'synth': bench_synth,
+    'geocode': bench_geocode,
+    'startup': bench_startup,
+    'lease_parser': bench_lease_parser,
+}
+
+
+def main():
+    """
+    Run the benchmarks at each scale and print the results as JSON
+    """
+    global REPEAT
+
+    parser = argparse.ArgumentParser(description="Benchmark HDB resale hot paths")
+    parser.add_argument('--scales', nargs='*', type=int, default=list(DEFAULT_SCALES),
+                        help="multiples of the bundled CSV to benchmark at")
+    parser.add_argument('--only', nargs='*', choices=list(BENCHMARKS), help="subset of benchmarks to run")
+    parser.add_argument('--repeat', type=int, default=REPEAT, help="timed runs per measurement, the fastest is kept")
+    parser.add_argument('--output', help="optional path of a JSON file to write the results to")
+    args = parser.parse_args()
+
+    # measure() reads REPEAT when called rather than as a default argument, which would keep the value at import
+    REPEAT = args.repeat
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'cpu_count': os.cpu_count()
+        }
+    }
+    for name in args.only or BENCHMARKS:
+        results[name] = {f"{scale}x": BENCHMARKS[name](scale) for scale in args.scales}
+
+    report = json.dumps(results, indent=2)
+    print(report)
+
+    if args.output:
+        with open(args.output, encoding="utf-8", mode='w') as outfile:
+            outfile.write(report)
+
+
+if __name__ == "__main__":
+    main()
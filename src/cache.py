@@ -0,0 +1,225 @@
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+# file format of each kind of cached value
+SUFFIXES = {pd.DataFrame: '.parquet', np.ndarray: '.npy'}
+
+# one cache per directory and process, shared by the pages
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class ResultCache:
+    """
+    Disk-backed cache of query results, shared by every session and app process and kept across restarts
+
+    Entries are stored in one subdirectory per dataset version, dataframes as parquet and arrays such as row
+    positions as .npy. Reading an entry refreshes its modification time, and the least recently used entries
+    are evicted once the current version holds more than `max_bytes`. The first access with a new dataset
+    version, i.e. after prepare() published a new artifact, removes the versions beyond the `keep_versions` most
+    recently written ones, which leaves theirs to app processes still serving an older snapshot.
+
+    Storing is best effort: a result that cannot be written, e.g. because another process pruned its version
+    at the same time, is simply not cached.
+
+    Args:
+        cache_dir [string]: directory of the cache
+        max_bytes [int]: size budget of the cache in bytes, 0 to disable caching
+        keep_versions [int]: number of dataset versions kept
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, keep_versions=3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.keep_versions = keep_versions
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._version = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _use_version(self, version: str) -> str:
+        """
+        Function to switch to the directory of a dataset version, pruning the oldest versions
+        """
+        version_dir = os.path.join(self.cache_dir, version)
+        if version != self._version:
+            os.makedirs(version_dir, exist_ok=True)
+            # the switch counts as a write, so that the version is not the next one pruned
+            os.utime(version_dir)
+            self._prune(version)
+            self._version = version
+            self._bytes = sum(entry.stat().st_size for entry in os.scandir(version_dir))
+        return version_dir
+
+    def _prune(self, version: str):
+        """
+        Function to remove the versions beyond the `keep_versions` most recently written ones, never `version`
+        """
+        versions = {}
+        for entry in os.scandir(self.cache_dir):
+            # another process may be pruning at the same time
+            try:
+                versions[entry.name] = entry.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+        for name in sorted(versions, key=versions.get, reverse=True)[self.keep_versions:]:
+            if name != version:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+    def get(self, version: str, key: str):
+        """
+        Function to read a cached result
+
+        Args:
+            version [string]: version of the dataset the result was computed from, see `serving.dataset_version()`
+            key [string]: key of the result, e.g. a `query.spec_key()` with a prefix naming the kind of result
+
+        Returns:
+            value [dataframe or np.ndarray]: the cached result, None on a miss
+        """
+        if not self.max_bytes or version is None:
+            return None
+
+        try:
+            with self._lock:
+                version_dir = self._use_version(version)
+        except OSError:
+            self.misses += 1
+            return None
+
+        for kind, suffix in SUFFIXES.items():
+            path = os.path.join(version_dir, f'{key}{suffix}')
+            try:
+                value = pd.read_parquet(path) if kind is pd.DataFrame else np.load(path)
+                # the modification time orders entries for eviction
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        return None
+
+    def put(self, version: str, key: str, value):
+        """
+        Function to store a result, evicting the least recently used entries if the cache exceeds its budget
+
+        Args:
+            version [string]: version of the dataset the result was computed from
+            key [string]: key of the result
+            value [dataframe or np.ndarray]: the result
+        """
+        if not self.max_bytes or version is None:
+            return
+
+        path = tmp_path = None
+        try:
+            with self._lock:
+                version_dir = self._use_version(version)
+            # another process may have pruned the version since this one switched to it
+            os.makedirs(version_dir, exist_ok=True)
+
+            path = os.path.join(version_dir, f'{key}{SUFFIXES[type(value)]}')
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            if isinstance(value, pd.DataFrame):
+                # parquet requires string column names, e.g. for the flat types of a pivot
+                value = value.set_axis([str(col) for col in value.columns], axis=1)
+                value.to_parquet(tmp_path, index=False)
+            else:
+                with open(tmp_path, mode='wb') as tmpfile:
+                    np.save(tmpfile, value)
+            os.replace(tmp_path, path)
+
+            with self._lock:
+                self._bytes += os.path.getsize(path)
+                if self._bytes > self.max_bytes:
+                    self._evict(version_dir)
+        except OSError:
+            # the result is returned all the same, only not cached
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def fetch(self, version: str, key: str, compute):
+        """
+        Function to read a cached result, computing and storing it on a miss
+
+        Args:
+            version [string]: version of the dataset the result is computed from
+            key [string]: key of the result
+            compute [callable]: function without arguments computing the result
+
+        Returns:
+            value [dataframe or np.ndarray]: the result
+        """
+        value = self.get(version, key)
+        if value is None:
+            value = compute()
+            self.put(version, key, value)
+        return value
+
+    def _evict(self, version_dir: str):
+        """
+        Function to remove the least recently used entries until the cache fits its budget, rescanning the
+        directory since other processes share it
+        """
+        entries = []
+        for entry in os.scandir(version_dir):
+            try:
+                if not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            except FileNotFoundError:
+                continue
+        entries.sort()
+        self._bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """
+        Function to summarise the use of the cache by this process
+
+        Returns:
+            stats [dict]: hits, misses, hit rate, evictions and bytes held by the current version
+        """
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / requests, 4) if requests else None,
+            'evictions': self.evictions,
+            'bytes': self._bytes
+        }
+
+
+def shared_result_cache(cache_dir: str, max_bytes: int, keep_versions=3) -> ResultCache:
+    """
+    Function to open the result cache of a directory once per process, so that every page shares its counters
+    and its view of the current version
+
+    Args:
+        cache_dir [string]: directory of the cache
+        max_bytes [int]: size budget of the cache in bytes, 0 to disable caching
+        keep_versions [int]: number of dataset versions kept
+
+    Returns:
+        cache [ResultCache]: the cache of the directory
+    """
+    with _shared_lock:
+        if cache_dir not in _shared:
+            _shared[cache_dir] = ResultCache(cache_dir, max_bytes, keep_versions=keep_versions)
+        return _shared[cache_dir]
@@ -0,0 +1,34 @@
+import os
+from functools import lru_cache
+
+import yaml
+
+CONFIG_FILE = "config.yml"
+
+# the C loader of libyaml is several times faster, where PyYAML was built with it
+_Loader = getattr(yaml, 'CLoader', yaml.Loader)
+
+
+@lru_cache(maxsize=4)
+def _parse_config(path: str, mtime_ns: int) -> dict:
+    """
+    Function to parse the configuration file, once per modification of the file
+    """
+    with open(path, encoding="utf-8", mode='r') as ymlfile:
+        return yaml.load(ymlfile, Loader=_Loader)
+
+
+def load_config(path=CONFIG_FILE) -> dict:
+    """
+    Function to read the configuration settings, parsed once per process and again only after the file changes
+
+    Streamlit re-executes page scripts on every rerun, so this replaces parsing the file on each rerun.
+    The returned dict is shared by every caller and must not be modified.
+
+    Args:
+        path [string]: path of the YAML configuration file
+
+    Returns:
+        cfg [dict]: the configuration settings
+    """
+    return _parse_config(path, os.stat(path).st_mtime_ns)
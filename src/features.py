@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+# first month covered by the data.gov.sg resale datasets, used as month ordinal 0
+BASE_YEAR = 1990
+
+
+def month_ordinal(month: pd.Series) -> pd.Series:
+    """
+    Function to convert 'YYYY-MM' strings into the number of months since January 1990
+
+    Args:
+        month [series]: transaction months as 'YYYY-MM' strings
+
+    Returns:
+        ordinal [series]: months since January 1990 as int16, -1 where the month is missing or not a valid 'YYYY-MM'
+
+    """
+    # only a few hundred distinct months exist, so parse the uniques and broadcast through the codes
+    codes, uniques = pd.factorize(month)
+    uniques = pd.Series(uniques, dtype=str)
+    parts = uniques.str.extract(r'^(\d{4})-(\d{2})$').astype('float64')
+    unique_ordinals = (parts[0] - BASE_YEAR) * 12 + parts[1] - 1
+    is_valid = (parts[0] >= BASE_YEAR) & parts[1].between(1, 12)
+
+    # NaN months get the code -1, which picks the appended invalid marker
+    unique_ordinals = np.append(unique_ordinals.where(is_valid, -1).to_numpy(), -1)
+
+    return pd.Series(unique_ordinals[codes], index=month.index, dtype='int16')
+
+
+def ordinal_to_month(ordinal) -> pd.Series:
+    """
+    Function to convert month ordinals back into 'YYYY-MM' strings
+
+    Args:
+        ordinal [series]: months since January 1990
+
+    Returns:
+        month [series]: months as 'YYYY-MM' strings
+
+    """
+    ordinal = pd.Series(ordinal).astype('int64')
+    year = (ordinal // 12 + BASE_YEAR).astype(str)
+    month = (ordinal % 12 + 1).astype(str).str.zfill(2)
+    return year + '-' + month
+
+
+def parse_storey_range(storey_range: pd.Series) -> pd.DataFrame:
+    """
+    Function to split storey ranges such as '07 TO 09' into numeric bounds
+
+    Args:
+        storey_range [series]: storey ranges as 'LL TO HH' strings
+
+    Returns:
+        storeys [dataframe]: `storey_low` and `storey_high` as int8 and `storey_mid` as float32
+
+    Raises:
+        ValueError: if a storey range is missing or not in the 'LL TO HH' format, e.g. when `transform()` ran
+            without a validator to quarantine it
+
+    """
+    codes, uniques = pd.factorize(storey_range)
+    bounds = pd.Series(uniques, dtype=str).str.extract(r'^\s*(\d+)\s*TO\s*(\d+)\s*$').astype('float64').to_numpy()
+
+    # a NaN bound would be cast to an arbitrary integer
+    invalid = list(np.asarray(uniques, dtype=object)[np.isnan(bounds).any(axis=1)])
+    if (codes < 0).any():
+        invalid.append(None)
+    if invalid:
+        raise ValueError(f"storey ranges not in the 'LL TO HH' format: {invalid}")
+    bounds = bounds[codes]
+
+    return pd.DataFrame({
+        'storey_low': bounds[:, 0].astype('int8'),
+        'storey_high': bounds[:, 1].astype('int8'),
+        'storey_mid': bounds.mean(axis=1).astype('float32')
+    }, index=storey_range.index)
+
+
+def order_storey_ranges(storey_range: pd.Series) -> list:
+    """
+    Function to order the distinct storey ranges from the lowest storeys up, e.g. as the categories of a chart
+
+    Args:
+        storey_range [series]: storey ranges as 'LL TO HH' strings
+
+    Returns:
+        storey_ranges [list]: distinct storey ranges by their lowest, then highest storey
+
+    """
+    uniques = pd.Series(pd.unique(storey_range.dropna()), dtype=str)
+    storeys = parse_storey_range(uniques)
+    return uniques.iloc[np.lexsort((storeys['storey_high'], storeys['storey_low']))].tolist()
+
+
+def materialize_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Function to precompute the derived columns used by the pages, so that they are never derived at render time
+
+    Args:
+        df [dataframe]: transformed pandas dataframe with `month`, `storey_range`, `floor_area_sqm`,
+            `resale_price` and `lease_commence_date` columns
+
+    Returns:
+        df [dataframe]: pandas dataframe with the derived columns added
+            - `year` (int16) and `month_ordinal` (int16, months since January 1990)
+            - `resale_price_thousands` and `price_per_sqm` (float32)
+            - `storey_low`, `storey_high` (int8) and `storey_mid` (float32)
+            - `lease_at_transaction` (float32), years of the lease used up when the flat was sold
+
+    """
+    ordinal = month_ordinal(df['month'])
+    df['month_ordinal'] = ordinal.to_numpy()
+    df['year'] = (ordinal.to_numpy() // 12 + BASE_YEAR).astype('int16')
+
+    price = df['resale_price'].to_numpy(dtype='float64')
+    df['resale_price_thousands'] = (price / 1000).astype('float32')
+    df['price_per_sqm'] = (price / df['floor_area_sqm'].to_numpy(dtype='float64')).astype('float32')
+
+    storeys = parse_storey_range(df['storey_range'])
+    for col in storeys.columns:
+        df[col] = storeys[col].to_numpy()
+
+    # leases start at the beginning of the commencement year, the sale happens within its month
+    transaction_years = BASE_YEAR + ordinal.to_numpy() / 12
+    df['lease_at_transaction'] = (transaction_years - df['lease_commence_date'].to_numpy()).astype('float32')
+
+    return df
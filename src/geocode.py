@@ -1,100 +1,170 @@
-import yaml
+import os
+
+import numpy as np
 import pandas as pd
+from geopy.exc import GeopyError
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
-import time
-from math import ceil
-from src.utility import transform, read_concat_csv_to_df
+from src.config import load_config
+from src.metrics import RunMetrics
+from src.validation import Validator
+from src.address import AddressIndex
+from src.storage import storage_profile, write_artifact
+from src.snapshot import Snapshot, current_path, published_files
 
 
-def geocode():
+def seed_coordinates(addresses: AddressIndex, path_filename: str) -> int:
     """
-    Function to perform geocoding on a CSV file and output the results in batches as separate CSV files
+    Function to record in the address dimension the coordinates of transactions geocoded before the dimension
+    existed, e.g. the 2015 geocoded artifact, so that their addresses are never looked up again
 
-    Inputs:
-    None
+    Args:
+        addresses [AddressIndex]: the address dimension
+        path_filename [string]: geocoded transactions with `Lat` and `Lon` columns, and either `block` and
+            `street_name` or the `address_id` of the dimension
 
-    Outputs:
-    None
+    Returns:
+        seeded [int]: number of addresses whose coordinates were recorded
     """
-    # Load configuration settings from YAML file
-    with open("config.yml", encoding="utf-8",mode='r') as ymlfile:
-        cfg = yaml.load(ymlfile, Loader=yaml.Loader)
-        csv_path = cfg['geocode']['csv_path']
-        csv_fname = cfg['geocode']['csv_fname']
-        batch_size = cfg['geocode']['batch_size']
-        artifacts_path = cfg['geocode']['artifacts_path']
-
-    # Creating an instance of the Nominatim class from the geopy library for geocoding
-    geolocator = Nominatim(user_agent="my_request")
-
-    # Applying the rate limiter wrapper from the geopy library to prevent overloading the geocoding API
-    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=0.1)
-
-    start_time = time.time()
-
-    # Read input CSV file using pandas
-    df_2015 = pd.read_csv(f'{csv_path}/{csv_fname}')
-
-    # Apply data transformation using a function from an imported utility module
-    df_transformed = transform(df_2015)
+    if not path_filename or not os.path.exists(path_filename):
+        return 0
 
-    # Print the number of rows in the transformed data frame
-    print(len(df_transformed))
+    df_seed = pd.read_parquet(path_filename).dropna(subset=['Lat', 'Lon'])
+    if 'address_id' in df_seed.columns:
+        ids = df_seed['address_id'].to_numpy(dtype='int64')
+    else:
+        ids = addresses.assign(df_seed['block'], df_seed['street_name'])
 
-    # Calculate the number of batches needed based on the batch size and the length of the data frame
-    batch_count = ceil(len(df_transformed)/batch_size)
-    batch_counter = 0
-    l_index, r_index = 0, batch_size
+    # one row per address, and only where no lookup was recorded yet
+    df_seed = pd.DataFrame({'address_id': ids, 'lat': df_seed['Lat'].to_numpy(), 'lon': df_seed['Lon'].to_numpy()})
+    df_seed = df_seed.drop_duplicates('address_id')
+    df_seed = df_seed.loc[df_seed['address_id'].isin(addresses.unresolved(df_seed['address_id']))]
+    addresses.set_coordinates(df_seed['address_id'], df_seed['lat'], df_seed['lon'])
+    return len(df_seed)
 
-    # Loop through each batch of data
-    for _ in range(batch_count):
-        # Create a dictionary to track progress and batch information
-        batch_progress = {'batch_counter': batch_counter, 'l_index': l_index}
 
-        # Slice the data frame to create the current batch
-        df_batch = df_2015[l_index:r_index]
-
-        # Increment the batch counter and update the left and right index references for the next batch
-        batch_counter += 1
-        l_index, r_index = r_index, r_index + batch_size
-
-        # Print progress information for the current batch
-        print(f"""
-        {batch_progress}
-        """)
-
-        # Apply the geocoding method to the 'full_address' column of the batch data frame
-        df_batch['location'] = df_batch['full_address'].apply(geocode)
-        df_batch['Lat'] = df_batch['location'].apply(lambda x: x.latitude if x else None)
-        df_batch['Lon'] = df_batch['location'].apply(lambda x: x.longitude if x else None)
-
-        # Persist the current batch as a separate CSV file
-        df_batch.to_csv(f'{artifacts_path}/df_2015_{batch_counter-1}.csv')
-
-    end_time = time.time()
+def geocode():
+    """
+    Function to geocode the addresses of the published dataset that no earlier run has looked up, and publish
+    the geocoded transactions of every year
 
-    # Print the total time taken to process all batches
-    time_taken = (end_time - start_time)/60
-    print(time_taken)
+    Coordinates are kept per address in the address dimension, so each run only sends the addresses first seen
+    since the previous run to the geocoding API, however many years the dataset covers.
 
-def geocode_combine():
-    """Combine geocode files and save the result as a parquet file."""
+    Inputs:
+    None
 
+    Outputs:
+    None
+    """
     # Load configuration settings from YAML file
-    with open("config.yml", encoding="utf-8", mode='r') as ymlfile:
-        cfg = yaml.load(ymlfile, Loader=yaml.Loader)
+    cfg = load_config()
+    geocode_cfg = cfg['geocode']
+    validation_cfg = cfg['validation']
+    artifacts_path = cfg['etl']['artifacts_path']
+    address_file = cfg['address']['artifact_file']
+    log_file = cfg['metrics']['log_file']
+    prometheus_textfile_dir = cfg['metrics']['prometheus_textfile_dir']
+
+    run = RunMetrics('geocode')
+    validator = Validator.from_config(validation_cfg)
+
+    # Read the transactions and the address dimension published by prepare; the lookups take long, so they run
+    # without the publish lock and are applied to whatever snapshot is current once they are done
+    snapshot_path = current_path(artifacts_path)
+    with run.stage('read') as record:
+        address_ids = pd.read_parquet(f'{snapshot_path}/hdb_resale.parquet', columns=['address_id'])['address_id']
+        addresses = AddressIndex.load(f'{snapshot_path}/{address_file}')
+        record['rows'] = len(address_ids)
+
+    with run.stage('seed') as record:
+        record['rows'] = seed_coordinates(addresses, geocode_cfg['seed_file'])
+
+    # only the distinct addresses not looked up before are sent to the geocoding API, at most max_lookups per run
+    with run.stage('diff') as record:
+        address_count = address_ids.nunique()
+        pending = addresses.unresolved(address_ids, retry_failed=geocode_cfg['retry_failed'])
+        record['rows'], record['cache_hits'] = address_count, address_count - len(pending)
+        if geocode_cfg['max_lookups']:
+            pending = pending[:geocode_cfg['max_lookups']]
+    print(f"Geocoding {len(pending)} of {address_count} addresses")
 
-        # Get the paths for the input and output files from the configuration settings
-        geocode_files_path = cfg['geocode_combine']['geocode_files_path']
-        artifacts_path = cfg['geocode_combine']['artifacts_path']
+    # Creating an instance of the Nominatim class from the geopy library for geocoding
+    geolocator = Nominatim(user_agent="my_request")
 
-    # Read and concatenate CSV files into a Pandas DataFrame
-    df_geocode_combine = read_concat_csv_to_df(geocode_files_path)
+    # count every request sent, so that retries by the rate limiter show up in the metrics
+    request_count = [0]
+
+    def counted_geocode(query, *args, **kwargs):
+        request_count[0] += 1
+        return geolocator.geocode(query, *args, **kwargs)
+
+    # Applying the rate limiter wrapper from the geopy library to prevent overloading the geocoding API; errors
+    # that outlast its retries are raised, so that an outage is not recorded as addresses without coordinates
+    geocode = RateLimiter(counted_geocode, min_delay_seconds=0.1, swallow_exceptions=False)
+
+    full_address = addresses.frame()['full_address'].to_numpy()
+    looked_up_ids, looked_up = [], []
+    batch_size = geocode_cfg['batch_size']
+    for batch_counter, l_index in enumerate(range(0, len(pending), batch_size)):
+        batch_ids = pending[l_index:l_index + batch_size]
+
+        with run.stage('geocode_batch', rows=len(batch_ids)) as record:
+            record['batch'] = batch_counter
+            requests_before = request_count[0]
+            coordinates = []
+            try:
+                for address_id in batch_ids:
+                    location = geocode(full_address[address_id])
+                    coordinates.append((location.latitude, location.longitude) if location else (np.nan, np.nan))
+            except GeopyError as err:
+                # keep the addresses resolved so far, the others are looked up by the next run
+                print(f"Geocoding stopped after {l_index + len(coordinates)} addresses: {err!r}")
+                record['error'] = repr(err)
+            record['retries'] = request_count[0] - requests_before - len(coordinates)
+
+            looked_up_ids.extend(batch_ids[:len(coordinates)])
+            looked_up.extend(coordinates)
+
+        if 'error' in record:
+            break
+
+    coordinates = np.array(looked_up, dtype='float64').reshape(-1, 2)
+
+    # a prepare run may have published new transactions and addresses during the lookups: under the publish lock,
+    # the coordinates are recorded in the address dimension of the snapshot current now, whose ids are those the
+    # lookups were made for since ids never change, and applied to its transactions
+    with Snapshot(artifacts_path, published_files(cfg), keep=cfg['snapshot']['keep']) as snapshot:
+        with run.stage('read_current') as record:
+            df_geocoded = pd.read_parquet(f'{snapshot.path}/hdb_resale.parquet')
+            addresses = AddressIndex.load(f'{snapshot.path}/{address_file}')
+            seed_coordinates(addresses, geocode_cfg['seed_file'])
+            addresses.set_coordinates(looked_up_ids, coordinates[:, 0], coordinates[:, 1])
+            record['rows'] = len(df_geocoded)
+
+        # Apply the coordinates through the address id of each transaction, then quarantine the transactions
+        # without coordinates, or geocoded outside Singapore
+        with run.stage('transform', rows=len(df_geocoded)):
+            df_geocoded['Lat'], df_geocoded['Lon'] = addresses.coordinates(df_geocoded['address_id'])
+            is_valid = validator.check_coordinates(df_geocoded)
+            df_geocoded = df_geocoded.loc[is_valid]
+
+        summary = validator.write(
+            f"{artifacts_path}/{validation_cfg['geocode_quarantine_file']}",
+            f"{artifacts_path}/{validation_cfg['geocode_report_file']}"
+        )
+        print(f"Quarantined {summary['rows_quarantined']} of {summary['rows_checked']} rows: {summary['issues']}")
+
+        # keep the coordinates in the address dimension, so that later runs and prepare reuse them; both artifacts
+        # are published together with the other artifacts carried over
+        with run.stage('write', rows=len(df_geocoded)) as record:
+            addresses.write(f'{snapshot.path}/{address_file}')
+            record['bytes'] = write_artifact(df_geocoded, f"{snapshot.path}/{cfg['geospatial']['artifact_file']}",
+                                             storage_profile(cfg))
+
+    # persist the stage metrics of this run
+    run.write(log_file=log_file, prometheus_textfile_dir=prometheus_textfile_dir)
 
-    # Write the resulting DataFrame to a parquet file
-    df_geocode_combine.to_parquet(f'{artifacts_path}/2015_geocoded.parquet')
 
 if __name__ == "__main__":
     geocode()
-    geocode_combine()
@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .query import filter_mask
+from .timeseries import histogram_medians
+
+# bump whenever the layout of the store changes, so that stale stores are ignored instead of misread
+STORE_VERSION = "1"
+GROUP_COLS = ['year', 'town', 'flat_type', 'flat_model']
+
+
+def aggregate_group_stats(df: pd.DataFrame, bin_width: int) -> pd.DataFrame:
+    """
+    Function to aggregate transactions into yearly price histograms per (town, flat_type, flat_model)
+
+    The groups follow the sidebar filters, so any selection of years, towns, flat types and flat models
+    is a subset of the groups, and its medians can be estimated from the summed histograms.
+
+    Args:
+        df [dataframe]: transactions with `year`, `town`, `flat_type`, `flat_model` and `resale_price` columns
+        bin_width [int]: width of a price bin in S$
+
+    Returns:
+        df_stats [dataframe]: one row per (year, town, flat_type, flat_model, price_bin) with the number of
+            transactions, the string columns as categoricals
+
+    """
+    df_bins = pd.DataFrame({col: df[col].to_numpy() for col in GROUP_COLS})
+    df_bins['price_bin'] = (df['resale_price'].to_numpy() // bin_width).astype('int32')
+
+    df_stats = (df_bins
+                .groupby(GROUP_COLS + ['price_bin'], sort=True, observed=True)
+                .size()
+                .reset_index(name='count'))
+
+    return df_stats.astype({'year': 'int16', 'town': 'category', 'flat_type': 'category',
+                            'flat_model': 'category', 'price_bin': 'int32', 'count': 'int32'})
+
+
+def write_group_stats(df_stats: pd.DataFrame, path: str, bin_width: int):
+    """
+    Function to persist the group statistics, with the layout version and bin width in the parquet metadata
+
+    Args:
+        df_stats [dataframe]: output of `aggregate_group_stats()`
+        path [string]: path of the parquet store, replaced atomically
+        bin_width [int]: width of a price bin in S$
+    """
+    table = pa.Table.from_pandas(df_stats, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({b'store_version': STORE_VERSION.encode(), b'bin_width': str(bin_width).encode()})
+
+    tmp_path = f'{path}.tmp'
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_group_stats(path: str, bin_width=None):
+    """
+    Function to read the group statistics, ignoring stores of another version or bin width
+
+    Args:
+        path [string]: path of the parquet store
+        bin_width [int]: expected width of a price bin in S$, or None to accept any
+
+    Returns:
+        df_stats [dataframe]: histogram rows, or None if there is no usable store
+        bin_width [int]: width of a price bin the store was built with
+
+    """
+    if not os.path.exists(path):
+        return None, bin_width
+
+    table = pq.read_table(path)
+    metadata = table.schema.metadata or {}
+    store_version = metadata.get(b'store_version', b'').decode()
+    store_bin_width = int(metadata.get(b'bin_width', b'0'))
+
+    if store_version != STORE_VERSION or (bin_width is not None and store_bin_width != bin_width):
+        return None, bin_width
+
+    return table.to_pandas(), store_bin_width
+
+
+def median_pivot(df_stats: pd.DataFrame, bin_width: int, filters: dict, index='town', columns='flat_type') -> pd.DataFrame:
+    """
+    Function to estimate the median resale price across two group columns from the group statistics,
+    without going back to the transactions
+
+    Args:
+        df_stats [dataframe]: histogram rows from `load_group_stats()`
+        bin_width [int]: width of a price bin in S$
+        filters [dict]: filters in the query spec format of src.query
+        index [string]: group column whose values become the rows of the pivot
+        columns [string]: group column whose values become the columns of the pivot
+
+    Returns:
+        df_pivot [dataframe]: estimated medians, NaN where a combination has no transactions
+
+    """
+    df_sel = df_stats.loc[filter_mask(df_stats, filters)]
+    if df_sel.empty:
+        return pd.DataFrame(index=pd.Index([], name=index), columns=pd.Index([], name=columns), dtype='float64')
+
+    row_codes, row_values = pd.factorize(df_sel[index], sort=True)
+    col_codes, col_values = pd.factorize(df_sel[columns], sort=True)
+    price_bins = df_sel['price_bin'].to_numpy()
+    first_bin = int(price_bins.min())
+    n_bins = int(price_bins.max()) - first_bin + 1
+
+    # dense (rows x columns) x bins histogram, summed over every selected group in one pass
+    cells = row_codes.astype('int64') * len(col_values) + col_codes
+    hist = np.bincount(
+        cells * n_bins + (price_bins - first_bin),
+        weights=df_sel['count'].to_numpy(),
+        minlength=len(row_values) * len(col_values) * n_bins
+    ).reshape(-1, n_bins)
+
+    medians = histogram_medians(hist, first_bin, bin_width).reshape(len(row_values), len(col_values))
+
+    return pd.DataFrame(
+        medians,
+        index=pd.Index(np.asarray(row_values), name=index),
+        columns=pd.Index(np.asarray(col_values), name=columns)
+    )
+
+
+def build_group_stats(df: pd.DataFrame, path: str, bin_width: int) -> int:
+    """
+    Function to aggregate and persist the group statistics of the prepared dataset
+
+    Args:
+        df [dataframe]: the prepared dataset
+        path [string]: path of the parquet store
+        bin_width [int]: width of a price bin in S$
+
+    Returns:
+        rows [int]: number of histogram rows written
+    """
+    df_stats = aggregate_group_stats(df, bin_width)
+    write_group_stats(df_stats, path, bin_width)
+    return len(df_stats)
@@ -0,0 +1,149 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+# every Streamlit session reruns its script on its own thread, so per-rerun records are thread-local
+_state = threading.local()
+
+
+def begin_rerun(page: str):
+    """
+    Start recording the stages of a page rerun
+
+    Args:
+        page [string]: name of the page being rendered
+    """
+    _state.rerun = {
+        'page': page,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'stages': []
+    }
+    _state.started = time.perf_counter()
+
+
+def _rows(value):
+    """
+    Function to count the rows of a dataframe argument or result, None for anything else
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
+
+
+@contextmanager
+def stage(name: str, rows_in=None):
+    """
+    Context manager timing one stage of the current rerun
+
+    Args:
+        name [string]: name of the stage, e.g. 'agg_date' or 'render charts'
+        rows_in [int]: number of input rows, if known
+
+    Yields:
+        record [dict]: the stage record, whose `rows_out` and `cache` entries the caller may fill in
+    """
+    record = {'stage': name, 'seconds': None, 'cache': None, 'rows_in': rows_in, 'rows_out': None}
+    start_time = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = round(time.perf_counter() - start_time, 6)
+        rerun = getattr(_state, 'rerun', None)
+        if rerun is not None:
+            rerun['stages'].append(record)
+
+
+def cached_stage(name: str, resource=False, **cache_kwargs):
+    """
+    Drop-in replacement for `st.cache_data` that records each call as a stage of the current rerun,
+    including whether the call was served from the cache
+
+    Args:
+        name [string]: name of the stage
+        resource [bool]: cache with `st.cache_resource` instead, returning the same object to every session
+            rather than a copy, e.g. for a dataset memory-mapped from disk
+        **cache_kwargs: keyword arguments passed on to the cache decorator, e.g. ttl=300
+
+    Returns:
+        decorator [callable]: decorator for the page helper
+    """
+    def decorator(func):
+
+        # only runs on a cache miss; `functools.wraps` keeps the cache key tied to `func`'s source
+        @functools.wraps(func)
+        def compute(*args, **kwargs):
+            _state.miss = True
+            return func(*args, **kwargs)
+
+        cached = (st.cache_resource if resource else st.cache_data)(**cache_kwargs)(compute)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows_in = next((_rows(arg) for arg in (*args, *kwargs.values()) if _rows(arg) is not None), None)
+            # a cached stage called while computing another one must not clear the flag of the outer call
+            outer_miss = getattr(_state, 'miss', False)
+            _state.miss = False
+            try:
+                with stage(name, rows_in=rows_in) as record:
+                    result = cached(*args, **kwargs)
+                    record['cache'] = 'miss' if _state.miss else 'hit'
+                    record['rows_out'] = _rows(result)
+            finally:
+                _state.miss = outer_miss
+            return result
+
+        wrapper.clear = cached.clear
+        return wrapper
+
+    return decorator
+
+
+def end_rerun(log_file=None, debug_panel=False):
+    """
+    Finish recording the current rerun, append it to the log file and optionally show it in the sidebar
+
+    Args:
+        log_file [string]: path of the JSON-lines log to append the rerun to, None to skip logging
+        debug_panel [bool]: render the timings in a sidebar panel
+
+    Returns:
+        rerun [dict]: the rerun record with its stages and total time, None if no rerun was being recorded
+    """
+    rerun = getattr(_state, 'rerun', None)
+    if rerun is None:
+        return None
+    rerun['total_seconds'] = round(time.perf_counter() - _state.started, 6)
+    _state.rerun = None
+
+    if log_file:
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        with open(log_file, encoding="utf-8", mode='a') as logfile:
+            logfile.write(json.dumps(rerun) + '\n')
+
+    # the panel can also be switched on for a single session with the ?debug=1 query parameter
+    if debug_panel or st.experimental_get_query_params().get('debug') == ['1']:
+        render_debug_panel(rerun)
+
+    return rerun
+
+
+def render_debug_panel(rerun: dict):
+    """
+    Render the stage timings of a rerun in the sidebar
+
+    Args:
+        rerun [dict]: rerun record built by `begin_rerun()` and `end_rerun()`
+    """
+    df_stages = pd.DataFrame(rerun['stages'], columns=['stage', 'seconds', 'cache', 'rows_in', 'rows_out'])
+
+    with st.sidebar.expander("Performance (this rerun)", expanded=True):
+        col1, col2 = st.columns(2)
+        col1.metric("Total (s)", f"{rerun['total_seconds']:.3f}")
+        col2.metric("Cache hits", f"{(df_stages['cache'] == 'hit').sum()} / {df_stages['cache'].notna().sum()}")
+        st.dataframe(df_stages, use_container_width=True)
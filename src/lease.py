@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+# matches every text format published on data.gov.sg, e.g. '56 years', '08 years', '68 years 03 months', '1 year 1 month'
+LEASE_PATTERN = r'^\s*(?:(\d+)\s*years?)?\s*(?:(\d+)\s*months?)?\s*$'
+
+
+def parse_lease_months(values: pd.Series) -> pd.Series:
+    """
+    Function to parse `remaining_lease` values of any published format into a number of months
+
+    The column only ever holds a few thousand distinct values, so each distinct value is parsed once
+    and the result is broadcast back to the rows through the factorized codes.
+
+    Args:
+        values [series]: `remaining_lease` values, e.g. '68 years 03 months', '56 years', 70 or NaN
+
+    Returns:
+        lease_months [series]: remaining lease in months as nullable Int16, <NA> where missing or unparseable
+
+    """
+    # single hashing pass over the rows; NaN rows get the code -1
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object)
+
+    # plain numbers (ints, or numeric strings) are already whole years
+    numeric_years = pd.to_numeric(uniques, errors='coerce')
+
+    # text values are split into their years and months parts
+    parts = uniques.astype(str).str.extract(LEASE_PATTERN)
+    years = pd.to_numeric(parts[0])
+    months = pd.to_numeric(parts[1])
+    text_months = years.fillna(0) * 12 + months.fillna(0)
+    text_months = text_months.where(years.notna() | months.notna())
+
+    unique_months = np.round(numeric_years * 12).fillna(text_months).to_numpy(dtype='float64')
+
+    # broadcast back to rows, with missing values for NaN inputs
+    lease_months = np.append(unique_months, np.nan)[codes]
+
+    return pd.Series(lease_months, index=values.index, name='remaining_lease_months').astype('Int16')
+
+
+def lease_months_to_years(lease_months):
+    """
+    Function to convert a number of months into years, rounded off to the nearest integer
+
+    Args:
+        lease_months [series]: remaining lease in months
+
+    Returns:
+        lease_years [series]: remaining lease in years, rounded half to even like Python's `round()`
+
+    """
+    return np.round(lease_months / 12).astype('int64')
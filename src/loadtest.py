@@ -0,0 +1,350 @@
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import streamlit as st
+from streamlit.runtime.scriptrunner import ScriptRunContext, add_script_run_ctx
+from streamlit.runtime.state import SafeSessionState, SessionState
+from streamlit.runtime.uploaded_file_manager import UploadedFileManager
+
+from . import instrument
+
+# the Geospatial page needs a Mapbox token in .streamlit/secrets.toml, add it with --pages 1 2 3 4
+DEFAULT_PAGES = ('1', '2', '4')
+DEFAULT_SESSIONS = (1, 4, 16)
+WIDGETS = ('select_slider', 'multiselect', 'slider', 'radio', 'selectbox', 'checkbox', 'text_input', 'number_input')
+
+# the session driving the widgets of the current thread, as every Streamlit session reruns on its own thread
+_session = threading.local()
+
+
+class RandomWidgets:
+    """
+    Stand-ins for the Streamlit input widgets, returning a random state of the sidebar and page controls on every
+    rerun instead of the default value a script run without a browser would get
+
+    Empty multiselects, which select every value, are as likely as a selection of one to three values, so that
+    both the warm default views and uncached selections are exercised.
+
+    Args:
+        rng [random.Random]: random generator of the session
+    """
+
+    SEARCHES = ('ANG MO KIO', 'TAMPINES', 'BEDOK NORTH', '4 ROOM', '10')
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+
+    def select_slider(self, label, options=(), value=None, **kwargs):
+        options = list(options)
+        # a range slider returns the two ends of the range
+        if isinstance(value, (tuple, list)):
+            start, end = sorted(self.rng.sample(range(len(options)), 2)) if len(options) > 1 else (0, 0)
+            return options[start], options[end]
+        return self.rng.choice(options)
+
+    def multiselect(self, label, options, default=None, max_selections=None, **kwargs):
+        options = list(options)
+        if not options or self.rng.random() < 0.5:
+            return []
+        size = min(self.rng.randint(1, 3), len(options), max_selections or len(options))
+        return self.rng.sample(options, size)
+
+    def slider(self, label, min_value=None, max_value=None, value=None, step=None, **kwargs):
+        step = step or 1
+        return min_value + step * self.rng.randint(0, (max_value - min_value) // step)
+
+    def radio(self, label, options, index=0, **kwargs):
+        return self.rng.choice(list(options))
+
+    def selectbox(self, label, options, index=0, **kwargs):
+        return self.rng.choice(list(options))
+
+    def checkbox(self, label, value=False, **kwargs):
+        return self.rng.random() < 0.5
+
+    def text_input(self, label, value="", **kwargs):
+        return self.rng.choice(self.SEARCHES) if self.rng.random() < 0.2 else value
+
+    def number_input(self, label, min_value=None, max_value=None, value=None, step=None, **kwargs):
+        return self.rng.randint(min_value, max_value) if min_value is not None and max_value is not None else value
+
+
+@contextmanager
+def random_widgets():
+    """
+    Context manager replacing the Streamlit input widgets with those of the session of the calling thread, and
+    restoring them on exit
+    """
+    originals = {name: getattr(st, name) for name in WIDGETS}
+
+    def dispatch(name):
+        def widget(*args, **kwargs):
+            widgets = getattr(_session, 'widgets', None)
+            return getattr(widgets, name)(*args, **kwargs) if widgets else originals[name](*args, **kwargs)
+        return widget
+
+    for name in WIDGETS:
+        setattr(st, name, dispatch(name))
+    try:
+        yield
+    finally:
+        for name, widget in originals.items():
+            setattr(st, name, widget)
+
+
+def load_page(prefix):
+    """
+    Function to import a Streamlit page script as a module, without running its `main()`
+
+    The reruns of the page are returned to the session instead of being appended to the rerun log.
+
+    Args:
+        prefix [string]: numeric prefix of the page file, e.g. '1'
+
+    Returns:
+        module [module]: the imported page script
+    """
+    path = glob.glob(f"pages/{prefix}_*.py")[0]
+    spec = importlib.util.spec_from_file_location(f"page_{prefix}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    module.log_file = None
+    module.end_rerun = lambda **kwargs: _session.reruns.append(instrument.end_rerun(**kwargs))
+    return module
+
+
+def rss_bytes() -> int:
+    """
+    Function to read the resident set size of this process, or its peak where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm', encoding="utf-8", mode='r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def session_context(session_id: str, sent: list) -> ScriptRunContext:
+    """
+    Function to create the script run context a Streamlit server gives a session; without one, `st.cache_data`
+    never returns a cached value
+
+    Args:
+        session_id [string]: id of the session
+        sent [list]: receives the size in bytes of every message the session would send to the browser
+
+    Returns:
+        ctx [ScriptRunContext]: context to attach to the thread running the session
+    """
+    return ScriptRunContext(
+        session_id=session_id,
+        _enqueue=lambda msg: sent.append(msg.ByteSize()),
+        query_string="",
+        session_state=SafeSessionState(SessionState()),
+        uploaded_file_mgr=UploadedFileManager(),
+        page_script_hash="",
+        user_info={'email': None}
+    )
+
+
+def run_session(pages: dict, reruns: int, seed: int, think_seconds=0.0) -> dict:
+    """
+    Function to simulate one user: `reruns` reruns of randomly chosen pages, each with a random widget state
+
+    Args:
+        pages [dict]: page modules keyed by prefix, from `load_page()`
+        reruns [int]: number of reruns of the session
+        seed [int]: seed of the session's random generator
+        think_seconds [float]: pause between two reruns
+
+    Returns:
+        session [dict]: the rerun records, each with its page, the errors raised by the pages, and the bytes
+            of the messages sent to the browser
+    """
+    rng = random.Random(seed)
+    _session.widgets = RandomWidgets(rng)
+    _session.reruns = []
+    errors = []
+    sent = []
+    ctx = session_context(f"loadtest-{seed}", sent)
+    add_script_run_ctx(threading.current_thread(), ctx)
+
+    for _ in range(reruns):
+        prefix = rng.choice(list(pages))
+        ctx.reset()
+        try:
+            pages[prefix].main()
+        except Exception:
+            errors.append({'page': prefix, 'error': traceback.format_exc().strip().splitlines()[-1],
+                           'line': traceback.extract_tb(sys.exc_info()[2])[-1].line})
+            instrument.end_rerun()
+        if think_seconds:
+            time.sleep(think_seconds)
+
+    return {'reruns': [rerun for rerun in _session.reruns if rerun is not None], 'errors': errors, 'bytes_sent': sum(sent)}
+
+
+def summarize(reruns: list) -> dict:
+    """
+    Function to summarize rerun records into latency percentiles and the cache hit rate
+
+    Args:
+        reruns [list]: rerun records from `instrument.end_rerun()`
+
+    Returns:
+        summary [dict]: number of reruns, p50/p95/p99 rerun latency, and share of cached stages served from cache
+    """
+    if not reruns:
+        return {'reruns': 0}
+    latencies = np.array([rerun['total_seconds'] for rerun in reruns])
+    cached = [stage['cache'] for rerun in reruns for stage in rerun['stages'] if stage['cache'] is not None]
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'reruns': len(reruns),
+        'p50_seconds': round(p50, 6),
+        'p95_seconds': round(p95, 6),
+        'p99_seconds': round(p99, 6),
+        'cache_hit_rate': round(cached.count('hit') / len(cached), 4) if cached else None
+    }
+
+
+def slowest_stages(reruns: list, top=5) -> list:
+    """
+    Function to rank the stages of the reruns by their 95th percentile time
+
+    Args:
+        reruns [list]: rerun records from `instrument.end_rerun()`
+        top [int]: number of stages to return
+
+    Returns:
+        stages [list]: page, stage, p95 time and number of calls of the slowest stages
+    """
+    timings = {}
+    for rerun in reruns:
+        for stage in rerun['stages']:
+            timings.setdefault((rerun['page'], stage['stage']), []).append(stage['seconds'])
+
+    ranked = sorted(((np.percentile(seconds, 95), key, len(seconds)) for key, seconds in timings.items()), reverse=True)
+    return [{'page': page, 'stage': name, 'p95_seconds': round(p95, 6), 'calls': calls}
+            for p95, (page, name), calls in ranked[:top]]
+
+
+def load_test(pages: dict, sessions: int, reruns: int, seed=0, think_seconds=0.0) -> dict:
+    """
+    Function to run `sessions` concurrent sessions against the pages, as one app process serves them
+
+    Resident memory is sampled every 50 ms while the sessions run, to report its growth and peak.
+
+    Args:
+        pages [dict]: page modules keyed by prefix, from `load_page()`
+        sessions [int]: number of concurrent sessions
+        reruns [int]: number of reruns per session
+        seed [int]: seed of the random widget states, session i uses seed + i
+        think_seconds [float]: pause between two reruns of a session
+
+    Returns:
+        results [dict]: latency and cache summary overall and per page, throughput, memory and errors
+    """
+    rss_before = rss_bytes()
+    rss_peak = [rss_before]
+    running = threading.Event()
+    running.set()
+
+    def sample():
+        while running.is_set():
+            rss_peak[0] = max(rss_peak[0], rss_bytes())
+            time.sleep(0.05)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start_time = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            results = list(pool.map(lambda i: run_session(pages, reruns, seed + i, think_seconds), range(sessions)))
+    finally:
+        wall_seconds = time.perf_counter() - start_time
+        running.clear()
+        sampler.join()
+
+    reruns_all = [rerun for result in results for rerun in result['reruns']]
+    errors = [error for result in results for error in result['errors']]
+    rss_after = rss_bytes()
+
+    return {
+        **summarize(reruns_all),
+        'reruns_per_second': round(len(reruns_all) / wall_seconds, 2),
+        'bytes_sent_per_rerun': round(sum(result['bytes_sent'] for result in results) / max(len(reruns_all), 1)),
+        'pages': {rerun_page: summarize([rerun for rerun in reruns_all if rerun['page'] == rerun_page])
+                  for rerun_page in sorted({rerun['page'] for rerun in reruns_all})},
+        'slowest_stages': slowest_stages(reruns_all),
+        'rss_before_bytes': rss_before,
+        'rss_after_bytes': rss_after,
+        'rss_peak_bytes': max(rss_peak[0], rss_after),
+        'rss_growth_bytes': rss_after - rss_before,
+        'errors': len(errors),
+        'error_samples': errors[:5]
+    }
+
+
+def main():
+    """
+    Load-test the pages with increasing numbers of concurrent sessions and print the results as JSON
+    """
+    parser = argparse.ArgumentParser(description="Simulate concurrent dashboard users against the page scripts")
+    parser.add_argument('--sessions', nargs='*', type=int, default=list(DEFAULT_SESSIONS),
+                        help="numbers of concurrent sessions, run one after another in the same process")
+    parser.add_argument('--reruns', type=int, default=20, help="reruns per session")
+    parser.add_argument('--pages', nargs='*', default=list(DEFAULT_PAGES),
+                        help="numeric prefixes of the pages to visit, e.g. 1 2 3 4")
+    parser.add_argument('--think', type=float, default=0.0, help="seconds between two reruns of a session")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random widget states")
+    parser.add_argument('--output', help="optional path of a JSON file to write the results to")
+    args = parser.parse_args()
+
+    rss_start = rss_bytes()
+    pages = {prefix: load_page(prefix) for prefix in args.pages}
+
+    # scripts run without a Streamlit server, whose warnings about the missing runtime would flood the output;
+    # set once the pages are loaded, as reading the Streamlit config resets the level
+    st.logger.set_log_level('error')
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'cpu_count': os.cpu_count(),
+            'reruns_per_session': args.reruns,
+            'pages': args.pages,
+            'rss_start_bytes': rss_start
+        }
+    }
+    # the caches stay warm from one level to the next, as in a long-running app process
+    with random_widgets():
+        for sessions in args.sessions:
+            results[f'{sessions}_sessions'] = load_test(
+                pages, sessions, args.reruns, seed=args.seed + 1000 * sessions, think_seconds=args.think
+            )
+
+    report = json.dumps(results, indent=2)
+    print(report)
+
+    if args.output:
+        with open(args.output, encoding="utf-8", mode='w') as outfile:
+            outfile.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import json
+import os
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import psutil
+
+
+def peak_rss_bytes():
+    """
+    Function to read the peak resident set size of the current process
+
+    Returns:
+        peak_rss [int]: peak resident memory in bytes, or the current resident memory where the peak is unavailable
+
+    """
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+    return psutil.Process().memory_info().rss
+
+
+class RunMetrics:
+    """
+    Structured metrics of one pipeline run, recorded stage by stage
+
+    Args:
+        job [string]: name of the pipeline job, e.g. 'prepare' or 'geocode'
+    """
+
+    def __init__(self, job: str):
+        self.job = job
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str, rows=None):
+        """
+        Context manager recording the duration and counters of one stage
+
+        Args:
+            name [string]: name of the stage, e.g. 'read', 'transform', 'geocode_batch'
+            rows [int]: number of rows processed, if known up front
+
+        Yields:
+            record [dict]: the stage record, whose `rows`, `retries` and `cache_hits` entries the caller may update
+        """
+        record = {
+            'run_id': self.run_id,
+            'job': self.job,
+            'stage': name,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'rows': rows,
+            'retries': 0,
+            'cache_hits': 0
+        }
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start_time
+            record['seconds'] = round(seconds, 6)
+            record['rows_per_second'] = round(record['rows'] / seconds, 1) if record['rows'] and seconds else None
+            record['peak_rss_bytes'] = peak_rss_bytes()
+            self.stages.append(record)
+            rows_note = f", {record['rows']} rows" if record['rows'] is not None else ''
+            print(f"[{self.job}] {name}: {record['seconds']:.2f}s{rows_note}")
+
+    def summary(self) -> dict:
+        """
+        Function to total the stages of the run
+
+        Returns:
+            summary [dict]: run-level record with the total duration, retries and cache hits of all stages
+        """
+        seconds = time.time() - self.started
+        return {
+            'run_id': self.run_id,
+            'job': self.job,
+            'stage': 'total',
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seconds': round(seconds, 6),
+            'retries': sum(record['retries'] for record in self.stages),
+            'cache_hits': sum(record['cache_hits'] for record in self.stages),
+            'peak_rss_bytes': peak_rss_bytes()
+        }
+
+    def write(self, log_file=None, prometheus_textfile_dir=None):
+        """
+        Persist the run, as JSON lines appended to `log_file` and as gauges in a Prometheus textfile
+
+        Args:
+            log_file [string]: path of the JSON-lines run log, None to skip
+            prometheus_textfile_dir [string]: node exporter textfile directory, None to skip; the gauges
+                of each job are written to their own `hdb_<job>.prom` file
+        """
+        records = self.stages + [self.summary()]
+
+        if log_file:
+            os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+            with open(log_file, encoding="utf-8", mode='a') as logfile:
+                for record in records:
+                    logfile.write(json.dumps(record) + '\n')
+
+        if prometheus_textfile_dir:
+            write_prometheus_textfile(records, os.path.join(prometheus_textfile_dir, f'hdb_{self.job}.prom'))
+
+
+def write_prometheus_textfile(records, path):
+    """
+    Function to export stage records as gauges in the Prometheus textfile format
+
+    Args:
+        records [list]: stage and summary records of a run
+        path [string]: path of the textfile, replaced atomically
+    """
+    from prometheus_client import CollectorRegistry, Gauge, write_to_textfile
+
+    registry = CollectorRegistry()
+    labels = ['job', 'stage']
+    gauges = {
+        'seconds': Gauge('hdb_pipeline_stage_seconds', 'Duration of the stage in seconds', labels, registry=registry),
+        'rows': Gauge('hdb_pipeline_stage_rows', 'Rows processed by the stage', labels, registry=registry),
+        'rows_per_second': Gauge('hdb_pipeline_stage_rows_per_second', 'Throughput of the stage', labels, registry=registry),
+        'retries': Gauge('hdb_pipeline_stage_retries', 'Retried requests in the stage', labels, registry=registry),
+        'cache_hits': Gauge('hdb_pipeline_stage_cache_hits', 'Cache hits in the stage', labels, registry=registry),
+        'peak_rss_bytes': Gauge('hdb_pipeline_peak_rss_bytes', 'Peak resident memory after the stage', labels, registry=registry)
+    }
+    last_success = Gauge('hdb_pipeline_last_success_timestamp_seconds', 'Completion time of the run', ['job'], registry=registry)
+
+    # repeated stages, such as geocode batches, are summed into one series per stage
+    totals = {}
+    for record in records:
+        key = (record['job'], record['stage'])
+        total = totals.setdefault(key, {})
+        for field in gauges:
+            value = record.get(field)
+            if value is None or field == 'rows_per_second':
+                continue
+            if field == 'peak_rss_bytes':
+                total[field] = max(total.get(field, 0), value)
+            else:
+                total[field] = total.get(field, 0) + value
+
+    for (job, stage), total in totals.items():
+        if total.get('rows') and total.get('seconds'):
+            total['rows_per_second'] = total['rows'] / total['seconds']
+        for field, value in total.items():
+            gauges[field].labels(job=job, stage=stage).set(value)
+        last_success.labels(job=job).set(time.time())
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    write_to_textfile(path, registry)
@@ -0,0 +1,252 @@
+import os
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import scipy.linalg
+import scipy.sparse
+
+from .config import load_config
+from .serving import dataset_version, load_serving_dataset
+from .snapshot import Snapshot, published_files
+
+# bump whenever the features or the layout of the coefficients change, so that stale models are ignored
+MODEL_VERSION = "1"
+# one-hot encoded, the month terms form a constant-quality price index
+CATEGORICAL_FEATURES = ['town', 'flat_type', 'flat_model', 'month']
+# ordinal storey and continuous features, standardised so that the penalty weighs every feature alike
+NUMERIC_FEATURES = ['storey_mid', 'floor_area_sqm', 'remaining_lease']
+TARGET = 'resale_price'
+
+
+def design_matrix(df: pd.DataFrame):
+    """
+    Function to build the sparse design matrix of the hedonic model directly from the category codes,
+    one intercept, one standardised column per numeric feature and one column per categorical level
+
+    Args:
+        df [dataframe]: transactions with the `CATEGORICAL_FEATURES` and `NUMERIC_FEATURES` columns,
+            without missing values
+
+    Returns:
+        X [scipy.sparse.csr_matrix]: design matrix, one row per transaction
+        df_columns [dataframe]: feature, level, mean, scale, min and max of each column of X
+
+    """
+    rows = len(df)
+    width = 1 + len(NUMERIC_FEATURES) + len(CATEGORICAL_FEATURES)
+    indices = np.empty((rows, width), dtype='int32')
+    data = np.ones((rows, width), dtype='float64')
+    columns = [{'feature': 'intercept', 'level': ''}]
+
+    indices[:, 0] = 0
+    for j, col in enumerate(NUMERIC_FEATURES, start=1):
+        values = df[col].to_numpy(dtype='float64')
+        mean, scale = values.mean(), values.std() or 1.0
+        indices[:, j] = len(columns)
+        data[:, j] = (values - mean) / scale
+        columns.append({'feature': col, 'level': '', 'mean': mean, 'scale': scale,
+                        'min': values.min(), 'max': values.max()})
+
+    # every row has exactly one level of each categorical, so its code is the offset of its column
+    for j, col in enumerate(CATEGORICAL_FEATURES, start=1 + len(NUMERIC_FEATURES)):
+        codes, levels = pd.factorize(df[col], sort=True)
+        indices[:, j] = len(columns) + codes
+        columns.extend({'feature': col, 'level': str(level)} for level in levels)
+
+    X = scipy.sparse.csr_matrix(
+        (data.ravel(), indices.ravel(), np.arange(0, rows * width + 1, width)),
+        shape=(rows, len(columns))
+    )
+    return X, pd.DataFrame(columns, columns=['feature', 'level', 'mean', 'scale', 'min', 'max'])
+
+
+def fit_model(df: pd.DataFrame, alpha=1.0):
+    """
+    Function to fit a ridge regression of the log resale price on the hedonic features
+
+    The model has a few hundred columns, so the normal equations are accumulated from the sparse design matrix
+    in one pass and solved densely by Cholesky, whatever the number of transactions.
+
+    Args:
+        df [dataframe]: the prepared dataset
+        alpha [float]: ridge penalty on every coefficient but the intercept
+
+    Returns:
+        df_coef [dataframe]: `design_matrix()` columns with their coefficient and number of training rows
+        summary [dict]: number of training rows, root mean squared error of the log price and R²
+
+    """
+    df = df.loc[df[CATEGORICAL_FEATURES + NUMERIC_FEATURES + [TARGET]].notna().all(axis=1)]
+    X, df_coef = design_matrix(df)
+    y = np.log(df[TARGET].to_numpy(dtype='float64'))
+
+    gram = (X.T @ X).toarray()
+    penalty = np.full(len(df_coef), float(alpha))
+    penalty[0] = 0.0
+    coef = scipy.linalg.solve(gram + np.diag(penalty), X.T @ y, assume_a='pos')
+
+    residuals = y - X @ coef
+    df_coef['coef'] = coef
+    # the diagonal of the Gram matrix counts the rows of each level
+    df_coef['rows'] = np.where(df_coef['feature'].isin(CATEGORICAL_FEATURES), np.diag(gram), len(df)).astype('int64')
+
+    summary = {
+        'rows': len(df),
+        'rmse': float(np.sqrt(np.mean(residuals ** 2))),
+        'r2': float(1 - residuals.var() / y.var())
+    }
+    return df_coef, summary
+
+
+def write_model(df_coef: pd.DataFrame, summary: dict, path: str, alpha: float, version: str):
+    """
+    Function to persist the coefficients, with the model version, penalty, fit summary and dataset version
+    in the parquet metadata
+
+    Args:
+        df_coef [dataframe]: coefficients from `fit_model()`
+        summary [dict]: fit summary from `fit_model()`
+        path [string]: path of the parquet file, replaced atomically
+        alpha [float]: ridge penalty the model was fitted with
+        version [string]: version of the dataset the model was fitted on, see `serving.dataset_version()`
+    """
+    table = pa.Table.from_pandas(df_coef, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({
+        b'model_version': MODEL_VERSION.encode(),
+        b'alpha': str(alpha).encode(),
+        b'dataset_version': str(version).encode(),
+        **{key.encode(): str(value).encode() for key, value in summary.items()}
+    })
+
+    tmp_path = f'{path}.tmp'
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_model(path: str):
+    """
+    Function to read the coefficients, ignoring models of another version
+
+    Args:
+        path [string]: path of the parquet file
+
+    Returns:
+        df_coef [dataframe]: coefficients, or None if there is no usable model
+        summary [dict]: fit summary, penalty and dataset version
+
+    """
+    if not os.path.exists(path):
+        return None, {}
+
+    table = pq.read_table(path)
+    metadata = {key.decode(): value.decode() for key, value in (table.schema.metadata or {}).items()
+                if key != b'pandas'}
+    if metadata.get('model_version') != MODEL_VERSION:
+        return None, {}
+
+    summary = {
+        'rows': int(metadata['rows']),
+        'rmse': float(metadata['rmse']),
+        'r2': float(metadata['r2']),
+        'alpha': float(metadata['alpha']),
+        'dataset_version': metadata['dataset_version']
+    }
+    return table.to_pandas(), summary
+
+
+def score_terms(df_coef: pd.DataFrame, flats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Function to decompose the predicted log price of each flat into the terms of its features
+
+    Levels the model was not fitted on, e.g. a town without transactions, contribute nothing.
+
+    Args:
+        df_coef [dataframe]: coefficients from `fit_model()` or `load_model()`
+        flats [dataframe]: flats with the `CATEGORICAL_FEATURES` and `NUMERIC_FEATURES` columns
+
+    Returns:
+        df_terms [dataframe]: one column per feature and one for the intercept, summing to the log price
+
+    """
+    df_terms = pd.DataFrame(index=flats.index)
+    df_terms['intercept'] = df_coef['coef'].iat[0]
+
+    for row in df_coef.loc[df_coef['feature'].isin(NUMERIC_FEATURES)].itertuples():
+        values = flats[row.feature].to_numpy(dtype='float64')
+        df_terms[row.feature] = row.coef * (values - row.mean) / row.scale
+
+    for col in CATEGORICAL_FEATURES:
+        df_levels = df_coef.loc[df_coef['feature'] == col]
+        coef = pd.Series(df_levels['coef'].to_numpy(), index=df_levels['level'].to_numpy())
+        df_terms[col] = coef.reindex(flats[col].astype(str).to_numpy()).fillna(0.0).to_numpy()
+
+    return df_terms
+
+
+def fair_price(df_coef: pd.DataFrame, flats: pd.DataFrame, rmse: float, coverage=0.8) -> pd.DataFrame:
+    """
+    Function to score the fair price of flats from the stored coefficients
+
+    Args:
+        df_coef [dataframe]: coefficients from `load_model()`
+        flats [dataframe]: flats with the `CATEGORICAL_FEATURES` and `NUMERIC_FEATURES` columns
+        rmse [float]: root mean squared error of the log price, from the fit summary
+        coverage [float]: share of transactions expected within the band, assuming normal log price residuals
+
+    Returns:
+        df_price [dataframe]: `fair_price` with the `low` and `high` ends of the band, in S$
+
+    """
+    z = NormalDist().inv_cdf(0.5 + coverage / 2)
+    log_price = score_terms(df_coef, flats).sum(axis=1).to_numpy()
+    return pd.DataFrame({
+        'fair_price': np.exp(log_price),
+        'low': np.exp(log_price - z * rmse),
+        'high': np.exp(log_price + z * rmse)
+    }, index=flats.index)
+
+
+def train_model(df: pd.DataFrame, path: str, alpha: float, version: str) -> dict:
+    """
+    Function to fit the hedonic model on the prepared dataset and persist its coefficients
+
+    Args:
+        df [dataframe]: the prepared dataset
+        path [string]: path of the parquet file
+        alpha [float]: ridge penalty on every coefficient but the intercept
+        version [string]: version of the dataset, see `serving.dataset_version()`
+
+    Returns:
+        summary [dict]: fit summary from `fit_model()`
+    """
+    df_coef, summary = fit_model(df, alpha=alpha)
+    write_model(df_coef, summary, path, alpha=alpha, version=version)
+    return summary
+
+
+def main():
+    """
+    Refit the hedonic model from the current artifacts, e.g. after changing model.alpha in config.yml
+    """
+    cfg = load_config()
+    artifacts_path = cfg['etl']['artifacts_path']
+    serving_file = cfg['serving']['artifact_file']
+    model_cfg = cfg['model']
+
+    # the refitted model is published in a new snapshot, alongside the dataset it was fitted on
+    with Snapshot(artifacts_path, published_files(cfg), keep=cfg['snapshot']['keep']) as snapshot:
+        summary = train_model(
+            load_serving_dataset(f'{snapshot.path}/{serving_file}'),
+            f"{snapshot.path}/{model_cfg['artifact_file']}",
+            alpha=model_cfg['alpha'],
+            version=dataset_version(f'{snapshot.path}/hdb_resale.parquet')
+        )
+    print(f"Fitted hedonic model on {summary['rows']} rows: R² {summary['r2']:.4f}, RMSE of log price {summary['rmse']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
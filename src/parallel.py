@@ -0,0 +1,103 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+
+from .features import materialize_features
+from .utility import CSV_DTYPES, list_csv_files, transform
+from .validation import Validator
+
+
+def to_ipc(df: pd.DataFrame) -> pa.Buffer:
+    """
+    Function to serialize a dataframe as an Arrow IPC stream, which crosses a process boundary as one buffer
+    instead of pickling every column
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def from_ipc(buffer: pa.Buffer) -> pa.Table:
+    """
+    Function to read an Arrow IPC stream written by `to_ipc()`, without copying the buffer
+    """
+    return pa.ipc.open_stream(buffer).read_all()
+
+
+def transform_partition(fname: str, validation_cfg=None) -> dict:
+    """
+    Function to read, transform and validate one CSV file, run in a worker process
+
+    Args:
+        fname [string]: path of the CSV file
+        validation_cfg [dict]: `validation` section of config.yml, None to skip validation
+
+    Returns:
+        partition [dict]: the transformed rows and the quarantined rows as Arrow IPC buffers, the number of rows
+            read, the counts of the validator and the CPU seconds of the worker
+
+    """
+    # CPU time rather than wall time, which counts the time other processes held the core
+    start_time = time.process_time()
+    df_raw = pd.read_csv(fname, dtype=CSV_DTYPES)
+    validator = Validator.from_config(validation_cfg) if validation_cfg else None
+    df_transformed = materialize_features(transform(df_raw, validator=validator))
+
+    df_quarantine = validator.quarantine_frame() if validator else None
+    return {
+        'fname': fname,
+        'rows_read': len(df_raw),
+        'table': to_ipc(df_transformed),
+        'rows_checked': validator.rows_checked if validator else 0,
+        'issue_counts': validator.issue_counts if validator else {},
+        'quarantine': to_ipc(df_quarantine) if df_quarantine is not None else None,
+        'cpu_seconds': time.process_time() - start_time
+    }
+
+
+def iter_transformed_partitions(path, workers=0, validator=None):
+    """
+    Function to transform every CSV file in a pool of worker processes, one file per task
+
+    Partitions are yielded in file order as soon as they are ready. At most two tasks per worker are in flight,
+    so that memory is bounded by a few partitions whatever the number of files.
+
+    Args:
+        path [string]: glob pattern of the CSV files
+        workers [int]: number of worker processes, 0 for one per CPU core
+        validator [Validator]: optional validator, into which the counts and quarantined rows of every
+            partition are merged
+
+    Yields:
+        partition [dict]: `transform_partition()` output, with `table` deserialized into a pyarrow Table
+
+    """
+    fnames = list_csv_files(path)
+    workers = min(workers or os.cpu_count(), len(fnames)) or 1
+    validation_cfg = validator.config if validator is not None else None
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for fname in fnames:
+            pending.append(executor.submit(transform_partition, fname, validation_cfg))
+            if len(pending) >= 2 * workers:
+                yield _receive(pending.popleft().result(), validator)
+        while pending:
+            yield _receive(pending.popleft().result(), validator)
+
+
+def _receive(partition: dict, validator=None) -> dict:
+    """
+    Function to deserialize a partition returned by a worker and merge its validation into the validator
+    """
+    if validator is not None:
+        df_quarantine = from_ipc(partition['quarantine']).to_pandas() if partition['quarantine'] is not None else None
+        validator.merge(partition['rows_checked'], partition['issue_counts'], df_quarantine)
+    partition['table'] = from_ipc(partition['table'])
+    return partition
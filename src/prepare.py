@@ -1,32 +1,365 @@
-import pandas as pd
-import yaml
-from .utility import read_concat_csv_to_df, transform
+from .config import load_config
+from .utility import read_concat_csv_to_df, iter_csv_batches, transform, ParquetBatchWriter
+from .features import materialize_features
+from .timeseries import (update_monthly_store, plan_monthly_update, delta_mask, aggregate_monthly,
+                         combine_monthly, write_monthly_store)
+from .metrics import RunMetrics
+from .validation import Validator
+from .serving import write_serving_file, load_serving_dataset, dataset_version
+from .warmup import build_warmup_store
+from .groupstats import build_group_stats
+from .model import train_model
+from .parallel import iter_transformed_partitions
+from .address import AddressIndex
+from .storage import storage_profile, write_artifact
+from .snapshot import Snapshot, published_files
+
+def prepare_streaming(csv_path, path_filename, batch_size, monthly_path, bin_width, restate_months, run, validator=None,
+                      addresses=None, profile=None):
+    """
+    Stream CSV files through `transform()` in batches of `batch_size` rows and write them to the parquet
+    artifact incrementally, so that peak memory is bounded by the batch size rather than the dataset.
+
+    Args:
+        csv_path [string]: glob pattern of the CSV files
+        path_filename [string]: path and filename of the parquet artifact
+        batch_size [int]: maximum number of rows held in memory at once
+        monthly_path [string]: path of the monthly price store
+        bin_width [int]: width of a price bin in S$
+        restate_months [int]: number of trailing stored months to recompute
+        run [RunMetrics]: metrics of the current run, one 'batch' stage is recorded per batch
+        validator [Validator]: optional validator, rows failing its checks are quarantined instead of written
+        addresses [AddressIndex]: optional address dimension, transactions are written with their address id
+        profile [dict]: storage profile of the parquet artifact, see `storage.storage_profile()`
+
+    Returns:
+        summary [dict]: number of rows written, and of months and transactions folded into the monthly store
+    """
+    # months kept in the monthly store are decided up front, so each batch only aggregates its delta
+    df_keep = plan_monthly_update(monthly_path, bin_width, restate_months)
+    df_monthly = None
+    rows_aggregated = 0
+
+    with ParquetBatchWriter(path_filename, profile=profile) as writer:
+        for batch, df_batch in enumerate(iter_csv_batches(csv_path, batch_size)):
+            with run.stage('batch', rows=len(df_batch)) as record:
+                record['batch'] = batch
+                df_batch = materialize_features(transform(df_batch, validator=validator, addresses=addresses))
+                writer.write(df_batch)
+
+                df_delta = df_batch.loc[delta_mask(df_batch['month_ordinal'].to_numpy(), df_keep)]
+                rows_aggregated += len(df_delta)
+                # histograms are additive, so the running total stays as small as the store itself
+                frames = [aggregate_monthly(df_delta, bin_width)]
+                df_monthly = combine_monthly(frames if df_monthly is None else [df_monthly] + frames)
+
+    with run.stage('monthly_store', rows=rows_aggregated):
+        write_monthly_store(df_keep, df_monthly, monthly_path, bin_width)
+
+    return {
+        'rows': writer.rows,
+        'months_updated': int(df_monthly['month_ordinal'].nunique()),
+        'rows_aggregated': rows_aggregated
+    }
+
+
+def prepare_parallel(csv_path, path_filename, workers, monthly_path, bin_width, restate_months, run, validator=None,
+                     addresses=None, profile=None):
+    """
+    Transform the CSV files in a pool of `workers` processes, one file per task, and write each transformed
+    partition to the parquet artifact as soon as it arrives, in file order.
+
+    Workers return their partition as an Arrow IPC buffer, which is written to parquet without going back
+    to pandas; only the columns of the monthly price store are converted. Address ids and the parquet encoding
+    stay in this process: ids are assigned in file order from the one dimension, as in the other modes, and the
+    artifact stays the single file that every reader, the snapshots and the serving file expect. Their share of
+    the CPU time bounds the speedup, see `bench_parallel()` in src.benchmark.
+
+    Args:
+        csv_path [string]: glob pattern of the CSV files
+        path_filename [string]: path and filename of the parquet artifact
+        workers [int]: number of worker processes, 0 for one per CPU core
+        monthly_path [string]: path of the monthly price store
+        bin_width [int]: width of a price bin in S$
+        restate_months [int]: number of trailing stored months to recompute
+        run [RunMetrics]: metrics of the current run, one 'partition' stage is recorded per file
+        validator [Validator]: optional validator, rows failing its checks are quarantined instead of written
+        addresses [AddressIndex]: optional address dimension; ids are assigned here, in file order, so that they
+            do not depend on which worker finishes first
+        profile [dict]: storage profile of the parquet artifact, see `storage.storage_profile()`
+
+    Returns:
+        summary [dict]: number of rows written, and of months and transactions folded into the monthly store
+    """
+    df_keep = plan_monthly_update(monthly_path, bin_width, restate_months)
+    df_monthly = None
+    rows_aggregated = 0
+
+    with ParquetBatchWriter(path_filename, profile=profile) as writer:
+        for partition in iter_transformed_partitions(csv_path, workers=workers, validator=validator):
+            table = partition['table']
+            with run.stage('partition', rows=table.num_rows) as record:
+                record['partition'] = partition['fname']
+                record['worker_cpu_seconds'] = round(partition['cpu_seconds'], 6)
+                if addresses is not None:
+                    table = addresses.attach_table(table)
+                writer.write_table(table)
+
+                df_partition = table.select(['town', 'flat_type', 'month_ordinal', 'resale_price']).to_pandas()
+                df_delta = df_partition.loc[delta_mask(df_partition['month_ordinal'].to_numpy(), df_keep)]
+                rows_aggregated += len(df_delta)
+                frames = [aggregate_monthly(df_delta, bin_width)]
+                df_monthly = combine_monthly(frames if df_monthly is None else [df_monthly] + frames)
+
+    with run.stage('monthly_store', rows=rows_aggregated):
+        write_monthly_store(df_keep, df_monthly, monthly_path, bin_width)
+
+    return {
+        'rows': writer.rows,
+        'months_updated': int(df_monthly['month_ordinal'].nunique()),
+        'rows_aggregated': rows_aggregated
+    }
+
+
+def write_addresses(addresses, artifacts_path, address_file, run):
+    """
+    Persist the address dimension, with the addresses first seen in this run appended.
+
+    Args:
+        addresses [AddressIndex]: address dimension passed to `transform()`
+        artifacts_path [string]: directory of the artifacts
+        address_file [string]: filename of the address dimension
+        run [RunMetrics]: metrics of the current run
+    """
+    with run.stage('addresses') as record:
+        record['rows'] = addresses.write(f'{artifacts_path}/{address_file}')
+
+    print(f"Successfully persisted {record['rows']} addresses in {artifacts_path}/{address_file}")
+
+
+def write_validation(validator, artifacts_path, validation_cfg):
+    """
+    Persist the quarantined rows and the validation report of a run, and print the summary.
+
+    Args:
+        validator [Validator]: validator passed to `transform()`
+        artifacts_path [string]: directory of the artifacts
+        validation_cfg [dict]: `validation` section of config.yml
+    """
+    summary = validator.write(
+        f"{artifacts_path}/{validation_cfg['quarantine_file']}",
+        f"{artifacts_path}/{validation_cfg['report_file']}"
+    )
+    print(f"Quarantined {summary['rows_quarantined']} of {summary['rows_checked']} rows: {summary['issues']}")
+
+
+def write_serving(artifacts_path, serving_file, run):
+    """
+    Convert the parquet artifact into the memory-mappable Arrow IPC file read by the app in serving mode "mmap".
+
+    Args:
+        artifacts_path [string]: directory of the artifacts
+        serving_file [string]: filename of the Arrow IPC file
+        run [RunMetrics]: metrics of the current run
+    """
+    with run.stage('serving_file') as record:
+        record['bytes'] = write_serving_file(f'{artifacts_path}/hdb_resale.parquet', f'{artifacts_path}/{serving_file}')
+
+    print(f"Successfully persisted serving file in {artifacts_path}/{serving_file}")
+
+
+def write_warmup(artifacts_path, snapshot_path, serving_file, warmup_cfg, run):
+    """
+    Precompute the page aggregations of the default view and the popular views of config.yml, so that the
+    first visitor after a deploy or an idle sleep is served from the warm-up store.
+
+    Args:
+        artifacts_path [string]: directory of the artifacts, where the warm-up store is kept across snapshots
+        snapshot_path [string]: directory of the snapshot being written
+        serving_file [string]: filename of the Arrow IPC file, mapped rather than loaded
+        warmup_cfg [dict]: `warmup` section of config.yml
+        run [RunMetrics]: metrics of the current run
+    """
+    with run.stage('warmup') as record:
+        df = load_serving_dataset(f'{snapshot_path}/{serving_file}')
+        record['rows'] = len(df)
+        record['results'] = build_warmup_store(
+            df,
+            f"{artifacts_path}/{warmup_cfg['store_path']}",
+            dataset_version(f'{snapshot_path}/hdb_resale.parquet'),
+            views=warmup_cfg['views'],
+            num_years=warmup_cfg['default_years'],
+            keep=warmup_cfg['keep']
+        )
+
+
+def write_group_stats(artifacts_path, serving_file, group_stats_cfg, run):
+    """
+    Aggregate the yearly price histograms per town, flat type and flat model, from which the pages estimate
+    median prices of any sidebar selection without scanning the transactions.
+
+    Args:
+        artifacts_path [string]: directory of the artifacts
+        serving_file [string]: filename of the Arrow IPC file, mapped rather than loaded
+        group_stats_cfg [dict]: `group_stats` section of config.yml
+        run [RunMetrics]: metrics of the current run
+    """
+    with run.stage('group_stats') as record:
+        df = load_serving_dataset(f'{artifacts_path}/{serving_file}')
+        record['rows'] = len(df)
+        record['groups'] = build_group_stats(
+            df,
+            f"{artifacts_path}/{group_stats_cfg['artifact_file']}",
+            bin_width=group_stats_cfg['bin_width']
+        )
+
+
+def write_model(artifacts_path, serving_file, model_cfg, run):
+    """
+    Fit the hedonic price model on the full history and persist its coefficients, from which the Fair Price
+    page scores hypothetical flats without loading the transactions.
+
+    Args:
+        artifacts_path [string]: directory of the artifacts
+        serving_file [string]: filename of the Arrow IPC file, mapped rather than loaded
+        model_cfg [dict]: `model` section of config.yml
+        run [RunMetrics]: metrics of the current run
+    """
+    with run.stage('model') as record:
+        summary = train_model(
+            load_serving_dataset(f'{artifacts_path}/{serving_file}'),
+            f"{artifacts_path}/{model_cfg['artifact_file']}",
+            alpha=model_cfg['alpha'],
+            version=dataset_version(f'{artifacts_path}/hdb_resale.parquet')
+        )
+        record['rows'] = summary['rows']
+        record['r2'] = round(summary['r2'], 4)
+
+    print(f"Fitted hedonic model on {summary['rows']} rows with R² {summary['r2']:.4f}")
+
 
 def prepare():
     """
     Load CSV files, apply a transformation, and save the result as a parquet file.
+
+    With `etl.mode: streaming` in config.yml the CSV files are processed `etl.batch_size` rows at a time,
+    with `etl.mode: parallel` they are transformed one file per task by `etl.workers` processes,
+    otherwise they are loaded and transformed in memory all at once.
+
+    The artifacts are written to a new snapshot, published only once all of them are complete.
     """
 
     # Load configuration settings from YAML file
-    with open("config.yml", encoding="utf-8",mode='r') as ymlfile:
-        cfg = yaml.load(ymlfile, Loader=yaml.Loader)
+    cfg = load_config()
+
+    # Get the paths for the input and output files from the configuration settings
+    csv_path = cfg['etl']['csv_path']
+    artifacts_path = cfg['etl']['artifacts_path']
+    mode = cfg['etl']['mode']
+    batch_size = cfg['etl']['batch_size']
+    workers = cfg['etl']['workers']
+    monthly_file = cfg['timeseries']['artifact_file']
+    bin_width = cfg['timeseries']['bin_width']
+    restate_months = cfg['timeseries']['restate_months']
+    log_file = cfg['metrics']['log_file']
+    prometheus_textfile_dir = cfg['metrics']['prometheus_textfile_dir']
+    validation_cfg = cfg['validation']
+    serving_file = cfg['serving']['artifact_file']
+    warmup_cfg = cfg['warmup']
+    group_stats_cfg = cfg['group_stats']
+    model_cfg = cfg['model']
+    address_file = cfg['address']['artifact_file']
+    profile = storage_profile(cfg)
+
+    run = RunMetrics('prepare')
+    validator = Validator.from_config(validation_cfg)
+
+    # readers keep the current snapshot until every artifact of this run is written
+    with Snapshot(artifacts_path, published_files(cfg), keep=cfg['snapshot']['keep']) as snapshot:
+        snapshot_path = snapshot.path
+
+        # ids of the addresses of earlier runs are kept, new addresses are appended
+        addresses = AddressIndex.load(f'{snapshot_path}/{address_file}')
+
+        if mode in ('streaming', 'parallel'):
+            if mode == 'streaming':
+                summary = prepare_streaming(
+                    csv_path,
+                    f'{snapshot_path}/hdb_resale.parquet',
+                    batch_size=batch_size,
+                    monthly_path=f'{snapshot_path}/{monthly_file}',
+                    bin_width=bin_width,
+                    restate_months=restate_months,
+                    run=run,
+                    validator=validator,
+                    addresses=addresses,
+                    profile=profile
+                )
+            else:
+                summary = prepare_parallel(
+                    csv_path,
+                    f'{snapshot_path}/hdb_resale.parquet',
+                    workers=workers,
+                    monthly_path=f'{snapshot_path}/{monthly_file}',
+                    bin_width=bin_width,
+                    restate_months=restate_months,
+                    run=run,
+                    validator=validator,
+                    addresses=addresses,
+                    profile=profile
+                )
+            print(f"Successfully persisted {summary['rows']} rows in {snapshot_path}/hdb_resale.parquet")
+            print(f"Updated {summary['months_updated']} months in {snapshot_path}/{monthly_file}")
+
+            write_addresses(addresses, snapshot_path, address_file, run)
+            write_serving(snapshot_path, serving_file, run)
+            write_warmup(artifacts_path, snapshot_path, serving_file, warmup_cfg, run)
+            write_group_stats(snapshot_path, serving_file, group_stats_cfg, run)
+            write_model(snapshot_path, serving_file, model_cfg, run)
+        else:
+            # read and concat csv files to a single dataframe
+            with run.stage('read') as record:
+                df_total = read_concat_csv_to_df(csv_path)
+                record['rows'] = len(df_total)
+
+            # Apply a transformation to the dataset using the `transform()` function
+            with run.stage('transform', rows=len(df_total)):
+                df_transformed = transform(df_total, validator=validator, addresses=addresses)
+
+                # precompute derived columns once, so that the pages never derive them at render time
+                df_transformed = materialize_features(df_transformed)
+
+            # persist transformed artifact as parquet file
+            with run.stage('write', rows=len(df_transformed)) as record:
+                record['bytes'] = write_artifact(df_transformed, f'{snapshot_path}/hdb_resale.parquet', profile)
+
+            print(f"Successfully persisted dataset in {snapshot_path}/hdb_resale.parquet")
+
+            write_addresses(addresses, snapshot_path, address_file, run)
+            write_serving(snapshot_path, serving_file, run)
+            write_warmup(artifacts_path, snapshot_path, serving_file, warmup_cfg, run)
+            write_group_stats(snapshot_path, serving_file, group_stats_cfg, run)
+            write_model(snapshot_path, serving_file, model_cfg, run)
 
-        # Get the paths for the input and output files from the configuration settings
-        csv_path = cfg['etl']['csv_path']
-        artifacts_path = cfg['etl']['artifacts_path']
+            # fold only the newly arrived months into the monthly price store
+            with run.stage('monthly_store') as record:
+                monthly_summary = update_monthly_store(
+                    df_transformed,
+                    f'{snapshot_path}/{monthly_file}',
+                    bin_width=bin_width,
+                    restate_months=restate_months
+                )
+                record['rows'] = monthly_summary['rows_aggregated']
 
-    # read and concat csv files to a single dataframe
-    df_total = read_concat_csv_to_df(csv_path)
+            print(f"Updated {monthly_summary['months_updated']} months in {snapshot_path}/{monthly_file}")
 
-    # Apply a transformation to the dataset using the `transform()` function
-    df_transformed = transform(df_total)
+    print(f"Published snapshot {snapshot.snapshot_id} in {artifacts_path}/current")
 
-    # persist transformed artifact as parquet file
-    df_transformed.to_parquet(f'{artifacts_path}/hdb_resale.parquet')
+    write_validation(validator, artifacts_path, validation_cfg)
 
-    print(f"Successfully persisted dataset in {artifacts_path}/hdb_resale.parquet")
+    # persist the stage metrics of this run
+    run.write(log_file=log_file, prometheus_textfile_dir=prometheus_textfile_dir)
 
 if __name__ == "__main__":
     # Call the `prepare()` function when this script is run as the main program
     prepare()
-    
\ No newline at end of file
@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+PAGE_SIZES = (25, 50, 100, 250)
+
+
+def search_rows(df: pd.DataFrame, query: str, labels=None) -> np.ndarray:
+    """
+    Function to find the positions of rows where any text column contains the search query
+
+    Args:
+        df [dataframe]: pandas dataframe to search
+        query [string]: case-insensitive substring to look for
+        labels [dict]: column of integer ids to the series of their labels, indexed by id, searched as text
+
+    Returns:
+        positions [np.ndarray]: integer positions of matching rows, in dataframe order
+
+    """
+    mask = np.zeros(len(df), dtype=bool)
+    needle = query.strip().upper()
+    labels = labels or {}
+
+    for col in df.columns:
+        series = df[col]
+
+        if col in labels:
+            # as for categoricals, match against the labels once, then look up rows by their ids
+            hits = labels[col].index[labels[col].astype(str).str.upper().str.contains(needle, regex=False)]
+            mask |= np.isin(series.to_numpy(), hits.to_numpy())
+
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            # match against the (few) categories once, then look up rows by their codes
+            categories = series.cat.categories.astype(str).str.upper()
+            hits = np.flatnonzero(categories.str.contains(needle, regex=False))
+            mask |= np.isin(series.cat.codes.to_numpy(), hits)
+
+        elif series.dtype == object:
+            mask |= series.astype(str).str.upper().str.contains(needle, regex=False).to_numpy()
+
+    return np.flatnonzero(mask)
+
+
+def sort_rows(df: pd.DataFrame, positions: np.ndarray, sort_col: str, ascending: bool, stop: int, labels=None) -> np.ndarray:
+    """
+    Function to order row positions by a column, only fully sorting the rows needed up to `stop`
+
+    Args:
+        df [dataframe]: pandas dataframe holding the sort column
+        positions [np.ndarray]: candidate row positions
+        sort_col [string]: name of column to sort by
+        ascending [bool]: sort direction
+        stop [int]: number of leading rows in sorted order that are required
+        labels [dict]: column of integer ids to the series of their labels, indexed by id, sorted by label
+
+    Returns:
+        positions [np.ndarray]: the first `stop` row positions in sorted order
+
+    """
+    series = df[sort_col].iloc[positions]
+
+    # map every value onto an ordered integer key so text and numeric columns partition alike
+    if labels and sort_col in labels:
+        ranks = labels[sort_col].rank(method='dense')
+        keys = ranks.reindex(series.to_numpy()).to_numpy(dtype="float64", na_value=np.inf)
+    elif pd.api.types.is_numeric_dtype(series.dtype) and not isinstance(series.dtype, pd.CategoricalDtype):
+        keys = series.to_numpy(dtype="float64", na_value=np.inf)
+    else:
+        keys = pd.factorize(series, sort=True)[0].astype("float64")
+        keys[keys < 0] = np.inf
+
+    # missing values keep their infinite key, so they stay last in either direction
+    if not ascending:
+        keys = np.where(np.isfinite(keys), -keys, keys)
+
+    # partial selection of the leading rows, then a stable sort of that small slice only
+    if stop < len(keys):
+        lead = np.argpartition(keys, stop - 1)[:stop]
+    else:
+        lead = np.arange(len(keys))
+    lead = lead[np.argsort(keys[lead], kind="stable")]
+
+    return positions[lead]
+
+
+def page_rows(df: pd.DataFrame, page: int, page_size: int, sort_col=None, ascending=True, positions=None,
+              labels=None) -> pd.DataFrame:
+    """
+    Function to slice out one page of rows after applying an optional search result and sort
+
+    Args:
+        df [dataframe]: pandas dataframe to page through
+        page [int]: 1-based page number
+        page_size [int]: number of rows per page
+        sort_col [string]: name of column to sort by, or None to keep dataframe order
+        ascending [bool]: sort direction
+        positions [np.ndarray]: row positions returned by `search_rows()`, or None for all rows
+        labels [dict]: column of integer ids to the series of their labels, see `sort_rows()`
+
+    Returns:
+        df_page [dataframe]: rows of the requested page
+
+    """
+    total_rows = len(df) if positions is None else len(positions)
+    start = (page - 1) * page_size
+    stop = min(start + page_size, total_rows)
+
+    if sort_col is None:
+        # without sorting, a page is a plain positional slice and never touches the other rows
+        if positions is None:
+            return df.iloc[start:stop]
+        return df.iloc[positions[start:stop]]
+
+    if positions is None:
+        positions = np.arange(len(df))
+    ordered = sort_rows(df, positions, sort_col, ascending, stop, labels=labels)
+
+    return df.iloc[ordered[start:stop]]
+
+
+def paged_dataframe(df: pd.DataFrame, key: str, labels=None):
+    """
+    Render a paged preview of a dataframe with server-side search and sort.
+    Only the rows of the visible page are serialized to the browser.
+
+    Args:
+        df [dataframe]: pandas dataframe to preview
+        key [string]: unique prefix for the widget keys of this preview
+        labels [dict]: column of integer ids to the series of their labels, indexed by id and named after the
+            displayed column, e.g. address ids to full addresses; only the visible page is labelled
+    """
+    col1, col2, col3 = st.columns([2, 2, 1])
+
+    with col1:
+        query = st.text_input("Search", key=f"{key}_search", placeholder="e.g. ANG MO KIO")
+
+    with col2:
+        sort_col = st.selectbox("Sort by", options=["None"] + list(df.columns), key=f"{key}_sort")
+
+    with col3:
+        descending = st.checkbox("Descending", key=f"{key}_desc")
+        page_size = st.selectbox("Rows per page", options=PAGE_SIZES, index=1, key=f"{key}_size")
+
+    if sort_col == "None":
+        sort_col = None
+
+    # search once; both the page count and the page slice reuse the matching positions
+    positions = search_rows(df, query, labels=labels) if query.strip() else None
+    total_rows = len(df) if positions is None else len(positions)
+    page_count = max(1, -(-total_rows // page_size))
+
+    page = st.number_input(
+        f"Page (of {page_count})",
+        min_value=1,
+        max_value=page_count,
+        value=1,
+        step=1,
+        # a new result size starts a fresh page widget so a stale page number can never exceed the bound
+        key=f"{key}_page_{total_rows}"
+    )
+
+    df_page = page_rows(
+        df,
+        page=int(page),
+        page_size=page_size,
+        sort_col=sort_col,
+        ascending=not descending,
+        positions=positions,
+        labels=labels
+    )
+
+    for col, series in (labels or {}).items():
+        df_page = df_page.assign(**{col: series.reindex(df_page[col].to_numpy()).to_numpy()}).rename(columns={col: series.name})
+
+    st.dataframe(df_page, use_container_width=True)
+
+    first_row = (int(page) - 1) * page_size
+    st.caption(f"Showing rows {min(first_row + 1, total_rows):,} to {first_row + len(df_page):,} of {total_rows:,}")
@@ -0,0 +1,309 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from .serving import load_compact_dataset
+
+# columns that may be filtered on, grouped by, or aggregated
+FILTER_COLS = ('flat_type', 'town', 'flat_model')
+GROUP_COLS = ('month', 'year', 'town', 'flat_type', 'flat_model', 'storey_range', 'floor_area_sqm', 'remaining_lease')
+VALUE_COLS = ('resale_price', 'price_per_sqm', 'floor_area_sqm', 'remaining_lease')
+
+
+def load_dataset(path_filename: str) -> pd.DataFrame:
+    """
+    Loads the prepared Parquet artifact once per process; every query shares the same read-only frame.
+
+    The path is resolved on every call, so that a path through the `current` snapshot pointer, see
+    `snapshot.pointer_path()`, loads a newly published snapshot at the next query without a restart.
+
+    Args:
+        path_filename [string]: path and filename of the Parquet artifact
+
+    Returns:
+        df [dataframe]: the prepared dataset in the compact representation of `serving.compact_table()`, with
+            the version of the artifact in `df.attrs['dataset_version']`
+    """
+    return _load_dataset(os.path.realpath(path_filename))
+
+
+# one snapshot is kept besides the published one, for the queries still running on it
+@lru_cache(maxsize=2)
+def _load_dataset(path_filename: str) -> pd.DataFrame:
+    """
+    Loads a resolved Parquet artifact, see `load_dataset()`
+    """
+    return load_compact_dataset(path_filename)
+
+
+def distinct_values(df: pd.DataFrame, col: str) -> np.ndarray:
+    """
+    Distinct values of a column in order of appearance, e.g. for the options of a sidebar multiselect.
+
+    Args:
+        df [dataframe]: Input DataFrame.
+        col [string]: Column name.
+
+    Returns:
+        values [np.ndarray]: plain array of the values, also for categorical columns of the memory-mapped dataset
+    """
+    return np.asarray(df[col].unique())
+
+
+def slice_year_range(df: pd.DataFrame, start_year, end_year) -> pd.DataFrame:
+    """
+    Filters a pandas DataFrame to include only rows where the value of 'year' column is greater than
+    the 'start_year' variable and less than the 'end_year' variable.
+
+    Args:
+        df [dataframe]: pandas DataFrame with a column named 'year'
+        start_year [int]: rows must be after this year
+        end_year [int]: rows must be before this year
+
+    Returns:
+        df [dataframe]: rows where the 'year' value is greater than 'start_year' and less than 'end_year'
+    """
+    year = df['year'].to_numpy()
+    return df.loc[(year > start_year) & (year < end_year)]
+
+
+def slice_features(df: pd.DataFrame, sel_flat_type: list, sel_town: list, sel_flat_model: list) -> pd.DataFrame:
+    """
+    Returns a filtered pandas DataFrame containing only the rows with the selected flat types, towns and flat models.
+
+    Args:
+        df [dataframe]: Input DataFrame to filter.
+        sel_flat_type [list]: List of flat types to filter the DataFrame.
+        sel_town [list]: List of towns to filter the DataFrame.
+        sel_flat_model [list]: List of flat models to filter the DataFrame.
+
+    Returns:
+        df [dataframe]: Filtered DataFrame containing only the specified flat types, towns and flat models.
+    """
+    # combine the three masks first, so that only one filtered copy of the frame is made
+    mask = (
+        df['flat_type'].isin(sel_flat_type).to_numpy()
+        & df['town'].isin(sel_town).to_numpy()
+        & df['flat_model'].isin(sel_flat_model).to_numpy()
+    )
+    return df.loc[mask]
+
+
+def agg_date(df: pd.DataFrame, x_selector: str, y_selector: str) -> pd.DataFrame:
+    """
+    Aggregate the input DataFrame `df` by a given column.
+
+    Args:
+        df [dataframe]: Input DataFrame to be aggregated.
+        x_selector [string]: Column name to group the DataFrame by.
+        y_selector [string]: Column name to aggregate.
+
+    Returns:
+        df_agg [dataframe]: Aggregated DataFrame with minimum, maximum, mean and median values,
+            with the mean and median truncated to integers
+    """
+    # categorical groups come out in order of appearance with observed=True, so the groups are sorted explicitly
+    df_agg = (df
+              .groupby(by=[x_selector], observed=True)[y_selector]
+              .agg(['min', 'max', 'mean', 'median'])
+              .sort_index()
+              .reset_index())
+
+    df_agg['mean'] = df_agg['mean'].astype('int64')
+    df_agg['median'] = df_agg['median'].astype('int64')
+
+    return df_agg
+
+
+def count_transactions(df: pd.DataFrame, col: str) -> pd.DataFrame:
+    """
+    Count the number of transactions for each value of a column, most frequent first.
+
+    Args:
+        df [dataframe]: Input DataFrame.
+        col [string]: Column name to count by.
+
+    Returns:
+        df_transacts [dataframe]: `col` and `num_transactions` columns, sorted by descending count, then by value
+    """
+    df_transacts = df[col].value_counts(sort=False).rename_axis(col).reset_index(name='num_transactions')
+    df_transacts = df_transacts.loc[df_transacts['num_transactions'] > 0]
+    # ties are broken by value, so that every backend returns the same order
+    return df_transacts.sort_values(['num_transactions', col], ascending=[False, True], ignore_index=True)
+
+
+def median_pivot(df: pd.DataFrame, index='town', columns='flat_type', values='resale_price') -> pd.DataFrame:
+    """
+    Pivot the median of a value across two columns, e.g. towns against flat types.
+
+    Args:
+        df [dataframe]: Input DataFrame.
+        index [string]: Column whose values become the rows of the pivot.
+        columns [string]: Column whose values become the columns of the pivot.
+        values [string]: Column to take the median of.
+
+    Returns:
+        df_pivot [dataframe]: median values, NaN where a combination has no transactions
+    """
+    return df.groupby([index, columns], observed=True)[values].median().sort_index().unstack(columns)
+
+
+def filter_mask(df: pd.DataFrame, filters: dict) -> np.ndarray:
+    """
+    Boolean mask of the rows selected by the filters of a query spec.
+
+    Args:
+        df [dataframe]: the prepared dataset
+        filters [dict]: optional `start_year` and `end_year` bounds (exclusive) and `town`, `flat_type` and
+            `flat_model` selections; an empty or missing selection means every value
+
+    Returns:
+        mask [np.ndarray]: True for the selected rows
+    """
+    mask = np.ones(len(df), dtype=bool)
+    if 'start_year' in filters or 'end_year' in filters:
+        year = df['year'].to_numpy()
+        mask &= (year > filters.get('start_year', -1)) & (year < filters.get('end_year', 10_000))
+
+    # an empty or missing selection means every value, as with the sidebar multiselects
+    for col in FILTER_COLS:
+        if filters.get(col):
+            mask &= df[col].isin(filters[col]).to_numpy()
+
+    return mask
+
+
+def filter_positions(df: pd.DataFrame, filters: dict) -> np.ndarray:
+    """
+    Positions of the rows selected by the filters of a query spec, small enough to cache per selection.
+
+    Args:
+        df [dataframe]: the prepared dataset
+        filters [dict]: filters, as for `filter_mask()`
+
+    Returns:
+        positions [np.ndarray]: int32 positions of the selected rows, in dataset order
+    """
+    return np.flatnonzero(filter_mask(df, filters)).astype('int32')
+
+
+def filter_rows(df: pd.DataFrame, filters: dict) -> pd.DataFrame:
+    """
+    Apply the filters of a query spec to the prepared dataset.
+
+    Args:
+        df [dataframe]: the prepared dataset
+        filters [dict]: filters, as for `filter_mask()`
+
+    Returns:
+        df_sel [dataframe]: the filtered rows
+    """
+    if not any(key in filters for key in ('start_year', 'end_year')) and not any(filters.get(col) for col in FILTER_COLS):
+        return df
+    return df.loc[filter_mask(df, filters)]
+
+
+def parse_aggregation(aggregation: dict) -> dict:
+    """
+    Validate the aggregation of a query spec and fill in its defaults.
+
+    Args:
+        aggregation [dict]: `type` and, depending on the type, `by`, `value` and `columns`
+
+    Returns:
+        aggregation [dict]: `type`, `by`, `value` and `columns`, with defaults filled in
+
+    Raises:
+        ValueError: if the aggregation names an unknown type or column
+    """
+    agg_type = aggregation.get('type', 'rows')
+    default_by = {'agg': 'year', 'count': 'town', 'median_pivot': 'town'}
+    if agg_type not in ('agg', 'count', 'median_pivot', 'rows'):
+        raise ValueError(f"unknown aggregation type '{agg_type}'")
+
+    parsed = {
+        'type': agg_type,
+        'by': aggregation.get('by') or default_by.get(agg_type),
+        'value': aggregation.get('value', 'resale_price'),
+        'columns': aggregation.get('columns', 'flat_type')
+    }
+
+    for key in ('by', 'columns'):
+        if parsed[key] is not None and parsed[key] not in GROUP_COLS:
+            raise ValueError(f"cannot group by '{parsed[key]}', expected one of {GROUP_COLS}")
+    if parsed['value'] not in VALUE_COLS:
+        raise ValueError(f"cannot aggregate '{parsed['value']}', expected one of {VALUE_COLS}")
+
+    return parsed
+
+
+def run_query(df: pd.DataFrame, spec: dict) -> pd.DataFrame:
+    """
+    Run a query described by a JSON-compatible spec against the prepared dataset.
+
+    Args:
+        df [dataframe]: the prepared dataset
+        spec [dict]: query descriptor, e.g.
+            {
+                "filters": {"start_year": 2012, "end_year": 2023, "town": ["BEDOK"], "flat_type": ["4 ROOM"]},
+                "aggregation": {"type": "agg", "by": "month", "value": "resale_price"},
+                "limit": 1000
+            }
+            `aggregation.type` is one of 'agg', 'count', 'median_pivot' or 'rows'.
+
+    Returns:
+        df_result [dataframe]: the query result
+
+    Raises:
+        ValueError: if the spec names an unknown aggregation or column
+    """
+    aggregation = parse_aggregation(spec.get('aggregation', {'type': 'rows'}))
+    df_sel = filter_rows(df, spec.get('filters', {}))
+
+    if aggregation['type'] == 'agg':
+        df_result = agg_date(df_sel, x_selector=aggregation['by'], y_selector=aggregation['value'])
+    elif aggregation['type'] == 'count':
+        df_result = count_transactions(df_sel, aggregation['by'])
+    elif aggregation['type'] == 'median_pivot':
+        df_result = median_pivot(
+            df_sel, index=aggregation['by'], columns=aggregation['columns'], values=aggregation['value']
+        ).reset_index()
+    else:
+        df_result = df_sel
+
+    limit = spec.get('limit')
+    if limit is not None:
+        df_result = df_result.head(int(limit))
+
+    return df_result
+
+
+def spec_key(spec: dict) -> str:
+    """
+    Key identifying a query spec, equal for specs that select the same rows and aggregate them the same way.
+
+    Args:
+        spec [dict]: query descriptor, as for `run_query()`
+
+    Returns:
+        key [string]: hex digest of the normalised spec
+    """
+    # empty selections mean every value, and the order of the selected values does not matter
+    filters = {}
+    for key, value in spec.get('filters', {}).items():
+        if key in FILTER_COLS:
+            if len(value):
+                filters[key] = sorted(str(item) for item in value)
+        else:
+            filters[key] = int(value)
+
+    normalised = {
+        'filters': filters,
+        'aggregation': parse_aggregation(spec.get('aggregation', {'type': 'rows'})),
+        'limit': spec.get('limit')
+    }
+    return hashlib.sha1(json.dumps(normalised, sort_keys=True).encode()).hexdigest()[:20]
@@ -0,0 +1,221 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .config import load_config
+from .snapshot import current_path
+
+
+def _sorted_dictionary(column: pa.ChunkedArray) -> pa.DictionaryArray:
+    """
+    Function to dictionary-encode a string column with its values in sorted order, so that pandas
+    categoricals built from it group and sort in the same order as plain strings
+    """
+    encoded = pc.dictionary_encode(column.combine_chunks()) if not pa.types.is_dictionary(column.type) \
+        else column.combine_chunks()
+    order = pc.sort_indices(encoded.dictionary).to_numpy()
+    rank = np.empty(len(order), dtype='int32')
+    rank[order] = np.arange(len(order), dtype='int32')
+
+    indices = encoded.indices.to_numpy(zero_copy_only=False)
+    mask = pc.is_null(encoded.indices).to_numpy(zero_copy_only=False)
+    new_indices = pa.array(rank[np.where(mask, 0, indices).astype('int64')], mask=mask)
+
+    return pa.DictionaryArray.from_arrays(new_indices, encoded.dictionary.take(pa.array(order)))
+
+
+# narrowest types holding every value the published files allow, see validation.ranges in config.yml; the
+# derived measures are already float32, and floor_area_sqm stays float64, as a group key whose values
+# such as 60.3 must come out of the aggregations exactly
+COMPACT_DTYPES = {
+    'resale_price': pa.int32(),
+    'lease_commence_date': pa.int16(),
+    'remaining_lease': pa.int16(),
+    'remaining_lease_months': pa.int16(),
+    'year': pa.int16(),
+    'month_ordinal': pa.int16(),
+    'address_id': pa.int32()
+}
+
+
+def compact_table(table: pa.Table) -> pa.Table:
+    """
+    Function to convert the prepared dataset into the compact representation held in memory by the app
+
+    String columns, including `month` and any address column, are dictionary-encoded in sorted order, so that
+    they become pandas categoricals: each distinct string is held once, and every row holds a code of one or
+    two bytes, e.g. `month` is held as int16 codes in month order. Integer columns are narrowed to
+    `COMPACT_DTYPES`, while columns of older artifacts stored as floats are left as they are, and every
+    column is combined into a single contiguous chunk.
+
+    Args:
+        table [Table]: the prepared dataset, e.g. read from the Parquet artifact
+
+    Returns:
+        table [Table]: the compact table, without the pandas index or metadata
+
+    Raises:
+        pyarrow.ArrowInvalid: if a value does not fit its compact type
+    """
+    # drop the index written by pandas, rows are addressed by position only
+    table = table.select([name for name in table.column_names if not name.startswith('__index_level_')])
+
+    columns = []
+    for name in table.column_names:
+        column = table[name]
+        if pa.types.is_string(column.type) or pa.types.is_dictionary(column.type):
+            columns.append(_sorted_dictionary(column))
+        elif name in COMPACT_DTYPES and pa.types.is_integer(column.type):
+            columns.append(column.combine_chunks().cast(COMPACT_DTYPES[name]))
+        else:
+            columns.append(column.combine_chunks())
+    return pa.Table.from_arrays(columns, names=table.column_names)
+
+
+def load_compact_dataset(parquet_filename: str) -> pd.DataFrame:
+    """
+    Function to load the prepared Parquet artifact in the compact representation, see `compact_table()`
+
+    The strings are dictionary-encoded in Arrow before the conversion to pandas, so the loading never creates
+    a Python string per row.
+
+    Args:
+        parquet_filename [string]: path and filename of the prepared Parquet artifact
+
+    Returns:
+        df [dataframe]: the prepared dataset, with the version of the artifact in `df.attrs['dataset_version']`
+    """
+    version = dataset_version(parquet_filename)
+    df = compact_table(pq.read_table(parquet_filename)).to_pandas(split_blocks=True, self_destruct=True)
+    df.attrs['dataset_version'] = version
+    return df
+
+
+def memory_report(df_before: pd.DataFrame, df_after: pd.DataFrame) -> pd.DataFrame:
+    """
+    Function to compare the resident size of each column of two representations of the dataset
+
+    Args:
+        df_before [dataframe]: the dataset as loaded by `pd.read_parquet()`
+        df_after [dataframe]: the dataset as loaded by `load_compact_dataset()` or `load_serving_dataset()`
+
+    Returns:
+        df_report [dataframe]: `dtype_before`, `dtype_after`, `bytes_before`, `bytes_after` and `reduction`
+            (bytes before / bytes after) per column, strings counted with their Python objects, and a `total` row
+    """
+    bytes_before = df_before.memory_usage(index=False, deep=True)
+    bytes_after = df_after.memory_usage(index=False, deep=True).reindex(bytes_before.index, fill_value=0)
+    df_report = pd.DataFrame({
+        'dtype_before': df_before.dtypes.astype(str),
+        'dtype_after': df_after.dtypes.astype(str).reindex(bytes_before.index, fill_value='dropped'),
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after
+    })
+    df_report.loc['total'] = ['', '', bytes_before.sum(), bytes_after.sum()]
+    df_report['reduction'] = (df_report['bytes_before'] / df_report['bytes_after'].replace(0, np.nan)).round(2)
+    return df_report
+
+
+def dataset_version(path_filename: str) -> str:
+    """
+    Function to identify the published version of an artifact, which changes whenever prepare() replaces it
+
+    Args:
+        path_filename [string]: path and filename of the artifact
+
+    Returns:
+        version [string]: modification time and size of the file, None if it does not exist
+    """
+    try:
+        stat = os.stat(path_filename)
+    except FileNotFoundError:
+        return None
+    return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+def write_serving_file(parquet_filename: str, serving_filename: str) -> int:
+    """
+    Function to convert the prepared Parquet artifact into an uncompressed Arrow IPC (Feather v2) file
+    that app processes memory-map instead of loading
+
+    The table is in the compact representation of `compact_table()`: string columns are dictionary-encoded,
+    so that they map to pandas categoricals backed by the file rather than to per-process Python strings,
+    and every column is written as a single contiguous chunk.
+
+    Args:
+        parquet_filename [string]: path and filename of the prepared Parquet artifact
+        serving_filename [string]: path and filename of the Arrow IPC file, replaced atomically
+
+    Returns:
+        size [int]: size of the written file in bytes
+    """
+    # the version of the parquet artifact identifies the dataset in caches keyed by dataset version
+    table = compact_table(pq.read_table(parquet_filename)).replace_schema_metadata(
+        {'dataset_version': dataset_version(parquet_filename)}
+    )
+
+    tmp_filename = f'{serving_filename}.tmp'
+    with pa.OSFile(tmp_filename, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+    os.replace(tmp_filename, serving_filename)
+
+    return os.path.getsize(serving_filename)
+
+
+def open_serving_table(serving_filename: str) -> pa.Table:
+    """
+    Function to memory-map the Arrow IPC file; no data is read until it is accessed, and the pages
+    read are shared through the OS page cache by every process mapping the same file
+
+    Args:
+        serving_filename [string]: path and filename of the Arrow IPC file
+
+    Returns:
+        table [Table]: table whose buffers point into the mapped file
+    """
+    source = pa.memory_map(serving_filename, 'r')
+    return pa.ipc.open_file(source).read_all()
+
+
+def load_serving_dataset(serving_filename: str) -> pd.DataFrame:
+    """
+    Function to load the serving file as a pandas DataFrame over the mapped buffers
+
+    Numeric columns without missing values are zero-copy views of the file and therefore read-only;
+    string columns become categoricals whose codes are the mapped dictionary indices.
+
+    Args:
+        serving_filename [string]: path and filename of the Arrow IPC file
+
+    Returns:
+        df [dataframe]: the prepared dataset, with the version of the parquet artifact it was converted from
+            in `df.attrs['dataset_version']`
+    """
+    table = open_serving_table(serving_filename)
+    df = table.to_pandas(split_blocks=True)
+    df.attrs['dataset_version'] = (table.schema.metadata or {}).get(b'dataset_version', b'').decode() or None
+    return df
+
+
+def main():
+    """
+    Print the memory report of the published dataset: the bytes of each column as loaded by `pd.read_parquet()`,
+    and in the compact representation held by the app
+    """
+    cfg = load_config()
+    parquet_filename = os.path.join(current_path(cfg['etl']['artifacts_path']), 'hdb_resale.parquet')
+
+    df_report = memory_report(pd.read_parquet(parquet_filename), load_compact_dataset(parquet_filename))
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 120):
+        print(df_report)
+    print(f"Resident size cut {df_report.at['total', 'reduction']}x, "
+          f"from {df_report.at['total', 'bytes_before'] / 1e6:.1f} MB to {df_report.at['total', 'bytes_after'] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
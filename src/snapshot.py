@@ -0,0 +1,205 @@
+import fcntl
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime
+
+# symlink to the published snapshot, and the directory of the snapshots, both in etl.artifacts_path
+CURRENT = 'current'
+SNAPSHOTS_DIR = 'snapshots'
+# held by the job writing a snapshot, from reading the current snapshot until publishing its own
+LOCK_FILE = '.publish.lock'
+
+
+def published_files(cfg: dict) -> list:
+    """
+    Function to list the artifacts read by the app and the API, which are versioned together in snapshots
+
+    Run reports, such as quarantined rows and validation reports, and stores keyed by dataset version, such as
+    the warm-up store and the result cache, stay in etl.artifacts_path.
+
+    Args:
+        cfg [dict]: the configuration settings
+
+    Returns:
+        files [list]: filenames of the published artifacts
+    """
+    return [
+        'hdb_resale.parquet',
+        cfg['serving']['artifact_file'],
+        cfg['timeseries']['artifact_file'],
+        cfg['group_stats']['artifact_file'],
+        cfg['model']['artifact_file'],
+        cfg['address']['artifact_file'],
+        cfg['geospatial']['artifact_file']
+    ]
+
+
+def current_path(artifacts_path: str) -> str:
+    """
+    Function to resolve the `current` pointer into the directory of the published snapshot
+
+    It costs a single readlink, so loaders call it on every rerun or request and pick up a new snapshot as
+    soon as it is published: the resolved path changes, and with it the keys of their caches.
+
+    Args:
+        artifacts_path [string]: directory of the artifacts
+
+    Returns:
+        path [string]: directory of the published snapshot, or `artifacts_path` itself if none has been
+            published yet, as in trees prepared before snapshots existed
+    """
+    try:
+        target = os.readlink(os.path.join(artifacts_path, CURRENT))
+    except OSError:
+        return artifacts_path
+    return os.path.join(artifacts_path, target)
+
+
+def pointer_path(artifacts_path: str, fname: str) -> str:
+    """
+    Function to address an artifact through the `current` symlink, for long-running processes such as the API,
+    whose open paths then follow every later publication
+
+    Args:
+        artifacts_path [string]: directory of the artifacts
+        fname [string]: filename of the artifact
+
+    Returns:
+        path [string]: path of the artifact through `current`, or in `artifacts_path` if no snapshot has been
+            published yet
+    """
+    pointer = os.path.join(artifacts_path, CURRENT)
+    return os.path.join(pointer if os.path.islink(pointer) else artifacts_path, fname)
+
+
+@contextmanager
+def publish_lock(artifacts_path: str):
+    """
+    Context manager holding the exclusive lock on publication, so that jobs writing snapshots, e.g. prepare and
+    geocode, take turns: each one starts from the snapshot published by the previous one
+
+    Readers never take the lock. It is released when the process exits, however it exits.
+
+    Args:
+        artifacts_path [string]: directory of the artifacts
+    """
+    os.makedirs(artifacts_path, exist_ok=True)
+    with open(os.path.join(artifacts_path, LOCK_FILE), mode='a') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+def _link_or_copy(source: str, destination: str):
+    """
+    Function to hard-link a file, or copy it where the filesystem does not support hard links
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+class Snapshot:
+    """
+    Writes a new version of the published artifacts to its own directory, and publishes it by atomically
+    replacing the `current` symlink, so that readers see either the previous or the new set of artifacts,
+    never a half-written file or a mix of both.
+
+    On entry the published files of the current snapshot are hard-linked into the new one, so a job only
+    writes the artifacts it changes and incremental stores find their previous state. Every artifact is
+    written under a temporary name and moved into place, which replaces the link without touching the
+    previous snapshot. On a successful exit the snapshot is published and the oldest beyond `keep` removed;
+    on an error it is discarded and the current snapshot stays published.
+
+    The publish lock is held from entry to exit, so the job must read what it builds on, e.g. the address
+    dimension, from `path` inside the block; anything read before entering may already be stale.
+
+    Args:
+        artifacts_path [string]: directory of the artifacts
+        files [list]: filenames carried over from the current snapshot, see `published_files()`
+        keep [int]: number of snapshots kept, including the published one; processes still reading a removed
+            snapshot keep the files they have open or mapped
+    """
+
+    def __init__(self, artifacts_path: str, files: list, keep=3):
+        self.artifacts_path = artifacts_path
+        self.files = files
+        self.keep = max(keep, 1)
+        self.snapshot_id = None
+        self.path = None
+        self.base_path = None
+        self._lock = None
+
+    def __enter__(self):
+        self._lock = publish_lock(self.artifacts_path)
+        self._lock.__enter__()
+        try:
+            return self._start()
+        except BaseException:
+            self._lock.__exit__(None, None, None)
+            raise
+
+    def _start(self):
+        """
+        Function to create the snapshot directory from the current snapshot, which becomes its base
+        """
+        previous_path = self.base_path = current_path(self.artifacts_path)
+
+        # ids sort in the order the snapshots were started
+        self.snapshot_id = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        self.path = os.path.join(self.artifacts_path, SNAPSHOTS_DIR, self.snapshot_id)
+        os.makedirs(self.path)
+
+        for fname in self.files:
+            source = os.path.join(previous_path, fname)
+            if os.path.exists(source):
+                _link_or_copy(source, os.path.join(self.path, fname))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is not None:
+                shutil.rmtree(self.path, ignore_errors=True)
+                return
+            try:
+                self.publish()
+            except RuntimeError:
+                shutil.rmtree(self.path, ignore_errors=True)
+                raise
+            self.prune()
+        finally:
+            self._lock.__exit__(None, None, None)
+
+    def publish(self):
+        """
+        Function to point `current` at this snapshot, by renaming a new symlink over the previous one
+
+        Raises:
+            RuntimeError: if `current` no longer points at the snapshot this one was started from, e.g. when a
+                process published without the lock; publishing would drop that snapshot's changes
+        """
+        if current_path(self.artifacts_path) != self.base_path:
+            raise RuntimeError(f"{CURRENT} moved from {self.base_path} to {current_path(self.artifacts_path)} "
+                               f"while snapshot {self.snapshot_id} was written, it is not published")
+        pointer = os.path.join(self.artifacts_path, CURRENT)
+        tmp_pointer = f'{pointer}.{os.getpid()}.tmp'
+        os.symlink(os.path.join(SNAPSHOTS_DIR, self.snapshot_id), tmp_pointer)
+        os.replace(tmp_pointer, pointer)
+
+    def prune(self) -> list:
+        """
+        Function to remove the oldest snapshots beyond `keep`, never the published one
+
+        Returns:
+            removed [list]: ids of the removed snapshots
+        """
+        snapshots_path = os.path.join(self.artifacts_path, SNAPSHOTS_DIR)
+        removed = [snapshot_id for snapshot_id in sorted(os.listdir(snapshots_path))[:-self.keep]
+                   if snapshot_id != self.snapshot_id]
+        for snapshot_id in removed:
+            shutil.rmtree(os.path.join(snapshots_path, snapshot_id), ignore_errors=True)
+        return removed
@@ -0,0 +1,92 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# pandas' to_parquet() defaults, used where no profile is configured
+DEFAULT_PROFILE = {
+    'sort_by': [],
+    'row_group_size': None,
+    'dictionary': True,
+    'compression': 'snappy',
+    'compression_level': None
+}
+
+
+def storage_profile(cfg: dict, name=None) -> dict:
+    """
+    Function to look up a storage profile in the `storage` section of config.yml
+
+    Args:
+        cfg [dict]: the configuration settings
+        name [string]: name of the profile, None for the one selected by `storage.profile`
+
+    Returns:
+        profile [dict]: sort columns, row group size, dictionary encoded columns, codec and codec level
+
+    """
+    storage_cfg = cfg['storage']
+    return {**DEFAULT_PROFILE, **storage_cfg['profiles'][name or storage_cfg['profile']]}
+
+
+def writer_options(profile: dict, schema: pa.Schema) -> dict:
+    """
+    Function to translate a storage profile into the options of `pyarrow.parquet.ParquetWriter`
+
+    Args:
+        profile [dict]: output of `storage_profile()`
+        schema [pa.Schema]: schema of the file, dictionary encoded columns it lacks are ignored
+
+    Returns:
+        options [dict]: `use_dictionary`, `compression` and `compression_level`
+
+    """
+    dictionary = profile['dictionary']
+    if not isinstance(dictionary, bool):
+        dictionary = [col for col in dictionary if col in schema.names]
+    return {
+        'use_dictionary': dictionary,
+        'compression': profile['compression'],
+        'compression_level': profile['compression_level']
+    }
+
+
+def sort_table(table: pa.Table, profile: dict) -> pa.Table:
+    """
+    Function to order rows by the sort columns of a profile, so that row group statistics prune filtered reads
+
+    Args:
+        table [pa.Table]: rows to write
+        profile [dict]: output of `storage_profile()`, sort columns missing from the table are ignored
+
+    Returns:
+        table [pa.Table]: the sorted rows
+    """
+    sort_by = [col for col in profile['sort_by'] if col in table.column_names]
+    if not sort_by:
+        return table
+    return table.sort_by([(col, 'ascending') for col in sort_by])
+
+
+def write_artifact(df: pd.DataFrame, path: str, profile=None) -> int:
+    """
+    Function to write a dataframe as parquet with a storage profile, replacing the file atomically
+
+    Args:
+        df [dataframe]: rows to write, the index is not stored
+        path [string]: path of the parquet file
+        profile [dict]: output of `storage_profile()`, None for the pandas defaults
+
+    Returns:
+        size [int]: size of the file in bytes
+    """
+    profile = profile or DEFAULT_PROFILE
+    table = sort_table(pa.Table.from_pandas(df, preserve_index=False), profile)
+
+    tmp_path = f'{path}.tmp'
+    with pq.ParquetWriter(tmp_path, table.schema, **writer_options(profile, table.schema)) as writer:
+        writer.write_table(table, row_group_size=profile['row_group_size'])
+    os.replace(tmp_path, path)
+
+    return os.path.getsize(path)
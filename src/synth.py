@@ -0,0 +1,360 @@
+import argparse
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from .config import load_config
+from .features import BASE_YEAR, month_ordinal, ordinal_to_month, materialize_features, parse_storey_range
+from .model import fit_model, score_terms, NUMERIC_FEATURES
+from .utility import CSV_DTYPES, transform
+
+# columns of the published CSV files, in their order
+COLUMNS = ['month', 'town', 'flat_type', 'block', 'street_name', 'storey_range', 'floor_area_sqm', 'flat_model',
+           'lease_commence_date', 'remaining_lease', 'resale_price']
+# flats are sold with the combination of town, flat type and flat model of a transaction of the source file
+COMBO = ['town', 'flat_type', 'flat_model']
+# the files up to 2014 do not publish `remaining_lease`, those of 2015 and 2016 publish whole years,
+# and those from 2017 publish text such as '61 years 04 months'
+LEASE_YEARS_FROM = 2015
+LEASE_TEXT_FROM = 2017
+LEASE_FORMATS = ('published', 'years', 'text')
+MAX_LEASE_MONTHS = 99 * 12
+# rows generated at a time, which bounds the memory used whatever the number of rows
+CHUNK_ROWS = 250_000
+
+
+def _empirical(df: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """
+    Function to count the distinct values of `keys` within each combination, sorted by combination
+    """
+    return (df.groupby(['combo'] + keys, observed=True, sort=True).size()
+              .rename('weight').reset_index())
+
+
+def _sample_within(groups, table_groups, cumulative, group_start, group_total, rng):
+    """
+    Function to draw one row of a table for each requested group, with probability proportional to its weight
+    within the group, in a single vectorized pass
+
+    Args:
+        groups [array]: group of each draw
+        table_groups [array]: group of each table row, sorted
+        cumulative [array]: cumulative weights of the table rows, over the whole table
+        group_start [array]: cumulative weight before the first row of each group
+        group_total [array]: total weight of each group, positive for every group drawn from
+        rng [Generator]: numpy random generator
+
+    Returns:
+        rows [array]: index of the drawn table row for each draw
+    """
+    target = group_start[groups] + rng.random(len(groups)) * group_total[groups]
+    rows = np.searchsorted(cumulative, target, side='right')
+    # floating point rounding may step past the last row of a group
+    last_row = np.searchsorted(table_groups, groups, side='right') - 1
+    return np.minimum(rows, last_row)
+
+
+class SyntheticGenerator:
+    """
+    Generates transactions in the schema of the published CSV files from distributions learnt on a source file,
+    so that the pipeline and the pages can be exercised at any scale without network access.
+
+    Each transaction draws a combination of town, flat type and flat model with its frequency in the source,
+    then an address, which carries the lease commencement, a storey range and a floor area among those of the
+    combination, so that the joint distribution is kept. Its month is uniform between the later of the start
+    month and the lease commencement, and the end month. The price follows the hedonic model fitted on the
+    source, with its residual noise, and a yearly drift away from the months of the source.
+
+    Args:
+        df_source [dataframe]: raw transactions, e.g. read from the bundled CSV with `utility.CSV_DTYPES`
+        annual_growth [float]: yearly drift of the log prices, relative to the months of the source
+    """
+
+    def __init__(self, df_source: pd.DataFrame, annual_growth=0.05):
+        self.annual_growth = annual_growth
+        df = materialize_features(transform(df_source.copy()))
+
+        # combinations are numbered in sorted order
+        df['combo'] = df.groupby(COMBO, sort=True).ngroup().to_numpy()
+        self.combos = df[COMBO].drop_duplicates().sort_values(COMBO).reset_index(drop=True)
+        self.addresses = _empirical(df, ['block', 'street_name', 'lease_commence_date'])
+        self.storeys = _empirical(df, ['storey_range'])
+        self.areas = _empirical(df, ['floor_area_sqm'])
+        self.storey_mid = parse_storey_range(self.storeys['storey_range'])['storey_mid'].to_numpy('float64')
+
+        # the categorical terms are fixed per combination; the month is left out, as an unseen level it adds nothing
+        df_coef, summary = fit_model(df)
+        self.rmse = summary['rmse']
+        flats = self.combos.assign(month='')
+        for col in NUMERIC_FEATURES:
+            flats[col] = df_coef.loc[df_coef['feature'] == col, 'mean'].iat[0]
+        self.combo_log_price = score_terms(df_coef, flats).sum(axis=1).to_numpy()
+        self.numeric = df_coef.loc[df_coef['feature'].isin(NUMERIC_FEATURES)].set_index('feature')
+        self.reference_ordinal = float(df['month_ordinal'].mean())
+
+        # lookups from months to the strings written out
+        self.lease_text = np.array([f'{months // 12:02d} years {months % 12:02d} months'
+                                    for months in range(MAX_LEASE_MONTHS + 1)], dtype=object)
+        self.lease_years = np.array([str(round(months / 12)) for months in range(MAX_LEASE_MONTHS + 1)],
+                                    dtype=object)
+
+    @classmethod
+    def from_csv(cls, path_filename: str, annual_growth=0.05):
+        """
+        Function to learn the distributions from a published CSV file
+
+        Args:
+            path_filename [string]: path and filename of the CSV file
+            annual_growth [float]: yearly drift of the log prices
+
+        Returns:
+            generator [SyntheticGenerator]: the fitted generator
+        """
+        return cls(pd.read_csv(path_filename, dtype=CSV_DTYPES), annual_growth=annual_growth)
+
+    def _draw(self, table: pd.DataFrame, groups, rng, mask=None):
+        """
+        Function to draw one row of `table` within the combination of each transaction
+        """
+        weights = table['weight'].to_numpy(dtype='float64')
+        if mask is not None:
+            weights = weights * mask
+        table_groups = table['combo'].to_numpy()
+        cumulative = np.cumsum(weights)
+        group_total = np.bincount(table_groups, weights=weights, minlength=len(self.combos))
+        group_start = np.concatenate([[0.0], np.cumsum(group_total)[:-1]])
+        return _sample_within(groups, table_groups, cumulative, group_start, group_total, rng)
+
+    def sample(self, rows: int, start_month: str, end_month: str, rng, lease_format='published') -> pd.DataFrame:
+        """
+        Function to generate transactions
+
+        Args:
+            rows [int]: number of transactions
+            start_month [string]: first month, as 'YYYY-MM'
+            end_month [string]: last month, as 'YYYY-MM'
+            rng [Generator]: numpy random generator
+            lease_format [string]: format of `remaining_lease`, one of `LEASE_FORMATS`; "published" follows the
+                files of each period, missing before 2015, whole years in 2015 and 2016 and text from 2017
+
+        Returns:
+            df [dataframe]: transactions with the `COLUMNS` of the published files, sorted by month, with the
+                string columns as categoricals
+        """
+        start, end = month_ordinal(pd.Series([start_month, end_month])).to_numpy(dtype='int64')
+        if start < 0 or end < start:
+            raise ValueError(f"invalid month range {start_month} to {end_month}")
+        if lease_format not in LEASE_FORMATS:
+            raise ValueError(f"unknown lease format {lease_format!r}, expected one of {LEASE_FORMATS}")
+
+        # flats whose lease commences after the end month cannot be sold, nor combinations without any such flat
+        lease_commence = self.addresses['lease_commence_date'].to_numpy(dtype='int64')
+        is_built = (lease_commence - BASE_YEAR) * 12 <= end
+        address_combos = self.addresses['combo'].to_numpy()
+        combo_weight = np.bincount(address_combos, weights=self.addresses['weight'] * is_built,
+                                   minlength=len(self.combos))
+        if not combo_weight.any():
+            raise ValueError(f"no flat of the source has a lease commencing by {end_month}")
+        combo = rng.choice(len(self.combos), size=rows, p=combo_weight / combo_weight.sum())
+
+        address = self._draw(self.addresses, combo, rng, mask=is_built)
+        storey = self._draw(self.storeys, combo, rng)
+        area = self.areas['floor_area_sqm'].to_numpy(dtype='float64')[self._draw(self.areas, combo, rng)]
+        commence = lease_commence[address]
+
+        # months are uniform from the later of the start month and the lease commencement; transactions are
+        # published in month order
+        low = np.maximum(start, (commence - BASE_YEAR) * 12)
+        ordinal = low + (rng.random(rows) * (end - low + 1)).astype('int64')
+        order = np.argsort(ordinal, kind='stable')
+        combo, address, storey, area, commence, ordinal = (
+            values[order] for values in (combo, address, storey, area, commence, ordinal)
+        )
+        # leases commence in any month of their year, which varies the months part of the remaining lease
+        lease_start = (commence - BASE_YEAR) * 12 + rng.integers(0, 12, rows)
+        lease_months = np.clip(MAX_LEASE_MONTHS - (ordinal - lease_start), 0, MAX_LEASE_MONTHS)
+
+        # standardised numeric terms, clipped to the range the model was fitted on
+        numeric = {'storey_mid': self.storey_mid[storey], 'floor_area_sqm': area, 'remaining_lease': lease_months / 12}
+        log_price = self.combo_log_price[combo] + rng.normal(0.0, self.rmse, rows)
+        log_price += self.annual_growth * (ordinal - self.reference_ordinal) / 12
+        for feature, row in self.numeric.iterrows():
+            values = np.clip(numeric[feature], row['min'], row['max'])
+            log_price += row['coef'] * (values - row['mean']) / row['scale']
+        # prices are published in whole thousands
+        price = np.maximum(np.round(np.exp(log_price), -3), 5000.0)
+
+        year = ordinal // 12 + BASE_YEAR
+        if lease_format == 'years':
+            remaining_lease = self.lease_years[lease_months]
+        elif lease_format == 'text':
+            remaining_lease = self.lease_text[lease_months]
+        else:
+            remaining_lease = np.where(year >= LEASE_TEXT_FROM, self.lease_text[lease_months],
+                                       np.where(year >= LEASE_YEARS_FROM, self.lease_years[lease_months], None))
+
+        return pd.DataFrame({
+            'month': pd.Categorical.from_codes(ordinal - start, categories=ordinal_to_month(np.arange(start, end + 1))),
+            'town': _categorical(self.combos['town'], combo),
+            'flat_type': _categorical(self.combos['flat_type'], combo),
+            'block': _categorical(self.addresses['block'], address),
+            'street_name': _categorical(self.addresses['street_name'], address),
+            'storey_range': _categorical(self.storeys['storey_range'], storey),
+            'floor_area_sqm': area,
+            'flat_model': _categorical(self.combos['flat_model'], combo),
+            'lease_commence_date': commence,
+            'remaining_lease': remaining_lease,
+            'resale_price': price
+        }, columns=COLUMNS)
+
+    def iter_chunks(self, rows: int, start_month: str, end_month: str, seed=0, lease_format='published',
+                    chunk_rows=CHUNK_ROWS):
+        """
+        Function to generate transactions as a stream of chunks, so that any number of rows fits in memory
+
+        Every chunk spans the whole month range, so the stream as a whole is only sorted by month within chunks.
+
+        Args:
+            rows [int]: total number of transactions
+            start_month [string]: first month, as 'YYYY-MM'
+            end_month [string]: last month, as 'YYYY-MM'
+            seed [int]: seed of the random generator, the same seed generating the same transactions
+            lease_format [string]: format of `remaining_lease`, see `sample()`
+            chunk_rows [int]: maximum number of transactions per chunk
+
+        Yields:
+            df_chunk [dataframe]: the next chunk of transactions
+        """
+        rng = np.random.default_rng(seed)
+        for offset in range(0, rows, chunk_rows):
+            yield self.sample(min(chunk_rows, rows - offset), start_month, end_month, rng, lease_format=lease_format)
+
+
+def _categorical(values: pd.Series, rows) -> pd.Categorical:
+    """
+    Function to pick rows of a table column as a categorical, without materializing the strings
+    """
+    codes, uniques = pd.factorize(values)
+    return pd.Categorical.from_codes(codes[rows], categories=uniques)
+
+
+def _csv_bytes(df_chunk: pd.DataFrame) -> bytes:
+    """
+    Function to render transactions as CSV lines without a header, through Arrow's CSV writer
+
+    Arrow quotes every string, which the published files do not; no published value holds a comma or a quote,
+    so the quotes are dropped. Whole floats, such as every price, are written without a decimal point.
+    """
+    table = pa.Table.from_pandas(df_chunk, preserve_index=False)
+    table = pa.table([column.cast(pa.string()) if pa.types.is_dictionary(column.type) else column
+                      for column in table.columns], names=table.column_names)
+    buffer = io.BytesIO()
+    pa_csv.write_csv(table, buffer, write_options=pa_csv.WriteOptions(include_header=False))
+    return buffer.getvalue().replace(b'"', b'')
+
+
+def write_csv(chunks, path: str, rows_per_file: int) -> list:
+    """
+    Function to write a stream of transactions to CSV files of at most `rows_per_file` rows, named in order
+
+    Args:
+        chunks [iterable]: dataframes from `SyntheticGenerator.iter_chunks()`
+        path [string]: directory of the CSV files, created if missing
+        rows_per_file [int]: maximum number of rows per file
+
+    Returns:
+        files [list]: paths of the files written
+    """
+    os.makedirs(path, exist_ok=True)
+    files, outfile, file_rows = [], None, 0
+    try:
+        for df_chunk in chunks:
+            while len(df_chunk):
+                if outfile is None or file_rows >= rows_per_file:
+                    if outfile is not None:
+                        outfile.close()
+                    files.append(os.path.join(path, f'synthetic_{len(files):05d}.csv'))
+                    outfile = open(files[-1], mode='wb')
+                    outfile.write((','.join(COLUMNS) + '\n').encode())
+                    file_rows = 0
+                split = rows_per_file - file_rows
+                df_part, df_chunk = df_chunk.iloc[:split], df_chunk.iloc[split:]
+                outfile.write(_csv_bytes(df_part))
+                file_rows += len(df_part)
+    finally:
+        if outfile is not None:
+            outfile.close()
+    return files
+
+
+def write_parquet(chunks, path: str) -> list:
+    """
+    Function to write a stream of transactions to a single parquet file, one row group per chunk
+
+    `remaining_lease` is written as strings whatever its format, as the published formats mix numbers and text.
+
+    Args:
+        chunks [iterable]: dataframes from `SyntheticGenerator.iter_chunks()`
+        path [string]: directory of the parquet file, created if missing
+
+    Returns:
+        files [list]: path of the file written
+    """
+    os.makedirs(path, exist_ok=True)
+    path_filename = os.path.join(path, 'synthetic.parquet')
+    schema = pa.schema([(col, pa.dictionary(pa.int32(), pa.string())) for col in COLUMNS[:6]] + [
+        ('floor_area_sqm', pa.float64()),
+        ('flat_model', pa.dictionary(pa.int32(), pa.string())),
+        ('lease_commence_date', pa.int64()),
+        ('remaining_lease', pa.string()),
+        ('resale_price', pa.float64())
+    ])
+
+    tmp_filename = f'{path_filename}.tmp'
+    with pq.ParquetWriter(tmp_filename, schema, compression='zstd') as writer:
+        for df_chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(df_chunk, schema=schema, preserve_index=False))
+    os.replace(tmp_filename, path_filename)
+    return [path_filename]
+
+
+def main():
+    """
+    Generate a synthetic dataset learnt from the bundled CSV (synth in config.yml) and print its throughput
+    """
+    synth_cfg = load_config()['synth']
+
+    parser = argparse.ArgumentParser(description="Generate synthetic HDB resale transactions in the published schema")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="number of transactions")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help="format of the output files")
+    parser.add_argument('--output', default=synth_cfg['output_path'], help="directory of the output files")
+    parser.add_argument('--lease-format', choices=LEASE_FORMATS, default=synth_cfg['lease_format'],
+                        help="format of remaining_lease")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random generator")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    generator = SyntheticGenerator.from_csv(synth_cfg['source_csv'], annual_growth=synth_cfg['annual_growth'])
+    fit_seconds = time.perf_counter() - start_time
+
+    chunks = generator.iter_chunks(args.rows, synth_cfg['start_month'], synth_cfg['end_month'],
+                                   seed=args.seed, lease_format=args.lease_format)
+    start_time = time.perf_counter()
+    if args.format == 'csv':
+        files = write_csv(chunks, args.output, synth_cfg['rows_per_file'])
+    else:
+        files = write_parquet(chunks, args.output)
+    seconds = time.perf_counter() - start_time
+
+    print(f"Learnt the distributions in {fit_seconds:.1f}s; wrote {args.rows} rows to {len(files)} file(s) in "
+          f"{args.output} in {seconds:.1f}s ({args.rows / seconds:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .features import ordinal_to_month
+
+# bump whenever the layout of the store changes, so that stale stores are rebuilt instead of extended
+STORE_VERSION = "1"
+GROUP_COLS = ['town', 'flat_type']
+
+
+def aggregate_monthly(df: pd.DataFrame, bin_width: int) -> pd.DataFrame:
+    """
+    Function to aggregate transactions into monthly price histograms per (town, flat_type)
+
+    Histogram counts are additive, so months can be merged into any rolling window or rolled up across
+    flat types without going back to the transactions.
+
+    Args:
+        df [dataframe]: transactions with `town`, `flat_type`, `month_ordinal` and `resale_price` columns
+        bin_width [int]: width of a price bin in S$
+
+    Returns:
+        df_monthly [dataframe]: one row per (town, flat_type, month_ordinal, price_bin) with the
+            number of transactions and their summed resale price
+
+    """
+    df_bins = pd.DataFrame({
+        'town': df['town'].to_numpy(),
+        'flat_type': df['flat_type'].to_numpy(),
+        'month_ordinal': df['month_ordinal'].to_numpy(),
+        'price_bin': (df['resale_price'].to_numpy() // bin_width).astype('int32'),
+        'resale_price': df['resale_price'].to_numpy(dtype='int64')
+    })
+
+    df_monthly = (df_bins
+                  .groupby(GROUP_COLS + ['month_ordinal', 'price_bin'], sort=True, observed=True)['resale_price']
+                  .agg(count='size', price_sum='sum')
+                  .reset_index())
+    df_monthly = df_monthly.astype({'month_ordinal': 'int16', 'price_bin': 'int32', 'count': 'int32'})
+
+    return df_monthly
+
+
+def load_monthly_store(path: str, bin_width=None):
+    """
+    Function to read the monthly store, ignoring stores of another version or bin width
+
+    Args:
+        path [string]: path of the parquet store
+        bin_width [int]: expected width of a price bin in S$, or None to accept any
+
+    Returns:
+        df_monthly [dataframe]: monthly histogram rows, or None if there is no usable store
+        bin_width [int]: width of a price bin the store was built with
+
+    """
+    if not os.path.exists(path):
+        return None, bin_width
+
+    table = pq.read_table(path)
+    metadata = table.schema.metadata or {}
+    store_version = metadata.get(b'store_version', b'').decode()
+    store_bin_width = int(metadata.get(b'bin_width', b'0'))
+
+    if store_version != STORE_VERSION or (bin_width is not None and store_bin_width != bin_width):
+        return None, bin_width
+
+    return table.to_pandas(), store_bin_width
+
+
+def plan_monthly_update(path: str, bin_width: int, restate_months=1):
+    """
+    Function to decide which stored months are kept as they are by the next update
+
+    Months already in the store are kept, except for the latest `restate_months` months, which
+    data.gov.sg publishes while still in progress and are therefore recomputed.
+
+    Args:
+        path [string]: path of the parquet store
+        bin_width [int]: width of a price bin in S$
+        restate_months [int]: number of trailing stored months to recompute
+
+    Returns:
+        df_keep [dataframe]: stored histogram rows to keep, None if the store is rebuilt from scratch
+
+    """
+    df_store, _ = load_monthly_store(path, bin_width)
+
+    if df_store is None or df_store.empty:
+        return None
+
+    first_month = int(df_store['month_ordinal'].max()) - restate_months + 1
+    return df_store.loc[df_store['month_ordinal'] < first_month]
+
+
+def delta_mask(months: np.ndarray, df_keep) -> np.ndarray:
+    """
+    Function to flag the transactions whose months are not kept in the store, such as restated months
+    or a back-filled historical file
+
+    Args:
+        months [np.ndarray]: month ordinals of the transactions
+        df_keep [dataframe]: output of `plan_monthly_update()`
+
+    Returns:
+        is_delta [np.ndarray]: True for the transactions to aggregate
+
+    """
+    if df_keep is None:
+        return np.ones(len(months), dtype=bool)
+    return ~np.isin(months, df_keep['month_ordinal'].unique())
+
+
+def combine_monthly(frames: list) -> pd.DataFrame:
+    """
+    Function to sum monthly histograms aggregated separately, e.g. batch by batch
+
+    Args:
+        frames [list]: outputs of `aggregate_monthly()` with the same bin width
+
+    Returns:
+        df_monthly [dataframe]: one row per (town, flat_type, month_ordinal, price_bin)
+
+    """
+    df_monthly = (pd.concat(frames, ignore_index=True)
+                  .groupby(GROUP_COLS + ['month_ordinal', 'price_bin'], sort=True, observed=True)[['count', 'price_sum']]
+                  .sum()
+                  .reset_index())
+    return df_monthly.astype({'month_ordinal': 'int16', 'price_bin': 'int32', 'count': 'int32'})
+
+
+def write_monthly_store(df_keep, df_monthly: pd.DataFrame, path: str, bin_width: int):
+    """
+    Function to write the kept and newly aggregated months as the monthly store
+
+    Args:
+        df_keep [dataframe]: output of `plan_monthly_update()`
+        df_monthly [dataframe]: histograms of the delta months
+        path [string]: path of the parquet store
+        bin_width [int]: width of a price bin in S$
+
+    """
+    if df_keep is not None:
+        df_monthly = pd.concat([df_keep, df_monthly], ignore_index=True).astype(df_monthly.dtypes.to_dict())
+
+    table = pa.Table.from_pandas(df_monthly, preserve_index=False)
+    table = table.replace_schema_metadata({'store_version': STORE_VERSION, 'bin_width': str(bin_width)})
+
+    # replaced atomically, as the store of the previous snapshot may be linked at the same path
+    tmp_path = f'{path}.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def update_monthly_store(df: pd.DataFrame, path: str, bin_width: int, restate_months=1) -> dict:
+    """
+    Function to fold newly arrived months of transactions into the monthly store
+
+    Only the transactions of months not kept by `plan_monthly_update()` are aggregated.
+
+    Args:
+        df [dataframe]: transactions with `town`, `flat_type`, `month_ordinal` and `resale_price` columns
+        path [string]: path of the parquet store
+        bin_width [int]: width of a price bin in S$
+        restate_months [int]: number of trailing stored months to recompute
+
+    Returns:
+        summary [dict]: number of months recomputed and of transactions aggregated
+
+    """
+    df_keep = plan_monthly_update(path, bin_width, restate_months)
+
+    # only the delta of transactions is aggregated
+    df_delta = df.loc[delta_mask(df['month_ordinal'].to_numpy(), df_keep)]
+    write_monthly_store(df_keep, aggregate_monthly(df_delta, bin_width), path, bin_width)
+
+    return {'months_updated': int(df_delta['month_ordinal'].nunique()), 'rows_aggregated': len(df_delta)}
+
+
+def _window_medians(df_group: pd.DataFrame, months: np.ndarray, window: int, bin_width: int) -> np.ndarray:
+    """
+    Function to estimate rolling medians of one series from its monthly price histograms
+
+    Args:
+        df_group [dataframe]: histogram rows of the series
+        months [np.ndarray]: contiguous month ordinals to evaluate
+        window [int]: rolling window in months
+        bin_width [int]: width of a price bin in S$
+
+    Returns:
+        medians [np.ndarray]: median resale price per month, NaN for windows without transactions
+
+    """
+    first_bin = df_group['price_bin'].min()
+    n_bins = df_group['price_bin'].max() - first_bin + 1
+
+    # dense months x bins histogram of this series only
+    hist = np.zeros((len(months), n_bins), dtype='int64')
+    np.add.at(
+        hist,
+        (df_group['month_ordinal'].to_numpy() - months[0], df_group['price_bin'].to_numpy() - first_bin),
+        df_group['count'].to_numpy()
+    )
+
+    # rolling window sums through a cumulative sum over months
+    cum_months = np.cumsum(hist, axis=0)
+    windowed = cum_months.copy()
+    windowed[window:] -= cum_months[:-window]
+
+    return histogram_medians(windowed, first_bin, bin_width)
+
+
+def histogram_medians(hist: np.ndarray, first_bin: int, bin_width: int) -> np.ndarray:
+    """
+    Function to estimate the medians of price histograms, one histogram per row
+
+    Args:
+        hist [np.ndarray]: 2-D array of transaction counts, rows by contiguous price bins
+        first_bin [int]: price bin of the first column
+        bin_width [int]: width of a price bin in S$
+
+    Returns:
+        medians [np.ndarray]: median resale price per row, NaN for rows without transactions
+
+    """
+    n_bins = hist.shape[1]
+    cum_bins = np.cumsum(hist, axis=1)
+    total = cum_bins[:, -1]
+    rows = np.arange(len(hist))
+
+    def rank_value(rank):
+        # locate the bin holding the transaction of this rank, then spread the bin's transactions evenly over it
+        rank_bin = np.minimum((cum_bins < rank[:, None]).sum(axis=1), n_bins - 1)
+        below = np.where(rank_bin > 0, cum_bins[rows, rank_bin - 1], 0)
+        in_bin = np.maximum(hist[rows, rank_bin], 1)
+        return first_bin + rank_bin + (rank - below - 0.5) / in_bin
+
+    # the median is the middle transaction, or the mean of the two middle ones for an even count
+    medians = (rank_value(np.floor((total + 1) / 2)) + rank_value(np.ceil((total + 1) / 2))) / 2 * bin_width
+
+    return np.where(total > 0, medians, np.nan)
+
+
+def rolling_medians(df_monthly: pd.DataFrame, bin_width: int, windows=(3, 6, 12), by='town',
+                    towns=None, flat_types=None, start_month=None, end_month=None) -> pd.DataFrame:
+    """
+    Function to serve rolling median resale prices from the monthly store
+
+    Args:
+        df_monthly [dataframe]: monthly histogram rows from `load_monthly_store()`
+        bin_width [int]: width of a price bin in S$
+        windows [tuple]: rolling windows in months
+        by [string]: 'town', 'flat_type' or None for one series over all selected rows
+        towns [list]: towns to include, None for all
+        flat_types [list]: flat types to include, None for all
+        start_month [int]: first month ordinal to report, None for the first stored month
+        end_month [int]: last month ordinal to report, None for the last stored month
+
+    Returns:
+        df_rolling [dataframe]: one row per (series, month) with `month`, `month_ordinal`, and a
+            `median_{window}m` column per window
+
+    """
+    mask = np.ones(len(df_monthly), dtype=bool)
+    if towns is not None:
+        mask &= df_monthly['town'].isin(towns).to_numpy()
+    if flat_types is not None:
+        mask &= df_monthly['flat_type'].isin(flat_types).to_numpy()
+    df_sel = df_monthly.loc[mask]
+
+    if df_sel.empty:
+        return pd.DataFrame(columns=['series', 'month', 'month_ordinal'] + [f'median_{w}m' for w in windows])
+
+    # windows need the months before `start_month` too, so evaluate from the first stored month
+    months = np.arange(df_sel['month_ordinal'].min(), df_sel['month_ordinal'].max() + 1)
+    groups = df_sel.groupby(by, observed=True) if by else [('ALL', df_sel)]
+
+    frames = []
+    for name, df_group in groups:
+        df_series = pd.DataFrame({'series': name, 'month_ordinal': months.astype('int16')})
+        for window in windows:
+            df_series[f'median_{window}m'] = _window_medians(df_group, months, window, bin_width)
+        frames.append(df_series)
+    df_rolling = pd.concat(frames, ignore_index=True)
+
+    if start_month is not None:
+        df_rolling = df_rolling.loc[df_rolling['month_ordinal'] >= start_month]
+    if end_month is not None:
+        df_rolling = df_rolling.loc[df_rolling['month_ordinal'] <= end_month]
+
+    df_rolling.insert(1, 'month', ordinal_to_month(df_rolling['month_ordinal']))
+
+    return df_rolling.reset_index(drop=True)
+
+
+def price_index(df_rolling: pd.DataFrame, window: int, base_month=None) -> pd.DataFrame:
+    """
+    Function to rebase rolling medians into a price index, 100 at the base month of each series
+
+    Args:
+        df_rolling [dataframe]: output of `rolling_medians()`
+        window [int]: rolling window whose medians are indexed
+        base_month [int]: month ordinal of the base period, None for each series' first month with data
+
+    Returns:
+        df_index [dataframe]: `series`, `month`, `month_ordinal` and `price_index` columns
+
+    """
+    col = f'median_{window}m'
+    df_index = df_rolling[['series', 'month', 'month_ordinal', col]].dropna(subset=[col])
+
+    if base_month is None:
+        base = df_index.groupby('series')[col].transform('first')
+    else:
+        base_values = df_index.loc[df_index['month_ordinal'] == base_month].set_index('series')[col]
+        base = df_index['series'].map(base_values)
+
+    df_index = df_index.assign(price_index=(df_index[col] / base * 100).round(1))
+
+    return df_index.drop(columns=[col]).dropna(subset=['price_index'])
+
@@ -1,13 +1,48 @@
+import os
 import pandas as pd
 import glob
+import pyarrow as pa
+import pyarrow.parquet as pq
 import streamlit as st
+from .lease import parse_lease_months, lease_months_to_years
+from .features import BASE_YEAR, month_ordinal
+from .validation import REQUIRED_COLS
+from .storage import DEFAULT_PROFILE, writer_options, sort_table
+
+# raw columns whose inferred type would otherwise change from one file, or one batch, to the next
+CSV_DTYPES = {
+    'block': str,
+    'street_name': str,
+    'storey_range': str,
+    'floor_area_sqm': 'float64',
+    'remaining_lease': object
+}
+
+def list_csv_files(path) -> list:
+    """
+    Function to list the csv files matching a glob pattern, in name order so that address ids are assigned
+    alike in every ETL mode
+
+    Args:
+        path [string]: glob pattern of the csv files, e.g. etl.csv_path
+
+    Returns:
+        fnames [list]: paths of the matching files
+
+    """
+    fnames = sorted(glob.glob(path))
+    if not fnames:
+        raise ValueError(f"no csv files match '{path}', check etl.csv_path in config.yml")
+    return fnames
+
 
-def read_concat_csv_to_df(path):
+def read_concat_csv_to_df(path, dtype=CSV_DTYPES):
     """
     Function to read all csv in a folder and concat them into a single pandas dataframe
 
     Args:
         path [string]: path where csv files are located
+        dtype [dict]: column types passed to `pd.read_csv()`, None to infer every type
 
     Returns:
         df_total [dataframe]: pandas dataframe after concat
@@ -17,52 +52,133 @@ def read_concat_csv_to_df(path):
     df_lst = []
 
     # iterate through folder of csv
-    for fname in glob.glob(path): 
-        df_raw = pd.read_csv(fname) # read csv into pandas df
+    for fname in list_csv_files(path):
+        df_raw = pd.read_csv(fname, dtype=dtype) # read csv into pandas df
         df_lst.append(df_raw) # append df into list
 
     return pd.concat(df_lst)
 
 
-def transform(df_bef: pd.DataFrame) -> pd.DataFrame:
+def iter_csv_batches(path, batch_size):
+    """
+    Function to read all csv in a folder as a stream of dataframes of at most `batch_size` rows
+
+    Args:
+        path [string]: path where csv files are located
+        batch_size [int]: maximum number of rows per batch
+
+    Yields:
+        df_batch [dataframe]: the next batch of rows, never spanning two files
+
+    """
+    for fname in list_csv_files(path):
+        with pd.read_csv(fname, dtype=CSV_DTYPES, chunksize=batch_size) as reader:
+            for df_batch in reader:
+                yield df_batch
+
+
+class ParquetBatchWriter:
+    """
+    Writes dataframes to a parquet file batch by batch, so that the whole dataset never has to be in memory
+
+    The file is written under a temporary name and only moved into place on a successful close, so
+    readers never see a partially written artifact. Every batch is cast to the schema of the first.
+
+    Args:
+        path_filename [string]: path and filename of the parquet file
+        profile [dict]: optional storage profile from `storage.storage_profile()`; rows are sorted within each
+            batch, since the whole dataset is never in memory
+    """
+
+    def __init__(self, path_filename, profile=None):
+        self.path_filename = path_filename
+        self.tmp_filename = f'{path_filename}.tmp'
+        self.profile = profile or DEFAULT_PROFILE
+        self.writer = None
+        self.rows = 0
+
+    def write(self, df_batch: pd.DataFrame):
+        schema = self.writer.schema if self.writer is not None else None
+        self.write_table(pa.Table.from_pandas(df_batch, schema=schema, preserve_index=False))
+
+    def write_table(self, table: pa.Table):
+        """
+        Function to write a batch already converted to Arrow, e.g. by a worker process
+        """
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.tmp_filename, table.schema,
+                                           **writer_options(self.profile, table.schema))
+        else:
+            # files publish their columns in different orders, so they are matched by name
+            table = table.select(self.writer.schema.names).cast(self.writer.schema)
+        self.writer.write_table(sort_table(table, self.profile), row_group_size=self.profile['row_group_size'])
+        self.rows += table.num_rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.writer is not None:
+            self.writer.close()
+            if exc_type is None:
+                os.replace(self.tmp_filename, self.path_filename)
+            else:
+                os.remove(self.tmp_filename)
+
+
+def transform(df_bef: pd.DataFrame, validator=None, addresses=None) -> pd.DataFrame:
     """
     Function to apply transformation to the datasets
 
     Args:
         df_bef [dataframe]: pandas dataframe that require transformation
+        validator [Validator]: optional `src.validation.Validator`; rows failing its checks are left out
+            of the result and set aside in the validator for the quarantine file
+        addresses [AddressIndex]: optional `src.address.AddressIndex`; the block and street name of each
+            transaction are replaced by the int32 id of its address, added to the index if new
 
     Returns:
         df_aft [dataframe]: pandas dataframe after applying transformation
-    
-    """
-    list_cols = ['remaining_lease','block','full_address','street_name','year','resale_price','flat_type','lease_commence_date']
-    result = any(item in df_bef.columns for item in list_cols)
 
-    if result is True:
+    Raises:
+        ValueError: if the dataframe does not have the necessary columns
 
-        # convert string values of `remaining_lease` into years, rounded off to the nearest integer
-        df_bef['remaining_lease'] = df_bef['remaining_lease'].apply(lambda x: convert_to_year_num(x) if isinstance(x,str) else x)
+    """
+    missing_cols = [col for col in REQUIRED_COLS if col not in df_bef.columns]
+    if missing_cols:
+        raise ValueError(f"dataframe does not have the necessary columns, missing {missing_cols}")
 
-        # combine block and street name as new address column and drop these columns
-        df_bef['full_address'] = df_bef['block'] + ' ' + df_bef['street_name']
-        df_bef['search_address'] = df_bef['block'] + '+' + df_bef['street_name'].str.replace(' ', '+') + '+SINGAPORE'    
+    # parse every format of `remaining_lease` into months in a single vectorized pass
+    if 'remaining_lease' in df_bef.columns:
+        lease_months = parse_lease_months(df_bef['remaining_lease'])
+    else:
+        lease_months = pd.Series(pd.NA, index=df_bef.index, dtype='Int16')
 
-        # drop irrelevant columns
-        df_aft = df_bef.drop(['block','street_name'],axis=1)
+    ordinal = month_ordinal(df_bef['month'])
 
-        # create year column
-        df_aft['year'] = df_aft['month'].apply(lambda x: int(x.split('-')[0]))
+    # clean value
+    df_bef['flat_type'] = df_bef['flat_type'].replace('MULTI GENERATION','MULTI-GENERATION')
 
-        # convert resale_price column to integer
-        df_aft['resale_price'] = df_aft['resale_price'].apply(lambda x: int(x))
+    # validate on the columns parsed above, so that validation adds no second pass over the raw text
+    if validator is not None:
+        is_valid = validator.check(df_bef, month_ordinal=ordinal, lease_months=lease_months)
+        if not is_valid.all():
+            df_bef = df_bef.loc[is_valid].copy()
+            ordinal, lease_months = ordinal[is_valid], lease_months[is_valid]
 
-        # clean value
-        df_aft['flat_type'] = df_aft['flat_type'].replace('MULTI GENERATION','MULTI-GENERATION')
+    # addresses are kept once in the address dimension, transactions only refer to them by id
+    df_aft = addresses.attach(df_bef) if addresses is not None else df_bef
 
-        df_aft['remaining_lease'] = df_aft['remaining_lease'].fillna(99-(df_aft['year']-df_aft['lease_commence_date']))
+    # create year column
+    df_aft['year'] = (ordinal // 12 + BASE_YEAR).astype('int64')
 
-    else:
-        print("dataframe does not have the necessary columns")
+    # convert resale_price column to integer
+    df_aft['resale_price'] = df_aft['resale_price'].astype('int64')
+
+    # fill missing leases from the 99-year lease commencement, then derive the rounded years from the months
+    lease_months = lease_months.fillna(12 * (99 - (df_aft['year'] - df_aft['lease_commence_date'])))
+    df_aft['remaining_lease_months'] = lease_months.astype('int16')
+    df_aft['remaining_lease'] = lease_months_to_years(df_aft['remaining_lease_months'])
 
     return df_aft
 
@@ -84,7 +200,7 @@ def convert_to_year_num(val):
     # Check if the string only contains a year value (e.g. '56 years')
     if len(str_lst) <= 2:
         # Convert the year value to an integer and return it
-        return int(str_lst[0],0)
+        return int(str_lst[0])
     
     # If the string contains a year and month value (e.g. '68 years 03 months'),
     # convert the year value to an integer and add the fractional value of months
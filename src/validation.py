@@ -0,0 +1,247 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+# columns every resale dataset must have; `remaining_lease` is only published from 2015 onwards
+REQUIRED_COLS = ['month', 'town', 'flat_type', 'block', 'street_name', 'storey_range', 'floor_area_sqm',
+                 'flat_model', 'lease_commence_date', 'resale_price']
+ADDRESS_COLS = ['block', 'street_name']
+
+
+def load_schema(metadata_file: str) -> dict:
+    """
+    Function to read the column types published in the data.gov.sg metadata file
+
+    Resources list their own schema; a column is numeric only if every resource publishes it as numeric,
+    e.g. `remaining_lease` is numeric up to 2016 and text afterwards.
+
+    Args:
+        metadata_file [string]: path of the metadata file
+
+    Returns:
+        schema [dict]: column name to a dict with its `type`, and `format` for datetime columns
+
+    """
+    with open(metadata_file, encoding="utf-8", mode='r') as metafile:
+        metadata = yaml.safe_load(metafile)
+
+    schema = {}
+    for resource in metadata['Resources']:
+        for field in resource['Schema']:
+            col = {'type': field['Type'], 'format': field.get('Format')}
+            if field['Name'] in schema and schema[field['Name']]['type'] != col['type']:
+                col['type'] = 'text'
+            schema[field['Name']] = col
+
+    return schema
+
+
+class Validator:
+    """
+    Row-level validation of resale transactions, run inside `transform()` on the columns it parses anyway
+
+    Rows failing any check are removed from the dataset and kept, with the names of the failed checks
+    in an `issues` column, for the quarantine file. Counts accumulate over every batch validated.
+
+    Args:
+        schema [dict]: column types, from `load_schema()`
+        ranges [dict]: column name to [min, max], inclusive
+        enumerations [dict]: column name to the list of allowed values, compared case-insensitively
+        coordinates [dict]: `lat` and `lon` as [min, max] bounding boxes of Singapore
+    """
+
+    def __init__(self, schema: dict, ranges=None, enumerations=None, coordinates=None):
+        self.schema = schema
+        self.ranges = ranges or {}
+        self.enumerations = {col: set(str(value).upper() for value in values)
+                             for col, values in (enumerations or {}).items()}
+        self.coordinates = coordinates
+        self.config = None
+        self.rows_checked = 0
+        self.issue_counts = {}
+        self.quarantined = []
+
+    @classmethod
+    def from_config(cls, cfg: dict):
+        """
+        Function to create a validator from the `validation` section of config.yml
+        """
+        validator = cls(
+            load_schema(cfg['metadata_file']),
+            ranges=cfg.get('ranges'),
+            enumerations=cfg.get('enumerations'),
+            coordinates=cfg.get('coordinates')
+        )
+        # kept so that worker processes can create their own validator, see src.parallel
+        validator.config = cfg
+        return validator
+
+    def _enum_issue(self, values: pd.Series, allowed: set) -> np.ndarray:
+        # a column holds only a few dozen distinct values, so each is looked up once
+        codes, uniques = pd.factorize(values)
+        unique_ok = np.array([str(value).upper() in allowed for value in uniques] + [False])
+        return ~unique_ok[codes]
+
+    def check(self, df: pd.DataFrame, month_ordinal: pd.Series, lease_months: pd.Series) -> np.ndarray:
+        """
+        Function to validate a batch of raw transactions, coercing numeric columns in place
+
+        Args:
+            df [dataframe]: raw transactions with the `REQUIRED_COLS` columns; missing values
+                of enumerated columns are reported by their enumeration check
+            month_ordinal [series]: parsed months, -1 where unparseable
+            lease_months [series]: parsed `remaining_lease`, <NA> where missing or unparseable
+
+        Returns:
+            is_valid [np.ndarray]: True for the rows that passed every check
+
+        """
+        issues = {}
+
+        for col, spec in self.schema.items():
+            if col not in df.columns or col == 'remaining_lease':
+                continue
+            if spec['type'] == 'numeric' or spec.get('format') == 'YYYY':
+                # numbers stored as text are coerced, anything else becomes NaN
+                if not pd.api.types.is_numeric_dtype(df[col]):
+                    df[col] = pd.to_numeric(df[col], errors='coerce')
+                issues[f'type_{col}'] = df[col].isna().to_numpy()
+            elif spec['type'] == 'text' and col not in self.enumerations and col not in ADDRESS_COLS:
+                issues[f'missing_{col}'] = df[col].isna().to_numpy()
+
+        # a missing block or street name leaves the address unknown, one check covers both
+        if all(col in df.columns for col in ADDRESS_COLS):
+            issues['missing_address'] = df[ADDRESS_COLS].isna().any(axis=1).to_numpy()
+
+        issues['type_month'] = month_ordinal.to_numpy() < 0
+
+        if 'remaining_lease' in df.columns:
+            issues['type_remaining_lease'] = (df['remaining_lease'].notna() & lease_months.isna()).to_numpy()
+
+        for col, (low, high) in self.ranges.items():
+            values = lease_months if col == 'remaining_lease_months' else df.get(col)
+            if values is not None:
+                values = values.to_numpy(dtype='float64', na_value=np.nan)
+                issues[f'range_{col}'] = (values < low) | (values > high)
+
+        for col, allowed in self.enumerations.items():
+            if col in df.columns:
+                issues[f'enum_{col}'] = self._enum_issue(df[col], allowed)
+
+        return self._record(df, issues)
+
+    def check_coordinates(self, df: pd.DataFrame, lat_col='Lat', lon_col='Lon') -> np.ndarray:
+        """
+        Function to validate geocoded transactions, whose coordinates must fall within Singapore
+
+        Args:
+            df [dataframe]: geocoded transactions
+            lat_col [string]: name of the latitude column
+            lon_col [string]: name of the longitude column
+
+        Returns:
+            is_valid [np.ndarray]: True for the rows geocoded within Singapore
+
+        """
+        lat = df[lat_col].to_numpy(dtype='float64', na_value=np.nan)
+        lon = df[lon_col].to_numpy(dtype='float64', na_value=np.nan)
+        (lat_min, lat_max), (lon_min, lon_max) = self.coordinates['lat'], self.coordinates['lon']
+
+        issues = {
+            'missing_coordinates': np.isnan(lat) | np.isnan(lon),
+            'coordinates_outside_singapore': (lat < lat_min) | (lat > lat_max) | (lon < lon_min) | (lon > lon_max)
+        }
+        return self._record(df, issues)
+
+    def _record(self, df: pd.DataFrame, issues: dict) -> np.ndarray:
+        """
+        Function to count the failed checks and set the offending rows aside for the quarantine file
+        """
+        is_invalid = np.zeros(len(df), dtype=bool)
+        for name, mask in issues.items():
+            count = int(mask.sum())
+            if count:
+                self.issue_counts[name] = self.issue_counts.get(name, 0) + count
+                is_invalid |= mask
+
+        self.rows_checked += len(df)
+
+        if is_invalid.any():
+            df_bad = df.loc[is_invalid].copy()
+            names = np.array(list(issues))
+            flags = np.column_stack([issues[name][is_invalid] for name in names])
+            df_bad['issues'] = [';'.join(names[row]) for row in flags]
+            self.quarantined.append(df_bad)
+
+        return ~is_invalid
+
+    def summary(self) -> dict:
+        """
+        Function to summarise the validation of every batch
+
+        Returns:
+            summary [dict]: rows checked and quarantined, and the number of rows failing each check
+        """
+        rows_quarantined = sum(len(df_bad) for df_bad in self.quarantined)
+        return {
+            'rows_checked': self.rows_checked,
+            'rows_quarantined': rows_quarantined,
+            'quarantine_rate': round(rows_quarantined / self.rows_checked, 6) if self.rows_checked else 0.0,
+            'issues': dict(sorted(self.issue_counts.items(), key=lambda item: -item[1]))
+        }
+
+    def quarantine_frame(self):
+        """
+        Function to gather the quarantined rows of every batch into one dataframe
+
+        Returns:
+            df_quarantine [dataframe]: quarantined rows with an `issues` column, None if every row passed
+        """
+        if not self.quarantined:
+            return None
+
+        # raw columns may hold mixed types in bad rows, so they are stored as text
+        df_quarantine = pd.concat(self.quarantined, ignore_index=True)
+        return df_quarantine.astype({col: str for col in df_quarantine.columns if df_quarantine[col].dtype == object})
+
+    def merge(self, rows_checked: int, issue_counts: dict, df_quarantine=None):
+        """
+        Function to add the counts and quarantined rows of a validator run in another process
+
+        Args:
+            rows_checked [int]: number of rows the other validator checked
+            issue_counts [dict]: number of rows failing each check
+            df_quarantine [dataframe]: output of the other validator's `quarantine_frame()`
+        """
+        self.rows_checked += rows_checked
+        for name, count in issue_counts.items():
+            self.issue_counts[name] = self.issue_counts.get(name, 0) + count
+        if df_quarantine is not None:
+            self.quarantined.append(df_quarantine)
+
+    def write(self, quarantine_file: str, report_file: str) -> dict:
+        """
+        Persist the quarantined rows as parquet and the summary as a JSON report
+
+        Args:
+            quarantine_file [string]: path of the quarantine parquet file, replaced on every run
+            report_file [string]: path of the JSON report
+
+        Returns:
+            summary [dict]: output of `summary()`
+        """
+        summary = self.summary()
+        df_quarantine = self.quarantine_frame()
+
+        if df_quarantine is not None:
+            df_quarantine.to_parquet(quarantine_file, index=False)
+        elif os.path.exists(quarantine_file):
+            os.remove(quarantine_file)
+
+        with open(report_file, encoding="utf-8", mode='w') as reportfile:
+            json.dump(summary, reportfile, indent=2)
+
+        return summary
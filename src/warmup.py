@@ -0,0 +1,192 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from . import query
+from .config import load_config
+from .serving import dataset_version, load_serving_dataset
+from .snapshot import current_path
+
+# aggregations the EDA pages request on first paint, in the query spec format of src.query
+PAGE_AGGREGATIONS = (
+    [{'type': 'count', 'by': col} for col in ('town', 'flat_type', 'storey_range', 'flat_model', 'month')]
+    + [{'type': 'agg', 'by': col, 'value': 'resale_price'}
+       for col in ('year', 'month', 'town', 'flat_type', 'storey_range', 'floor_area_sqm', 'remaining_lease')]
+)
+
+INDEX_FILE = 'index.json'
+
+
+def default_filters(years, num_years=11) -> dict:
+    """
+    Function to build the filters of the default sidebar state: the last `num_years` years and every
+    town, flat type and flat model
+
+    Args:
+        years [array]: years present in the dataset
+        num_years [int]: number of years covered by the default year range
+
+    Returns:
+        filters [dict]: filters in the query spec format of src.query
+    """
+    years = np.sort(np.unique(years))
+    return {
+        'start_year': int(years[-min(num_years, len(years))]),
+        'end_year': int(years.max()),
+        'flat_type': [],
+        'town': [],
+        'flat_model': []
+    }
+
+
+def build_warmup_store(df: pd.DataFrame, store_path: str, version: str, views=(), num_years=11, keep=3) -> int:
+    """
+    Function to precompute the page aggregations of the default view and of popular filter combinations,
+    and persist them as one parquet file per result with a JSON index, in a directory of the store per version
+
+    The results are written to a directory unique to the process and renamed into place once complete, so that
+    readers never see a partial version and concurrent builds do not write over each other; the versions beyond
+    the `keep` most recently built ones are then removed, never the one just built.
+
+    Args:
+        df [dataframe]: the prepared dataset
+        store_path [string]: directory of the store
+        version [string]: version of the dataset the results are computed from, see `serving.dataset_version()`
+        views [list]: popular filter combinations, each overriding the default filters, e.g. {'town': ['BEDOK']}
+        num_years [int]: number of years covered by the default year range
+        keep [int]: number of versions kept, so that app processes still serving an older snapshot find theirs
+
+    Returns:
+        num_results [int]: number of results persisted
+    """
+    defaults = default_filters(df['year'].unique(), num_years)
+    index = {'version': version, 'results': {}}
+
+    version_path = os.path.join(store_path, version)
+    tmp_path = os.path.join(store_path, f'.{version}.{os.getpid()}.tmp')
+    old_path = os.path.join(store_path, f'.{version}.{os.getpid()}.old')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    try:
+        for view in [{}] + list(views or []):
+            filters = {**defaults, **view}
+            # each view is filtered once and shared by all of its aggregations
+            df_sel = query.filter_rows(df, filters)
+            for aggregation in PAGE_AGGREGATIONS:
+                key = query.spec_key({'filters': filters, 'aggregation': aggregation})
+                df_result = query.run_query(df_sel, {'aggregation': aggregation})
+                # parquet requires string column names
+                df_result.columns = [str(col) for col in df_result.columns]
+                df_result.to_parquet(os.path.join(tmp_path, f'{key}.parquet'), index=False)
+                index['results'][key] = {'filters': filters, 'aggregation': aggregation}
+
+        # the index is written last, a version directory without one is incomplete
+        with open(os.path.join(tmp_path, INDEX_FILE), encoding="utf-8", mode='w') as indexfile:
+            json.dump(index, indexfile, indent=2)
+
+        # a version built before, e.g. with other popular views, is moved aside first: readers in between find
+        # no results for the version and compute the views on demand
+        try:
+            os.rename(version_path, old_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rename(tmp_path, version_path)
+        except OSError:
+            # another process published the same version in between, its results are as recent
+            if not os.path.exists(os.path.join(version_path, INDEX_FILE)):
+                raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    prune_warmup_store(store_path, keep=keep, current=version)
+
+    return len(index['results'])
+
+
+def prune_warmup_store(store_path: str, keep=3, current=None) -> list:
+    """
+    Function to remove the versions of the store beyond the `keep` most recently built ones
+
+    Args:
+        store_path [string]: directory of the store
+        keep [int]: number of versions kept
+        current [string]: version never removed, e.g. the one just built
+
+    Returns:
+        removed [list]: removed versions
+    """
+    # directories being built are hidden, and left to the process building them; files are results of the former
+    # layout of a single version at the top of the store
+    versions = {}
+    for entry in os.scandir(store_path):
+        # another process may be pruning at the same time
+        try:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                versions[entry.name] = entry.stat().st_mtime_ns
+            else:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            continue
+
+    removed = [version for version in sorted(versions, key=versions.get, reverse=True)[keep:] if version != current]
+    for version in removed:
+        shutil.rmtree(os.path.join(store_path, version), ignore_errors=True)
+    return removed
+
+
+def load_warmup_store(store_path: str, version: str) -> dict:
+    """
+    Function to load the results precomputed from the given dataset version
+
+    Args:
+        store_path [string]: directory of the store
+        version [string]: current version of the dataset
+
+    Returns:
+        results [dict]: spec key to result dataframe, None if the version is missing from the store or only
+            partly readable, e.g. pruned while loading
+    """
+    if version is None:
+        return None
+
+    version_path = os.path.join(store_path, version)
+    try:
+        with open(os.path.join(version_path, INDEX_FILE), encoding="utf-8", mode='r') as indexfile:
+            index = json.load(indexfile)
+        return {key: pd.read_parquet(os.path.join(version_path, f'{key}.parquet')) for key in index['results']}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def main():
+    """
+    Rebuild the warm-up store from the current artifacts, e.g. after editing the popular views in config.yml
+    """
+    cfg = load_config()
+    artifacts_path = cfg['etl']['artifacts_path']
+    serving_file = cfg['serving']['artifact_file']
+    warmup_cfg = cfg['warmup']
+
+    snapshot_path = current_path(artifacts_path)
+    path_filename = f'{snapshot_path}/hdb_resale.parquet'
+    num_results = build_warmup_store(
+        load_serving_dataset(f'{snapshot_path}/{serving_file}'),
+        f"{artifacts_path}/{warmup_cfg['store_path']}",
+        dataset_version(path_filename),
+        views=warmup_cfg['views'],
+        num_years=warmup_cfg['default_years'],
+        keep=warmup_cfg['keep']
+    )
+    print(f"Precomputed {num_results} results in {artifacts_path}/{warmup_cfg['store_path']}")
+
+
+if __name__ == "__main__":
+    main()